@@ -0,0 +1,354 @@
+"""Minimal stand-in for Blender's ``bpy`` module.
+
+Only covers what the addon touches on its hot paths, so they can be timed
+under plain CPython. ``install()`` registers the fake modules in
+``sys.modules``; it has to run before ``mqtt_nodes`` is imported.
+"""
+
+import sys
+import types
+
+
+class _Property:
+    """Result of a bpy.props.*Property() call, keeps the keyword arguments"""
+
+    def __init__(self, kind, **kwargs):
+        self.kind = kind
+        self.kwargs = kwargs
+
+    def default(self):
+        if self.kind == 'CollectionProperty':
+            return PropCollection(self.kwargs.get("type"))
+        if self.kind == 'PointerProperty':
+            prop_type = self.kwargs.get("type")
+            if isinstance(prop_type, type) and issubclass(prop_type, PropertyGroup):
+                return prop_type()
+            return None
+        if "default" in self.kwargs:
+            return self.kwargs["default"]
+        return {
+            'StringProperty': "",
+            'BoolProperty': False,
+            'IntProperty': 0,
+            'FloatProperty': 0.0,
+            'EnumProperty': None,
+        }.get(self.kind)
+
+
+def _property_factory(kind):
+    def factory(**kwargs):
+        return _Property(kind, **kwargs)
+    factory.__name__ = kind
+    return factory
+
+
+class PropertyGroup:
+    """Instances get the defaults of their annotated properties"""
+
+    def __init__(self):
+        for cls in reversed(type(self).__mro__):
+            for name, prop in getattr(cls, "__annotations__", {}).items():
+                if isinstance(prop, _Property):
+                    setattr(self, name, prop.default())
+
+
+class PropCollection(list):
+    """bpy_prop_collection with add() and remove() like CollectionProperty"""
+
+    def __init__(self, item_type=None, items=()):
+        super().__init__(items)
+        self._item_type = item_type
+
+    def add(self):
+        item = self._item_type()
+        self.append(item)
+        return item
+
+    def remove(self, index):
+        del self[index]
+
+
+class IDCollection(list):
+    """bpy.data collection, indexable by name"""
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            for item in self:
+                if item.name == key:
+                    return item
+            raise KeyError(f'bpy_prop_collection[key]: key "{key}" not found')
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+class ID:
+
+    def __init__(self, name):
+        self.name = name
+        self.animation_data = None
+        self._props = {}
+
+    def __getitem__(self, key):
+        return self._props[key]
+
+    def __setitem__(self, key, value):
+        if isinstance(value, (list, tuple)):
+            value = list(value)
+        self._props[key] = value
+
+    def __contains__(self, key):
+        return key in self._props
+
+    def get(self, key, default=None):
+        return self._props.get(key, default)
+
+    def update_tag(self):
+        pass
+
+    def as_pointer(self):
+        return id(self)
+
+
+class Scene(ID):
+
+    def __init__(self, name="Scene"):
+        super().__init__(name)
+        self.frame_current = 1
+        self.render = types.SimpleNamespace(fps=24, fps_base=1.0)
+        self.frame_start = 1
+
+
+class Object(ID):
+
+    def __init__(self, name, data=None):
+        super().__init__(name)
+        self.data = data
+        self.location = [0.0, 0.0, 0.0]
+        self.rotation_euler = [0.0, 0.0, 0.0]
+
+
+class DriverTarget:
+
+    def __init__(self, data_path="", id_type='SCENE'):
+        self.data_path = data_path
+        self.id_type = id_type
+
+
+class DriverVariable:
+
+    def __init__(self, name, data_path):
+        self.name = name
+        self.targets = [DriverTarget(data_path)]
+
+
+class Driver:
+
+    def __init__(self, expression, variables=()):
+        self.expression = expression
+        self.variables = list(variables)
+
+
+class FCurve:
+
+    def __init__(self, data_path, driver):
+        self.data_path = data_path
+        self.driver = driver
+
+
+class AnimData:
+
+    def __init__(self):
+        self.drivers = []
+
+
+class NodeGroup(ID):
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.nodes = []
+
+
+class AttributeElement:
+
+    def __init__(self, attribute, index):
+        self._attribute = attribute
+        self._index = index
+
+    def _get(self):
+        a = self._attribute
+        w = a.width
+        values = a.flat[self._index * w:(self._index + 1) * w]
+        return values[0] if w == 1 else tuple(values)
+
+    value = property(_get)
+    vector = property(_get)
+    color = property(_get)
+
+
+class AttributeData:
+
+    def __init__(self, attribute):
+        self._attribute = attribute
+
+    def __len__(self):
+        return self._attribute.count
+
+    def __getitem__(self, index):
+        if index >= self._attribute.count:
+            raise IndexError(index)
+        return AttributeElement(self._attribute, index)
+
+    def foreach_get(self, prop, buf):
+        buf[:] = self._attribute.flat
+
+    def foreach_set(self, prop, buf):
+        self._attribute.flat[:] = buf
+
+
+# data_type -> components per element
+ATTRIBUTE_WIDTHS = {
+    'FLOAT': 1, 'INT': 1, 'BOOLEAN': 1, 'FLOAT2': 2,
+    'FLOAT_VECTOR': 3, 'FLOAT_COLOR': 4, 'BYTE_COLOR': 4,
+}
+
+
+class Attribute:
+
+    def __init__(self, name, data_type, count, flat=None, domain='POINT'):
+        self.name = name
+        self.data_type = data_type
+        self.domain = domain
+        self.width = ATTRIBUTE_WIDTHS[data_type]
+        self.count = count
+        if flat is None:
+            flat = [0.0] * (count * self.width)
+        self.flat = flat
+        self.data = AttributeData(self)
+
+
+class AttributeGroup(dict):
+
+    def new(self, name, data_type, domain):
+        attr = self[name] = Attribute(name, data_type, 0, domain=domain)
+        return attr
+
+    def __iter__(self):
+        return iter(self.values())
+
+
+class Mesh(ID):
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.attributes = AttributeGroup()
+
+    def update(self):
+        pass
+
+
+class Depsgraph:
+
+    def __init__(self, data):
+        self._data = data
+        self.updates = []
+
+    @property
+    def objects(self):
+        return self._data.objects
+
+
+class Context:
+
+    def __init__(self, data):
+        self.scene = None
+        self._depsgraph = Depsgraph(data)
+
+    def evaluated_depsgraph_get(self):
+        return self._depsgraph
+
+
+class Timers:
+
+    def __init__(self):
+        self._registered = {}
+
+    def register(self, function, first_interval=0.0, persistent=False):
+        self._registered[function] = first_interval
+
+    def unregister(self, function):
+        self._registered.pop(function, None)
+
+    def is_registered(self, function):
+        return function in self._registered
+
+
+def _persistent(function):
+    return function
+
+
+def install():
+    """Install the fake bpy modules and return the bpy module"""
+    if "bpy" in sys.modules:
+        return sys.modules["bpy"]
+
+    bpy = types.ModuleType("bpy")
+
+    props = types.ModuleType("bpy.props")
+    for kind in ('StringProperty', 'BoolProperty', 'IntProperty',
+                 'FloatProperty', 'EnumProperty', 'PointerProperty',
+                 'CollectionProperty', 'FloatVectorProperty'):
+        setattr(props, kind, _property_factory(kind))
+
+    bpy_types = types.ModuleType("bpy.types")
+    bpy_types.PropertyGroup = PropertyGroup
+    bpy_types.Panel = type("Panel", (), {})
+    bpy_types.Operator = type("Operator", (), {})
+    bpy_types.UIList = type("UIList", (), {})
+    bpy_types.ID = ID
+    bpy_types.Scene = Scene
+    bpy_types.Object = Object
+    bpy_types.Mesh = Mesh
+
+    app = types.ModuleType("bpy.app")
+    handlers = types.ModuleType("bpy.app.handlers")
+    handlers.persistent = _persistent
+    for name in ('load_pre', 'load_post', 'frame_change_pre',
+                 'frame_change_post', 'depsgraph_update_post', 'undo_post',
+                 'redo_post'):
+        setattr(handlers, name, [])
+    app.handlers = handlers
+    app.timers = Timers()
+    app.version = (4, 2, 0)
+
+    data = types.SimpleNamespace(
+        objects=IDCollection(),
+        scenes=IDCollection(),
+        shape_keys=IDCollection(),
+        node_groups=IDCollection(),
+        meshes=IDCollection(),
+        materials=IDCollection(),
+    )
+
+    utils = types.ModuleType("bpy.utils")
+    utils.register_class = lambda cls: None
+    utils.unregister_class = lambda cls: None
+
+    bpy.props = props
+    bpy.types = bpy_types
+    bpy.app = app
+    bpy.data = data
+    bpy.utils = utils
+    bpy.context = Context(data)
+
+    sys.modules["bpy"] = bpy
+    sys.modules["bpy.props"] = props
+    sys.modules["bpy.types"] = bpy_types
+    sys.modules["bpy.app"] = app
+    sys.modules["bpy.app.handlers"] = handlers
+    sys.modules["bpy.utils"] = utils
+    return bpy
@@ -0,0 +1,150 @@
+"""Stand-in for ``paho.mqtt.client`` that never touches the network.
+
+Publishes are counted and dropped, so the benchmarks measure the addon
+and not a broker.
+"""
+
+import socket
+import sys
+import types
+
+
+class MQTTMessageInfo:
+
+    def __init__(self, rc=0, mid=0):
+        self.rc = rc
+        self.mid = mid
+
+    def wait_for_publish(self, timeout=None):
+        pass
+
+    def is_published(self):
+        return True
+
+
+class MQTTMessage:
+
+    def __init__(self, topic, payload, properties=None):
+        self.topic = topic
+        self.payload = payload
+        self.properties = properties
+        self.qos = 0
+        self.retain = False
+
+
+class Client:
+
+    def __init__(self, *args, **kwargs):
+        self._userdata = None
+        self._connected = False
+        self.on_connect = None
+        self.on_message = None
+        self.on_disconnect = None
+        self.published = 0
+        self.bytes_published = 0
+        self.subscriptions = set()
+        self._sock = None
+
+    def user_data_set(self, userdata):
+        self._userdata = userdata
+
+    def connect(self, host, port=1883, keepalive=60, **kwargs):
+        self._connected = True
+        if self.on_connect:
+            self.on_connect(self, self._userdata, {}, 0)
+        return 0
+
+    def connect_async(self, host, port=1883, keepalive=60, **kwargs):
+        return self.connect(host, port, keepalive)
+
+    def reconnect(self):
+        self._connected = True
+        return 0
+
+    def disconnect(self):
+        self._connected = False
+        if self._sock is not None:
+            for sock in self._sock:
+                sock.close()
+            self._sock = None
+        return 0
+
+    def is_connected(self):
+        return self._connected
+
+    def subscribe(self, topic, qos=0, **kwargs):
+        # A filter or a list of (filter, qos or options) like paho
+        if isinstance(topic, list):
+            self.subscriptions.update(t for t, _ in topic)
+        else:
+            self.subscriptions.add(topic)
+        return 0, 0
+
+    def unsubscribe(self, topic, **kwargs):
+        if isinstance(topic, list):
+            self.subscriptions.difference_update(topic)
+        else:
+            self.subscriptions.discard(topic)
+        return 0, 0
+
+    def publish(self, topic, payload=None, qos=0, retain=False, **kwargs):
+        self.published += 1
+        if payload is not None:
+            self.bytes_published += len(payload)
+        return MQTTMessageInfo()
+
+    def loop(self, timeout=1.0):
+        return 0
+
+    def socket(self):
+        # A socket that never becomes readable, for the network selector
+        if not self._connected:
+            return None
+        if self._sock is None:
+            self._sock = socket.socketpair()
+        return self._sock[0]
+
+    def want_write(self):
+        return False
+
+    def loop_read(self, max_packets=1):
+        return 0 if self._connected else 4
+
+    def loop_write(self):
+        return 0 if self._connected else 4
+
+    def loop_misc(self):
+        return 0 if self._connected else 4
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def deliver(self, topic, payload, properties=None):
+        """Feed a message to on_message as if it came from the broker"""
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self.on_message(self, self._userdata,
+                        MQTTMessage(topic, payload, properties))
+
+
+def install():
+    """Install the fake paho modules and return the client module"""
+    if "paho.mqtt.client" in sys.modules:
+        return sys.modules["paho.mqtt.client"]
+    paho = types.ModuleType("paho")
+    paho_mqtt = types.ModuleType("paho.mqtt")
+    client = types.ModuleType("paho.mqtt.client")
+    client.Client = Client
+    client.MQTTMessage = MQTTMessage
+    client.MQTTMessageInfo = MQTTMessageInfo
+    client.MQTTv311 = 4
+    client.MQTTv5 = 5
+    paho.mqtt = paho_mqtt
+    paho_mqtt.client = client
+    sys.modules["paho"] = paho
+    sys.modules["paho.mqtt"] = paho_mqtt
+    sys.modules["paho.mqtt.client"] = client
+    return client
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+"""
+Headless benchmarks for the MQTT Nodes addon.
+
+Runs the addon's hot paths under plain CPython against the fake bpy and
+paho modules in this directory, on a synthetic scene with N inputs,
+M drivers, K output data paths and attribute outputs of the given sizes.
+Results are written as JSON, so runs of different versions can be
+compared.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--quick] [--output results.json]
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+import fake_bpy
+import fake_paho
+
+bpy = fake_bpy.install()
+fake_paho.install()
+
+import mqtt_nodes
+from mqtt_nodes import batch, codec, driver_utils, mqtt_connection
+from mqtt_nodes.transport import PahoTransport, loopback_broker
+from mqtt_nodes.filters import filter_engine
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+TOPIC_PREFIX = "/bl_prop_input/"
+
+
+def measure(function, setup=None, repeat=20, warmup=2):
+    """Time ``function`` ``repeat`` times, ``setup`` runs untimed before
+    every call"""
+    times = []
+    for i in range(warmup + repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            times.append(elapsed)
+    times.sort()
+    return {
+        "repeat": repeat,
+        "mean": statistics.fmean(times),
+        "min": times[0],
+        "max": times[-1],
+        "p50": times[len(times) // 2],
+        "p95": times[min(len(times) - 1, int(len(times) * 0.95))],
+    }
+
+
+def make_flat(count, width):
+    if np is not None:
+        return np.random.default_rng(0).random(count * width, dtype=np.float32)
+    import array
+    return array.array('f', [(i % 97) * 0.01 for i in range(count * width)])
+
+
+def build_scene(n_inputs, n_drivers, n_outputs, attribute_sizes):
+    """Create a fresh synthetic scene and make it the context scene"""
+    data = bpy.data
+    for collection in vars(data).values():
+        collection.clear()
+
+    scn = fake_bpy.Scene("Scene")
+    data.scenes.append(scn)
+    bpy.context.scene = scn
+    scn.mqtt_settings = mqtt_nodes.MQTTSettingsProp()
+    scn.mqtt_settings.topic_prefix = TOPIC_PREFIX
+    scn.mqtt_inputs = fake_bpy.PropCollection(mqtt_nodes.MQTTInputProp)
+    scn.mqtt_outputs = fake_bpy.PropCollection(mqtt_nodes.MQTTOutputProp)
+    scn.mqtt_attribute_outputs = fake_bpy.PropCollection(
+            mqtt_nodes.MQTTAttributeOutputProp)
+    scn.mqtt_attribute_inputs = fake_bpy.PropCollection(
+            mqtt_nodes.MQTTAttributeInputProp)
+
+    for i in range(n_inputs):
+        prop = scn.mqtt_inputs.add()
+        prop.property_name = f"in_{i}"
+        scn[prop.property_name] = 0.0
+
+    # Drivers spread over objects, 10 per object
+    for j in range(n_drivers):
+        if j % 10 == 0:
+            obj = fake_bpy.Object(f"Driven_{j // 10}")
+            obj.animation_data = fake_bpy.AnimData()
+            data.objects.append(obj)
+        name = f"in_{j % max(n_inputs, 1)}"
+        driver = fake_bpy.Driver(f'bpy.data.scenes["Scene"]["{name}"] * 2.0')
+        obj.animation_data.drivers.append(
+                fake_bpy.FCurve("location", driver))
+
+    cube = fake_bpy.Object("Cube")
+    cube.location = [1.0, 2.0, 3.0]
+    data.objects.append(cube)
+    for k in range(n_outputs):
+        prop = scn.mqtt_outputs.add()
+        prop.data_path = f'bpy.data.objects["Cube"].location[{k % 3}]'
+        prop.topic = f"out_{k}"
+
+    for size in attribute_sizes:
+        mesh = fake_bpy.Mesh(f"Points_{size}")
+        mesh.attributes["position"] = fake_bpy.Attribute(
+                "position", 'FLOAT_VECTOR', size, make_flat(size, 3))
+        obj = fake_bpy.Object(f"Points_{size}", mesh)
+        data.objects.append(obj)
+        prop = scn.mqtt_attribute_outputs.add()
+        prop.object = obj
+        prop.attribute_name = "position"
+        prop.stream_all_instances = True
+        prop.topic = f"points_{size}"
+        # The same attribute fed by an attribute input
+        prop = scn.mqtt_attribute_inputs.add()
+        prop.object = obj
+        prop.attribute_name = "position"
+        prop.topic = f"points_in_{size}"
+
+    connection = mqtt_connection.mqtt_connection
+    connection.update_inputs(scn)
+    driver_utils.driver_index.invalidate()
+    return scn
+
+
+def connect():
+    """Attach a paho transport with a fake client to the connection and
+    start its publish worker, without a network thread. Returns the fake
+    client."""
+    connection = mqtt_connection.mqtt_connection
+    connection._topic_prefix = TOPIC_PREFIX
+    transport = PahoTransport()
+    transport.user_data_set(connection)
+    transport.on_message = mqtt_connection.MQTTConnection._on_message
+    client = transport._client
+    client._connected = True
+    connection._client = transport
+    connection._publisher.start(connection._publish)
+    return client
+
+
+def wait_for_publisher():
+    publisher = mqtt_connection.mqtt_connection._publisher
+    while publisher.pending():
+        time.sleep(0.0005)
+
+
+def run(args):
+    results = []
+
+    def record(name, params, stats):
+        entry = {"name": name, "params": params}
+        entry.update(stats)
+        results.append(entry)
+        print(f"{name:40s} {json.dumps(params):45s} "
+              f"mean {stats['mean'] * 1000.0:9.3f} ms", file=sys.stderr)
+
+    client = connect()
+    ingest_buffer = mqtt_connection.ingest_buffer
+    repeat = args.repeat
+
+    for n_inputs in args.inputs:
+        params = {"inputs": n_inputs, "drivers": args.drivers}
+        scn = build_scene(n_inputs, args.drivers, 0, [])
+        messages = [(TOPIC_PREFIX + f"in_{i}", str(i * 0.5).encode())
+                    for i in range(n_inputs)]
+
+        def deliver():
+            for topic, payload in messages:
+                client.deliver(topic, payload)
+        record("on_message", params, measure(deliver, repeat=repeat))
+        ingest_buffer.clear()
+
+        # The same values as one batch message
+        layout = mqtt_connection.mqtt_connection.batch_layout
+        batches = {
+            "JSON": json.dumps({f"in_{i}": i * 0.5 for i in range(n_inputs)}),
+            "BINARY": batch.encode_frame(layout.layout_id,
+                                         [i * 0.5 for i in range(n_inputs)]),
+        }
+        for encoding, payload in batches.items():
+            record("on_message_batch", dict(params, encoding=encoding),
+                   measure(lambda: client.deliver(TOPIC_PREFIX + "batch", payload),
+                           repeat=repeat))
+            ingest_buffer.clear()
+
+        def fill():
+            for i in range(n_inputs):
+                ingest_buffer.push(f"in_{i}", float(i))
+        record("process_mqtt_updates", params,
+               measure(mqtt_nodes.process_mqtt_updates, fill, repeat))
+
+        for prop in scn.mqtt_inputs:
+            prop.filter_type = 'DECAY'
+            prop.decay_hold_peak_frames = 0
+        filter_engine.configure(scn)
+
+        def arm_decay():
+            for prop in scn.mqtt_inputs:
+                scn[prop.property_name] = 1.0
+                filter_engine.receive(prop.property_name, 1.0)
+        record("updateSceneVarsByFilters", params,
+               measure(lambda: mqtt_nodes.updateSceneVarsByFilters(scn),
+                       arm_decay, repeat))
+
+    params = {"drivers": args.drivers}
+    build_scene(max(args.inputs), args.drivers, 0, [])
+    record("update_all_drivers", params,
+           measure(driver_utils.update_all_drivers, repeat=repeat))
+    changed = {f"in_{i}" for i in range(max(1, max(args.inputs) // 10))}
+    params = {"drivers": args.drivers, "changed_properties": len(changed)}
+    record("refresh_drivers_for_properties", params,
+           measure(lambda: driver_utils.refresh_drivers_for_properties(changed),
+                   repeat=repeat))
+
+    scn = build_scene(0, 0, args.outputs, [])
+    params = {"outputs": args.outputs}
+
+    def publish_outputs():
+        for prop in scn.mqtt_outputs:
+            mqtt_nodes.publish_output_property_value(prop)
+    record("publish_output_property_value", params,
+           measure(publish_outputs, wait_for_publisher, repeat))
+
+    scn = build_scene(0, 0, 0, args.attribute_sizes)
+    for prop in scn.mqtt_attribute_outputs:
+        size = int(prop.topic.rsplit("_", 1)[1])
+        attr_repeat = max(3, repeat // 4) if size >= 100000 else repeat
+        for encoding, delta_mode in (('JSON', False), ('BINARY', False),
+                                     ('BINARY', True)):
+            prop.encoding = encoding
+            prop.delta_mode = delta_mode
+            params = {"elements": size, "encoding": encoding,
+                      "delta": delta_mode}
+            publish = lambda: mqtt_nodes.publish_attribute_output_value(prop, bpy.context)
+            record("publish_attribute_output_value", params,
+                   measure(publish, wait_for_publisher, attr_repeat))
+            # Including the encode and publish on the worker thread
+            record("publish_attribute_output_value+worker", params,
+                   measure(lambda: (publish(), wait_for_publisher()),
+                           repeat=attr_repeat))
+
+    # Attribute inputs: decoding on the network thread, then the bulk write
+    if np is not None:
+        attribute_ingest = mqtt_connection.attribute_ingest
+        for size in args.attribute_sizes:
+            attr_repeat = max(3, repeat // 4) if size >= 100000 else repeat
+            rows = make_flat(size, 3).reshape(size, 3)
+            payloads = {
+                "BINARY": codec.encode_array(rows),
+                "RAW": rows.tobytes(),
+            }
+            topic = TOPIC_PREFIX + f"points_in_{size}"
+            for encoding, payload in payloads.items():
+                params = {"elements": size, "encoding": encoding}
+                record("on_message_attribute", params,
+                       measure(lambda: client.deliver(topic, payload),
+                               repeat=attr_repeat))
+            attribute_ingest.clear()
+
+            def fill_attribute():
+                client.deliver(topic, payloads["BINARY"])
+            record("apply_attribute_inputs", {"elements": size},
+                   measure(mqtt_nodes.process_mqtt_updates, fill_attribute,
+                           attr_repeat))
+
+    mqtt_connection.mqtt_connection._publisher.stop(timeout=1.0)
+
+    # Bridge throughput with the network taken out: a producer in this
+    # thread publishes to the loopback broker, the connection's network
+    # thread routes the messages into the ingest buffer
+    connection = mqtt_connection.mqtt_connection
+    for n_inputs in args.inputs:
+        build_scene(n_inputs, 0, 0, [])
+        connection.stop()
+        loopback_broker.clear()
+        connection.run("", TOPIC_PREFIX, transport='LOOPBACK')
+        while not loopback_broker._subscriptions:
+            time.sleep(0.001)
+        count = args.messages
+        messages = [(TOPIC_PREFIX + f"in_{i % n_inputs}", str(i * 0.5).encode())
+                    for i in range(count)]
+
+        def send_and_drain():
+            target = ingest_buffer.seq + count
+            for topic, payload in messages:
+                loopback_broker.publish(topic, payload)
+            while ingest_buffer.seq < target:
+                time.sleep(0.0001)
+            ingest_buffer.clear()
+        stats = measure(send_and_drain, repeat=max(3, repeat // 4))
+        stats["messages_per_second"] = count / stats["p50"]
+        record("loopback_throughput", {"inputs": n_inputs, "messages": count},
+               stats)
+    connection.stop()
+    return results
+
+
+def get_version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"],
+                              cwd=REPO_DIR, capture_output=True, text=True,
+                              timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def parse_sizes(text):
+    return [int(v) for v in text.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--inputs", type=parse_sizes, default=[10, 100, 1000],
+                        help="comma separated input counts (default: 10,100,1000)")
+    parser.add_argument("--drivers", type=int, default=1000,
+                        help="number of drivers (default: 1000)")
+    parser.add_argument("--outputs", type=int, default=100,
+                        help="number of output data paths (default: 100)")
+    parser.add_argument("--attribute-sizes", type=parse_sizes,
+                        default=[1000, 10000, 100000, 1000000],
+                        help="comma separated attribute element counts")
+    parser.add_argument("--messages", type=int, default=100000,
+                        help="messages per loopback throughput run (default: 100000)")
+    parser.add_argument("--repeat", type=int, default=20,
+                        help="timed repetitions per benchmark (default: 20)")
+    parser.add_argument("--quick", action="store_true",
+                        help="small sizes for a fast smoke run")
+    parser.add_argument("--output", help="write the JSON results to a file "
+                        "instead of stdout")
+    args = parser.parse_args()
+    if args.quick:
+        args.inputs = [10, 100]
+        args.drivers = 100
+        args.outputs = 10
+        args.attribute_sizes = [1000, 10000]
+        args.messages = 10000
+        args.repeat = 5
+
+    report = {
+        "meta": {
+            "version": get_version(),
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__ if np is not None else None,
+        },
+    }
+    # Keep the addon's connection messages out of the report
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        report["results"] = run(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -14,6 +14,7 @@ bl_info = {
 
 import bpy
 import json
+import time
 
 from bpy.app.handlers import persistent
 
@@ -33,9 +34,34 @@ from bpy.types import (
 from . import ui, operators
 from . import mqtt_connection
 from . import driver_utils
+from . import codec
+from . import delta
+from . import data_paths
+from .scheduler import output_scheduler, drain_scheduler
+from .metrics import metrics
+from .attribute_buffers import attribute_buffers
+from .shm import shm_reader
+from .attribute_inputs import attribute_writer
+from .jitter import jitter_buffers
+from .filters import filter_engine
+from .recorder import session_recorder, replay_source
+
+# Import the ingest buffer from mqtt_connection
+from .mqtt_connection import ingest_buffer, attribute_ingest
+
+def update_metrics_settings(settings, context):
+    metrics.enabled = settings.metrics_enabled
+    output_scheduler.mark_dirty()
+
+def update_shm_settings(settings, context):
+    shm_reader.configure(settings.shm_enabled, settings.shm_name)
+    drain_scheduler.wake()
+
+def update_drain_settings(settings, context):
+    drain_scheduler.min_interval = settings.update_min_interval
+    drain_scheduler.listen_interval = settings.update_idle_interval
+    drain_scheduler.wake()
 
-# Import pending_updates from mqtt_connection
-from .mqtt_connection import pending_updates
 
 class MQTTSettingsProp(PropertyGroup):
     broker_host : StringProperty(
@@ -43,28 +69,181 @@ class MQTTSettingsProp(PropertyGroup):
             description="IP or hostname of the broker",
             default=""
             )
+    broker_port : IntProperty(
+            name="Broker Port",
+            description="TCP port of the broker",
+            default=1883,
+            min=1,
+            max=65535
+            )
+    transport : EnumProperty(
+            name="Transport",
+            description="How to reach the broker",
+            items=[
+                ('PAHO', "MQTT Broker", "Connect to an MQTT broker over the network"),
+                ('LOOPBACK', "Loopback", "In-process broker without network, for testing and benchmarks"),
+            ],
+            default='PAHO'
+            )
+    no_local : BoolProperty(
+            name="No Local",
+            description="Connect with MQTT v5 and ask the broker not to send the addon's own publishes back, for inputs and outputs under a shared topic",
+            default=False
+            )
+    shm_enabled : BoolProperty(
+            name="Shared Memory",
+            description="Also read inputs from a shared memory segment written by a producer on this machine",
+            default=False,
+            update=update_shm_settings
+            )
+    shm_name : StringProperty(
+            name="Segment Name",
+            description="Name of the shared memory segment",
+            default="blender_mqtt",
+            update=update_shm_settings
+            )
     topic_prefix : StringProperty(
             name="Topic Prefix",
             description="Prefix for the topic before all the input topics",
             default="/bl_prop_input/"
             )
+    update_min_interval : FloatProperty(
+            name="Min Update Spacing",
+            description="Shortest time in seconds between two updates applying incoming data, so bursts don't refresh the drivers more often than needed. While no data arrives the updates slow down on their own",
+            default=0.01,
+            min=0.0,
+            max=0.5,
+            update=update_drain_settings
+            )
+    update_idle_interval : FloatProperty(
+            name="Idle Poll Interval",
+            description="Longest time in seconds between two checks for incoming data while connected and nothing arrives. Lower values apply the first message after a quiet period sooner, higher values use less CPU",
+            default=0.05,
+            min=0.0,
+            max=1.0,
+            update=update_drain_settings
+            )
     mqtt_enabled : BoolProperty(
             name="MQTT Enabled",
             description="Enable/disable all MQTT input and output updates",
             default=True
             )
+    latency_echo : BoolProperty(
+            name="Latency Echo",
+            description="Republish every applied input value with its timestamps to <prefix>$echo/<name>",
+            default=False
+            )
+    metrics_enabled : BoolProperty(
+            name="Collect Metrics",
+            description="Count messages and publishes and time the update paths",
+            default=False,
+            update=update_metrics_settings
+            )
+    record_path : StringProperty(
+            name="Recording",
+            description="File to record the received input samples to",
+            default="//mqtt_session.blrec",
+            subtype='FILE_PATH'
+            )
+    replay_path : StringProperty(
+            name="Replay",
+            description="Recorded session to replay",
+            default="//mqtt_session.blrec",
+            subtype='FILE_PATH'
+            )
+    replay_mode : EnumProperty(
+            name="Replay Mode",
+            description="How replayed samples follow time",
+            items=[
+                ('REALTIME', "Real Time", "Replay at the recorded rate"),
+                ('FAST', "Fast", "Replay Speed times faster than recorded"),
+                ('FRAME', "Frame Locked", "Follow the timeline, the recording starts at the start frame. Renders get the same values every time"),
+            ],
+            default='REALTIME'
+            )
+    replay_speed : FloatProperty(
+            name="Replay Speed",
+            description="Speed of fast replay relative to the recording",
+            default=4.0,
+            min=0.01
+            )
+    replay_loop : BoolProperty(
+            name="Loop",
+            description="Start over at the end of the recording",
+            default=False
+            )
+    metrics_interval : FloatProperty(
+            name="Metrics Interval",
+            description="Publish the metrics retained to <prefix>$metrics every n seconds (0 to not publish)",
+            default=0.0,
+            min=0.0,
+            update=update_metrics_settings
+            )
+
+def update_filter_settings(prop, context):
+    filter_engine.configure(context.scene)
 
 def update_input_property(prop, context):
+    mqtt_connection.mqtt_connection.update_inputs(context.scene)
     mqtt_connection.mqtt_connection.pub_manifest()
 
+def update_output_schedule(prop, context):
+    output_scheduler.mark_dirty()
+    # Wake the publish timer, so the change applies right away
+    if bpy.app.timers.is_registered(publish_timer_output_properties):
+        bpy.app.timers.unregister(publish_timer_output_properties)
+        bpy.app.timers.register(publish_timer_output_properties, first_interval=0.0)
+
 def update_output_property(prop, context):
+    update_output_schedule(prop, context)
+    data_paths.invalidate_accessors()
+    # Consumers need a keyframe after any change of the stream layout
+    delta.reset_all()
     mqtt_connection.mqtt_connection.pub_manifest()
 
+INPUT_FILTERS = [
+    ('NONE', "None", "Write the received values as they are"),
+    ('DECAY', "Decay", "Hold a received value for some frames, then lower it by a rate per frame down to 0"),
+    ('EMA', "Smooth", "Exponential moving average, moves a fraction of the way to the received value each frame"),
+    ('ONE_EURO', "One Euro", "Smooths slow motion strongly and fast motion lightly, for jittery tracking data"),
+    ('SLEW', "Slew Limit", "Follow the received value with a limited change per second"),
+]
+
+INPUT_VALUE_TYPES = [
+    ('SCALAR', "Scalar", "A single number per message"),
+    ('VECTOR', "Vector", "2 to 4 numbers per message, e.g. a location or a quaternion"),
+    ('ARRAY', "Array", "Array Size numbers per message"),
+]
+
+
 class MQTTInputProp(PropertyGroup):
+    value_type : EnumProperty(
+            name="Value Type",
+            description="What a message to this input carries. Vectors and arrays are sent as a JSON list or as packed float32 values",
+            items=INPUT_VALUE_TYPES,
+            default='SCALAR',
+            update=update_input_property
+            )
+    vector_size : IntProperty(
+            name="Vector Size",
+            description="Number of components of a vector input",
+            default=3,
+            min=2,
+            max=4,
+            update=update_input_property
+            )
     topic : StringProperty(
             name="Topic",
-            description="The topic postfix to get input data from",
-            default=""
+            description="The topic postfix to get input data from, may contain + and # wildcards (defaults to the property name)",
+            default="",
+            update=update_input_property
+            )
+    array_size : IntProperty(
+            name="Array Size",
+            description="Store the input as an array. For scalar inputs the segment matched by the first + wildcard in the topic selects the slot (0 for a single value), array inputs receive all values in one message",
+            default=0,
+            min=0,
+            update=update_input_property
             )
     property_name : StringProperty(
             name="Custom Property Name",
@@ -72,6 +251,44 @@ class MQTTInputProp(PropertyGroup):
             default="NOT_SET",
             update=update_input_property
             )
+    keep_all_samples : BoolProperty(
+            name="Keep All Samples",
+            description="Apply every received sample instead of only the newest one per update",
+            default=False,
+            update=update_input_property
+            )
+    jitter_buffer : BoolProperty(
+            name="Jitter Buffer",
+            description="Keep the last timestamped samples and write the value at the current time minus the delay on each frame change, trading a fixed latency for smooth motion",
+            default=False,
+            update=update_input_property
+            )
+    jitter_delay : FloatProperty(
+            name="Delay",
+            description="Seconds the written value lags behind the samples, a bit more than the variation of their arrival times",
+            default=0.1,
+            min=0.0,
+            max=5.0,
+            update=update_input_property
+            )
+    jitter_size : IntProperty(
+            name="Buffer Size",
+            description="Number of samples the jitter buffer keeps",
+            default=32,
+            min=2,
+            max=1024,
+            update=update_input_property
+            )
+    interpolation : EnumProperty(
+            name="Interpolation",
+            description="How the jitter buffer evaluates between two samples",
+            items=[
+                ('LINEAR', "Linear", "Straight line between the two samples"),
+                ('HERMITE', "Hermite", "Smooth cubic curve through the samples, with the slopes of the neighbouring samples"),
+            ],
+            default='LINEAR',
+            update=update_input_property
+            )
     min_value : FloatProperty(
             name="Min Value",
             description="If a float value, limit to this minimum",
@@ -84,27 +301,64 @@ class MQTTInputProp(PropertyGroup):
             )
     do_decay_float : BoolProperty(
             name="Do Decay",
-            description="Decay the input value with animation. Must be convertable to float.",
+            description="Replaced by the Decay filter, read from older files",
             default=False
             )
-    decay_current_value : FloatProperty(
-            name="Current Value",
-            default=0.0
+    filter_type : EnumProperty(
+            name="Filter",
+            description="Filter the received values on every frame",
+            items=INPUT_FILTERS,
+            default='NONE',
+            update=update_filter_settings
             )
     decay_hold_peak_frames : IntProperty(
             name="Hold N Frames",
             description="Hold the input value for n frames before decaying",
-            default=4
-            )
-    decay_curr_hold_peak_frames : IntProperty(
-            name="Counter for holding n remaining frames",
-            default=0
+            default=4,
+            min=0,
+            update=update_filter_settings
             )
     decay_rate : FloatProperty(
            name="Decay Rate",
            description="Decay per frame",
-           default=0.05
+           default=0.05,
+           update=update_filter_settings
            )
+    filter_factor : FloatProperty(
+            name="Factor",
+            description="Fraction of the way to the received value the smoothed value moves each frame",
+            default=0.2,
+            min=0.001,
+            max=1.0,
+            update=update_filter_settings
+            )
+    filter_min_cutoff : FloatProperty(
+            name="Min Cutoff",
+            description="Cutoff frequency in Hz while the value holds still, lower removes more jitter",
+            default=1.0,
+            min=0.001,
+            update=update_filter_settings
+            )
+    filter_beta : FloatProperty(
+            name="Beta",
+            description="How much the cutoff rises with the speed of the value, higher lags less in fast motion",
+            default=0.01,
+            min=0.0,
+            update=update_filter_settings
+            )
+    filter_rate : FloatProperty(
+            name="Max Rate",
+            description="Largest change of the value per second",
+            default=1.0,
+            min=0.0,
+            update=update_filter_settings
+            )
+
+
+PAYLOAD_ENCODINGS = [
+    ('JSON', "JSON", "JSON text arrays"),
+    ('BINARY', "Binary", "Little-endian packed array with a fixed header, described in the manifest"),
+]
 
 
 class MQTTOutputProp(PropertyGroup):
@@ -120,17 +374,26 @@ class MQTTOutputProp(PropertyGroup):
             default="",
             update=update_output_property
             )
+    encoding : EnumProperty(
+            name="Encoding",
+            description="Payload format for array values",
+            items=PAYLOAD_ENCODINGS,
+            default='JSON',
+            update=update_output_property
+            )
     publish_on_frame : BoolProperty(
             name="Publish on Frame",
             description="Publish the property value on each frame change",
-            default=True
+            default=True,
+            update=update_output_schedule
             )
     timer_interval : FloatProperty(
             name="Timer Interval",
             description="Interval in seconds to publish when not publishing on frame (0.01 = 100Hz)",
             default=0.1,
             min=0.01,
-            max=10.0
+            max=10.0,
+            update=update_output_schedule
             )
 
 
@@ -178,76 +441,417 @@ class MQTTAttributeOutputProp(PropertyGroup):
             default="",
             update=update_output_property
             )
+    encoding : EnumProperty(
+            name="Encoding",
+            description="Payload format for array values",
+            items=PAYLOAD_ENCODINGS,
+            default='JSON',
+            update=update_output_property
+            )
+    delta_mode : BoolProperty(
+            name="Delta Mode",
+            description="Only publish the element ranges that changed since the last message, with periodic full keyframes",
+            default=False,
+            update=update_output_property
+            )
+    delta_epsilon : FloatProperty(
+            name="Delta Epsilon",
+            description="Elements changing by no more than this are treated as unchanged",
+            default=0.0,
+            min=0.0
+            )
+    delta_keyframe_interval : IntProperty(
+            name="Keyframe Interval",
+            description="Send the full attribute every N messages",
+            default=60,
+            min=1
+            )
     publish_on_frame : BoolProperty(
             name="Publish on Frame",
             description="Publish the attribute value on each frame change",
-            default=True
+            default=True,
+            update=update_output_schedule
             )
     timer_interval : FloatProperty(
             name="Timer Interval",
             description="Interval in seconds to publish when not publishing on frame (0.01 = 100Hz)",
             default=0.1,
             min=0.01,
-            max=10.0
+            max=10.0,
+            update=update_output_schedule
+            )
+
+
+ATTRIBUTE_INPUT_TYPES = [
+    ('FLOAT', "Float", "One float per element"),
+    ('INT', "Integer", "One integer per element"),
+    ('BOOLEAN', "Boolean", "One boolean per element"),
+    ('FLOAT2', "2D Vector", "Two floats per element"),
+    ('FLOAT_VECTOR', "Vector", "Three floats per element, e.g. positions"),
+    ('FLOAT_COLOR', "Color", "RGBA floats per element, RGB is accepted too"),
+]
+
+ATTRIBUTE_DOMAINS = [
+    ('POINT', "Point", "Vertices or points"),
+    ('EDGE', "Edge", "Mesh edges"),
+    ('FACE', "Face", "Mesh faces"),
+    ('CORNER', "Face Corner", "Mesh face corners"),
+    ('CURVE', "Spline", "Curves"),
+]
+
+
+class MQTTAttributeInputProp(PropertyGroup):
+    object : PointerProperty(
+            name="Object",
+            description="The object whose mesh, point cloud or curves data receives the attribute",
+            type=bpy.types.Object,
+            update=update_input_property
+            )
+    attribute_name : StringProperty(
+            name="Attribute Name",
+            description="Name of the attribute to write, it is created if it does not exist",
+            default="",
+            update=update_input_property
+            )
+    topic : StringProperty(
+            name="Topic",
+            description="The topic postfix to get arrays from",
+            default="",
+            update=update_input_property
+            )
+    data_type : EnumProperty(
+            name="Data Type",
+            description="Data type of the attribute",
+            items=ATTRIBUTE_INPUT_TYPES,
+            default='FLOAT_VECTOR',
+            update=update_input_property
+            )
+    domain : EnumProperty(
+            name="Domain",
+            description="Domain of the attribute when it has to be created",
+            items=ATTRIBUTE_DOMAINS,
+            default='POINT'
+            )
+    resize : BoolProperty(
+            name="Resize",
+            description="Change the vertex count of a mesh to the number of received elements (point domain only). Shrinking or growing a mesh with edges or faces leaves loose points",
+            default=False
             )
 
 
+def apply_input_value(scn, key, value):
+    """Write a received value to the scene, returns True if an input matched
+
+    ``key`` is either the property name or a (property name, slot) pair
+    for array inputs.
+    """
+    if isinstance(key, tuple):
+        var_name, slot = key
+    else:
+        var_name, slot = key, None
+    if filter_engine and filter_engine.receive(key, value):
+        # The filter writes its output on the next frame
+        return False
+    
+    applied = False
+    input_indices = mqtt_connection.mqtt_connection.router.input_indices
+    for idx in input_indices.get(var_name, ()):
+        if idx >= len(scn.mqtt_inputs):
+            continue
+        prop = scn.mqtt_inputs[idx]
+        if prop.property_name != var_name:
+            continue
+        if isinstance(value, tuple):
+            # Vector and array inputs, the whole value in one assignment
+            scn[var_name] = value
+        elif slot is None:
+            scn[var_name] = value
+        else:
+            # Make sure the scene property is an array of the configured size
+            arr = scn.get(var_name)
+            if not hasattr(arr, '__len__') or len(arr) != prop.array_size:
+                scn[var_name] = [0.0] * prop.array_size
+                arr = scn[var_name]
+            arr[slot] = value
+        applied = True
+    return applied
+
+
+def trace_applied_samples(applied, drain_time, applied_time, echo):
+    """Record the latency stages of applied samples and optionally echo
+    them with their timestamps to <prefix>$echo/<name>"""
+    for key, sample in applied:
+        if isinstance(key, tuple):
+            name, slot = key
+        else:
+            name, slot = key, None
+        if metrics.enabled:
+            metrics.incr("applied", name)
+            origin = sample.recv_time
+            if sample.producer_time is not None:
+                origin = sample.producer_time
+                metrics.observe_latency(name, "network", sample.recv_time - sample.producer_time)
+            metrics.observe_latency(name, "queue", drain_time - sample.recv_time)
+            metrics.observe_latency(name, "apply", applied_time - drain_time)
+            metrics.observe_latency(name, "total", applied_time - origin)
+        if echo:
+            mqtt_connection.mqtt_connection.publish(
+                    "$echo/" + name, encode=json.dumps, args=({
+                        "name": name,
+                        "slot": slot,
+                        "value": sample.value,
+                        "seq": sample.seq,
+                        "producer_ts": sample.producer_time,
+                        "recv_ts": sample.recv_time,
+                        "drain_ts": drain_time,
+                        "applied_ts": applied_time,
+                    },))
+
+
 def process_mqtt_updates():
-    """Process pending MQTT updates in the main thread (similar to Foscap's process_shape_key_updates)"""
+    """Process pending MQTT updates in the main thread (similar to Foscap's process_shape_key_updates)
+
+    The timer interval adapts to the incoming data, see DrainScheduler.
+    """
+    ui.redraw_on_state_change()
+    state = mqtt_connection.mqtt_connection.state
+    listening = state == mqtt_connection.STATE_CONNECTED
+    if not inputs_pending():
+        # Nothing to apply, don't touch the scene at all
+        if state == mqtt_connection.STATE_DISCONNECTED:
+            return drain_scheduler.stop()
+        return drain_scheduler.next_interval(False, listening=listening)
     scn = bpy.context.scene
     # Skip processing if MQTT is paused
     if not scn.mqtt_settings.mqtt_enabled:
-        return 0.01
-    
-    do_update_drivers = False
+        return drain_scheduler.next_interval(False)
+    return drain_scheduler.next_interval(drain_mqtt_updates(scn),
+                                         listening=listening)
+
+
+def inputs_pending():
+    """Whether the update timer has data to apply or a source to poll"""
+    return bool(ingest_buffer or attribute_ingest or shm_reader.enabled
+                or replay_source.active or jitter_buffers.pending
+                or filter_engine.settling)
+
+
+def drain_mqtt_updates(scn):
+    """Apply all pending updates, returns True if there were any"""
+    # Same-host producers write straight into shared memory
+    if shm_reader.enabled:
+        shm_reader.poll(ingest_buffer,
+                        mqtt_connection.mqtt_connection.router.vector_lengths)
+    if replay_source.active and not replay_source.frame_locked:
+        replay_source.poll(ingest_buffer, attribute_ingest,
+                           mqtt_connection.mqtt_connection.batch_layout.keep_all)
+    received = bool(attribute_ingest)
+    if received:
+        apply_attribute_inputs(scn, attribute_ingest.swap()[0])
+    latest, samples = ingest_buffer.swap()
+    if latest:
+        apply_ingested_samples(scn, latest, samples)
+        received = True
+    # While the animation plays, the frame change handler does this
+    if not drain_scheduler.playing():
+        if jitter_buffers.pending:
+            apply_jitter_buffers(scn)
+            received = True
+        if filter_engine.settling:
+            step_filters_on_timer(scn)
+            received = True
+    return received
+
+
+def apply_ingested_samples(scn, latest, samples):
+    """Write the drained samples to the scene, samples of inputs with a
+    jitter buffer go into their buffer"""
+    drain_time = time.time()
+    if metrics.enabled:
+        start = time.perf_counter()
+    changed_names = set()
+    applied = []
     
-    while pending_updates:
-        var_name, value = pending_updates.pop(0)
-        for prop in scn.mqtt_inputs:
-            if prop.property_name == var_name:
-                print("[MQTT] update var:", var_name, " = ", value)
-                scn[var_name] = value
-                if prop.do_decay_float:
-                    prop.decay_current_value = value
-                    prop.decay_curr_hold_peak_frames = prop.decay_hold_peak_frames
-                do_update_drivers = True
+    # Inputs that keep every sample get them applied in arrival order,
+    # all others only get their newest value
+    sampled = set()
+    for key, sample in samples:
+        sampled.add(key)
+        if jitter_buffers.settings and \
+           (key[0] if isinstance(key, tuple) else key) in jitter_buffers:
+            jitter_buffers.push(key, sample)
+            continue
+        if apply_input_value(scn, key, sample.value):
+            changed_names.add(key[0] if isinstance(key, tuple) else key)
+            applied.append((key, sample))
+    for key, sample in latest.items():
+        if key in sampled:
+            continue
+        if jitter_buffers.settings and \
+           (key[0] if isinstance(key, tuple) else key) in jitter_buffers:
+            jitter_buffers.push(key, sample)
+            continue
+        if apply_input_value(scn, key, sample.value):
+            changed_names.add(key[0] if isinstance(key, tuple) else key)
+            applied.append((key, sample))
     
-    if do_update_drivers:
-        driver_utils.update_all_drivers()
+    if changed_names:
+        driver_utils.refresh_drivers_for_properties(changed_names)
         scn.update_tag()
     
-    # Return interval for next timer call (similar to Foscap pattern)
-    return 0.01
+    if metrics.enabled:
+        metrics.observe("drain_time", time.perf_counter() - start)
+    if metrics.enabled or scn.mqtt_settings.latency_echo:
+        trace_applied_samples(applied, drain_time, time.time(),
+                              scn.mqtt_settings.latency_echo)
+
+
+def apply_jitter_buffers(scn):
+    """Write the values of the inputs with a jitter buffer at the current
+    time minus their delay"""
+    changed_names = set()
+    for key, value in jitter_buffers.evaluate():
+        if apply_input_value(scn, key, value):
+            changed_names.add(key[0] if isinstance(key, tuple) else key)
+    if changed_names:
+        driver_utils.refresh_drivers_for_properties(changed_names)
+        scn.update_tag()
+
+
+def start_update_timer():
+    """(Re)start the timer applying incoming data right away"""
+    if bpy.app.timers.is_registered(process_mqtt_updates):
+        bpy.app.timers.unregister(process_mqtt_updates)
+    bpy.app.timers.register(process_mqtt_updates, first_interval=0.0)
+
+
+def apply_attribute_inputs(scn, latest):
+    """Write the newest array of each attribute input into its attribute"""
+    if metrics.enabled:
+        start = time.perf_counter()
+    for idx, sample in latest.items():
+        if idx >= len(scn.mqtt_attribute_inputs):
+            continue
+        prop = scn.mqtt_attribute_inputs[idx]
+        if attribute_writer.write(idx, prop, sample.value) and metrics.enabled:
+            metrics.incr("applied", prop.topic)
+            metrics.observe_latency(prop.topic, "total", time.time() - (
+                    sample.producer_time or sample.recv_time))
+    if metrics.enabled:
+        metrics.observe("attribute_write_time", time.perf_counter() - start)
+
+
+def get_frame_duration(scn):
+    """Seconds per frame of the scene"""
+    render = getattr(scn, 'render', None)
+    if render is None or not render.fps:
+        return 1.0 / 24.0
+    return render.fps_base / render.fps
+
+
+def write_filtered_values(scn, values):
+    """Write the outputs of the input filters to the scene"""
+    changed_names = set()
+    for key, value in values:
+        if isinstance(key, tuple):
+            name, slot = key
+            arr = scn.get(name)
+            if not hasattr(arr, '__len__') or slot >= len(arr):
+                continue
+            arr[slot] = value
+        else:
+            name = key
+            scn[name] = value
+        changed_names.add(name)
+    if changed_names:
+        driver_utils.refresh_drivers_for_properties(changed_names)
+        scn.update_tag()
+
+
+def get_frame_time(scn):
+    """Seconds from the start frame to the current frame"""
+    return (scn.frame_current - scn.frame_start) * get_frame_duration(scn)
 
 
 def updateSceneVarsByFilters(scn):
-    # Skip decay updates if MQTT is paused
-    if not scn.mqtt_settings.mqtt_enabled:
+    """Advance the input filters by one frame"""
+    # Skip filter updates if MQTT is paused
+    if not scn.mqtt_settings.mqtt_enabled or not filter_engine:
         return
-    
-    do_update_drivers = False
-    for input_prop in scn.mqtt_inputs:
-        if input_prop.do_decay_float:
-            ## decay
-            if input_prop.decay_curr_hold_peak_frames > 0:
-                input_prop.decay_curr_hold_peak_frames -= 1
-            else:
-                if scn[input_prop.property_name] == 0.0:
-                    break
-                next_c_value = input_prop.decay_current_value - \
-                        input_prop.decay_rate
-                input_prop.decay_current_value = next_c_value
-                do_update_drivers = True
-                if next_c_value < 0.0:
-                    scn[input_prop.property_name] = 0.0
-                elif next_c_value < scn[input_prop.property_name]:
-                    scn[input_prop.property_name] = next_c_value
-    if do_update_drivers:
-        driver_utils.update_all_drivers()
-        scn.update_tag()
+    write_filtered_values(scn, filter_engine.step(get_frame_duration(scn)))
+
+
+def step_filters_on_timer(scn):
+    """Advance the smoothing filters at the frame rate while the animation
+    is stopped, decay only runs on frame changes"""
+    now = time.monotonic()
+    frame_duration = get_frame_duration(scn)
+    if now - filter_engine.last_timer_step < frame_duration:
+        return
+    filter_engine.last_timer_step = now
+    write_filtered_values(scn, filter_engine.step(frame_duration, decay=False))
+
+
+def read_attribute_values(attr, has_vector, has_value):
+    """Read all attribute elements one by one, the fallback when bulk
+    reads are unavailable. Returns None if an element can't be read."""
+    values = []
+    for i in range(len(attr.data)):
+        if has_vector:
+            try:
+                vec = attr.data[i].vector
+                values.append([float(vec[0]), float(vec[1]), float(vec[2])])
+            except (AttributeError, IndexError):
+                # Try color if vector doesn't work
+                try:
+                    color = attr.data[i].color
+                    values.append([float(color[0]), float(color[1]), float(color[2])])
+                except (AttributeError, IndexError):
+                    return None
+        elif has_value:
+            try:
+                # Wrap single values in array to match [[r,g,b],[r,g,b],...] format
+                values.append([float(attr.data[i].value)])
+            except (AttributeError, ValueError):
+                return None
+        else:
+            # Try to access the attribute directly if it's a simple type
+            try:
+                val = attr.data[i]
+                if isinstance(val, (int, float)):
+                    # Wrap single values in array to match [[r,g,b],[r,g,b],...] format
+                    values.append([float(val)])
+                else:
+                    return None
+            except:
+                return None
+    return values
+
 
+def encode_attribute_values(values, frame, binary):
+    """Build the payload for all elements of an attribute, runs on the
+    publish worker. ``values`` is an array of shape (elements, components)
+    or a list of rows."""
+    if isinstance(values, list):
+        if binary:
+            return codec.encode_values(values, frame)
+        return json.dumps(values)
+    if binary:
+        return codec.encode_array(values, frame)
+    if values.dtype.kind != 'f':
+        values = values.astype('float64')
+    return json.dumps(values.tolist())
 
-def publish_attribute_output_value(attr_prop, client, context):
+
+def encode_output_values(values, frame, binary):
+    """Build the payload for a single vector value, runs on the publish
+    worker"""
+    if binary:
+        return codec.encode_values([values], frame)
+    return json.dumps(values)
+
+
+def publish_attribute_output_value(attr_prop, context):
     """Publish a geometry node attribute value to MQTT"""
     if not attr_prop.object or not attr_prop.attribute_name or not attr_prop.topic:
         if not attr_prop.object:
@@ -295,40 +899,30 @@ def publish_attribute_output_value(attr_prop, client, context):
             has_value = hasattr(attr.data[0], 'value')
             has_vector = hasattr(attr.data[0], 'vector')
         
+        binary = attr_prop.encoding == 'BINARY'
+        frame = context.scene.frame_current
+        
         if attr_prop.stream_all_instances or attr_prop.attribute_index < 0:
-            # Stream all instances
-            values = []
-            for i in range(len(attr.data)):
-                if has_vector:
-                    try:
-                        vec = attr.data[i].vector
-                        values.append([float(vec[0]), float(vec[1]), float(vec[2])])
-                    except (AttributeError, IndexError):
-                        # Try color if vector doesn't work
-                        try:
-                            color = attr.data[i].color
-                            values.append([float(color[0]), float(color[1]), float(color[2])])
-                        except (AttributeError, IndexError):
-                            return False
-                elif has_value:
-                    try:
-                        # Wrap single values in array to match [[r,g,b],[r,g,b],...] format
-                        values.append([float(attr.data[i].value)])
-                    except (AttributeError, ValueError):
-                        return False
+            # Stream all instances, read in bulk when possible
+            buffer = attribute_buffers.read(attr_prop.topic, attr)
+            if buffer is not None:
+                # The buffer is reused for the next read, so hand a copy
+                # to the publish worker
+                snapshot = buffer.copy()
+                if attr_prop.delta_mode:
+                    encoder = delta.get_encoder(attr_prop.topic)
+                    encode = encoder.encode
+                    args = (snapshot, frame, attr_prop.delta_epsilon,
+                            attr_prop.delta_keyframe_interval, binary)
                 else:
-                    # Try to access the attribute directly if it's a simple type
-                    try:
-                        val = attr.data[i]
-                        if isinstance(val, (int, float)):
-                            # Wrap single values in array to match [[r,g,b],[r,g,b],...] format
-                            values.append([float(val)])
-                        else:
-                            return False
-                    except:
-                        return False
-            
-            payload = json.dumps(values)
+                    encode = encode_attribute_values
+                    args = (snapshot, frame, binary)
+            else:
+                values = read_attribute_values(attr, has_vector, has_value)
+                if values is None:
+                    return False
+                encode = encode_attribute_values
+                args = (values, frame, binary)
         else:
             # Stream single index
             idx = attr_prop.attribute_index
@@ -338,18 +932,18 @@ def publish_attribute_output_value(attr_prop, client, context):
             if has_vector:
                 try:
                     vec = attr.data[idx].vector
-                    payload = json.dumps([float(vec[0]), float(vec[1]), float(vec[2])])
+                    values = [float(vec[0]), float(vec[1]), float(vec[2])]
                 except (AttributeError, IndexError):
                     # Try color if vector doesn't work
                     try:
                         color = attr.data[idx].color
-                        payload = json.dumps([float(color[0]), float(color[1]), float(color[2])])
+                        values = [float(color[0]), float(color[1]), float(color[2])]
                     except (AttributeError, IndexError):
                         return False
             elif has_value:
                 try:
                     # Wrap single values in array to match [[r,g,b],[r,g,b],...] format
-                    payload = json.dumps([float(attr.data[idx].value)])
+                    values = [float(attr.data[idx].value)]
                 except (AttributeError, ValueError):
                     return False
             else:
@@ -358,19 +952,17 @@ def publish_attribute_output_value(attr_prop, client, context):
                     val = attr.data[idx]
                     if isinstance(val, (int, float)):
                         # Wrap single values in array to match [[r,g,b],[r,g,b],...] format
-                        payload = json.dumps([float(val)])
+                        values = [float(val)]
                     else:
                         return False
                 except:
                     return False
+            
+            encode = encode_output_values
+            args = (values, frame, binary)
         
-        # Publish to topic
-        full_topic = mqtt_connection.mqtt_connection._topic_prefix + attr_prop.topic
-        result = client.publish(full_topic, payload, qos=0, retain=False)
-        if result.rc == 0:
-            print(f"[MQTT] Published attribute '{attr_prop.attribute_name}' to topic '{full_topic}'")
-        else:
-            print(f"[MQTT] Failed to publish attribute '{attr_prop.attribute_name}' to topic '{full_topic}', rc={result.rc}")
+        # Encoding and publishing happen on the publish worker
+        mqtt_connection.mqtt_connection.publish(attr_prop.topic, encode=encode, args=args)
         return True
         
     except (AttributeError, KeyError, TypeError, ValueError, IndexError) as e:
@@ -378,7 +970,7 @@ def publish_attribute_output_value(attr_prop, client, context):
         return False
 
 
-def publish_output_property_value(output_prop, client):
+def publish_output_property_value(output_prop):
     """Publish a single output property value to MQTT"""
     if not output_prop.data_path or not output_prop.topic:
         if not output_prop.data_path:
@@ -388,12 +980,14 @@ def publish_output_property_value(output_prop, client):
         return False
     
     data_path = output_prop.data_path
+    accessor = data_paths.get_accessor(data_path)
     
     # Try to evaluate the data path and get the property value
     try:
-        # Evaluate the data path safely (only allow access to bpy and standard types)
-        # This allows paths like: bpy.data.objects["Cube"].location[2]
-        value = eval(data_path, {"__builtins__": {}, "bpy": bpy})
+        # The path is parsed once and resolved to its datablock, only paths
+        # like bpy.data.objects["Cube"].location[2] skip evaluation entirely
+        value = accessor.get()
+        accessor.clear_error()
         
         # Skip None values
         if value is None:
@@ -407,9 +1001,13 @@ def publish_output_property_value(output_prop, client):
         
         # Convert to appropriate format
         if isinstance(value, (list, tuple)):
-            # For vector properties, publish as JSON array
+            # For vector properties, publish as JSON array or packed binary
             try:
-                payload = json.dumps([float(v) for v in value])
+                values = [float(v) for v in value]
+                payload = None
+                encode = encode_output_values
+                args = (values, bpy.context.scene.frame_current,
+                        output_prop.encoding == 'BINARY')
             except (TypeError, ValueError) as e:
                 # If conversion fails, skip this publish
                 print(f"[MQTT] Failed to convert list/tuple from '{data_path}' to float array: {e}")
@@ -417,30 +1015,32 @@ def publish_output_property_value(output_prop, client):
         elif isinstance(value, (int, float)):
             # For numeric values, publish as string
             payload = str(value)
+            encode, args = None, ()
         elif isinstance(value, bool):
             # For boolean values, publish as string
             payload = str(value)
+            encode, args = None, ()
         elif isinstance(value, str):
             # For string values, publish as-is
             payload = value
+            encode, args = None, ()
         else:
             # For other types (dict, complex objects), skip publishing
             # to avoid publishing empty dicts or unexpected data
             print(f"[MQTT] Unsupported value type '{type(value).__name__}' from data path '{data_path}', skipping publish to topic: {output_prop.topic}")
             return False
         
-        # Publish to topic
-        full_topic = mqtt_connection.mqtt_connection._topic_prefix + output_prop.topic
-        result = client.publish(full_topic, payload, qos=0, retain=False)
-        if result.rc == 0:
-            print(f"[MQTT] Published data path '{data_path}' (value: {payload[:50]}{'...' if len(payload) > 50 else ''}) to topic '{full_topic}'")
-        else:
-            print(f"[MQTT] Failed to publish data path '{data_path}' to topic '{full_topic}', rc={result.rc}")
+        # Publish to topic, payloads of vectors are encoded on the publish worker
+        mqtt_connection.mqtt_connection.publish(output_prop.topic, payload,
+                                                encode=encode, args=args)
         return True
         
-    except (AttributeError, KeyError, TypeError, ValueError, NameError, SyntaxError) as e:
-        # Property doesn't exist, can't be accessed, or invalid syntax
-        print(f"[MQTT] Error evaluating data path '{data_path}' for topic '{output_prop.topic}': {type(e).__name__}: {e}")
+    except (AttributeError, KeyError, TypeError, ValueError, NameError, SyntaxError,
+            IndexError, ReferenceError) as e:
+        # Property doesn't exist, can't be accessed, or invalid syntax,
+        # only reported the first time
+        if accessor.report_error(e):
+            print(f"[MQTT] Error evaluating data path '{data_path}' for topic '{output_prop.topic}': {type(e).__name__}: {e}")
         return False
 
 
@@ -450,14 +1050,7 @@ def publish_output_properties(scn, context=None):
     if not scn.mqtt_settings.mqtt_enabled:
         return
     
-    client = mqtt_connection.mqtt_connection._client
-    if not client:
-        return
-    # Check if client is connected
-    try:
-        if not client.is_connected():
-            return
-    except:
+    if not mqtt_connection.mqtt_connection.is_connected():
         return
     
     if context is None:
@@ -466,13 +1059,72 @@ def publish_output_properties(scn, context=None):
     for output_prop in scn.mqtt_outputs:
         if not output_prop.publish_on_frame:
             continue
-        publish_output_property_value(output_prop, client)
+        publish_output_property_value(output_prop)
     
     # Publish attribute outputs
     for attr_prop in scn.mqtt_attribute_outputs:
         if not attr_prop.publish_on_frame:
             continue
-        publish_attribute_output_value(attr_prop, client, context)
+        publish_attribute_output_value(attr_prop, context)
+
+
+def get_metrics_report():
+    """Get the collected metrics together with the bridge's own counters"""
+    report = metrics.snapshot()
+    connection = mqtt_connection.mqtt_connection
+    report["ingest"] = {
+        "seq": ingest_buffer.seq,
+        "dropped": ingest_buffer.dropped,
+    }
+    report["publish_queue"] = {
+        "pending": connection._publisher.pending(),
+        "dropped": connection._publisher.dropped,
+        "failed": connection._publisher.failed,
+        "network_dropped": connection.publishes_dropped,
+    }
+    report["scheduler"] = output_scheduler.get_stats()
+    report["drain"] = drain_scheduler.get_stats()
+    report["jitter"] = jitter_buffers.get_stats()
+    report["filters"] = filter_engine.get_stats()
+    report["recorder"] = session_recorder.get_stats()
+    report["replay"] = replay_source.get_stats()
+    report["drivers"] = {
+        "last_refreshed": driver_utils.driver_index.last_touched,
+    }
+    return report
+
+
+def publish_metrics():
+    """Publish the metrics retained to <prefix>$metrics"""
+    mqtt_connection.mqtt_connection.publish(
+            "$metrics", encode=json.dumps, args=(get_metrics_report(),),
+            retain=True)
+
+
+# Longest time the publish timer sleeps before checking the configuration
+TIMER_MAX_SLEEP = 0.5
+
+
+def get_timer_output_intervals(scn):
+    """Get the publish intervals of all timer based outputs, keyed by
+    ('output', index) and ('attribute', index)"""
+    intervals = {}
+    for idx, output_prop in enumerate(scn.mqtt_outputs):
+        if not output_prop.data_path or not output_prop.topic:
+            continue
+        if output_prop.publish_on_frame:
+            continue  # Skip frame-based publishing
+        intervals[('output', idx)] = output_prop.timer_interval
+    for idx, attr_prop in enumerate(scn.mqtt_attribute_outputs):
+        if not attr_prop.object or not attr_prop.attribute_name or not attr_prop.topic:
+            continue
+        if attr_prop.publish_on_frame:
+            continue  # Skip frame-based publishing
+        intervals[('attribute', idx)] = attr_prop.timer_interval
+    settings = scn.mqtt_settings
+    if settings.metrics_enabled and settings.metrics_interval > 0.0:
+        intervals[('metrics', 0)] = settings.metrics_interval
+    return intervals
 
 
 def publish_timer_output_properties():
@@ -483,52 +1135,42 @@ def publish_timer_output_properties():
     if not scn.mqtt_settings.mqtt_enabled:
         return 0.1
     
-    client = mqtt_connection.mqtt_connection._client
-    if not client:
+    if not mqtt_connection.mqtt_connection.is_connected():
         return 0.1  # Default interval if not connected
-    # Check if client is connected
-    try:
-        if not client.is_connected():
-            return 0.1
-    except:
-        return 0.1
     
-    # Find the minimum timer interval from all timer-based output properties
-    min_interval = 10.0  # Default to 10 seconds if no timer properties
+    if output_scheduler.dirty:
+        output_scheduler.sync(get_timer_output_intervals(scn))
     
-    for output_prop in scn.mqtt_outputs:
-        if not output_prop.data_path or not output_prop.topic:
-            continue
-        if output_prop.publish_on_frame:
-            continue  # Skip frame-based publishing
-        
-        # Publish this property
-        publish_output_property_value(output_prop, client)
-        
-        # Track minimum interval
-        if output_prop.timer_interval < min_interval:
-            min_interval = output_prop.timer_interval
+    # Publish only the outputs whose deadline has come
+    for kind, idx in output_scheduler.pop_due():
+        if kind == 'output':
+            if idx < len(scn.mqtt_outputs):
+                publish_output_property_value(scn.mqtt_outputs[idx])
+        elif kind == 'metrics':
+            publish_metrics()
+        elif idx < len(scn.mqtt_attribute_outputs):
+            publish_attribute_output_value(scn.mqtt_attribute_outputs[idx], context)
     
-    # Publish timer-based attribute outputs
-    for attr_prop in scn.mqtt_attribute_outputs:
-        if not attr_prop.object or not attr_prop.attribute_name or not attr_prop.topic:
-            continue
-        if attr_prop.publish_on_frame:
-            continue  # Skip frame-based publishing
-        
-        # Publish this attribute
-        publish_attribute_output_value(attr_prop, client, context)
-        
-        # Track minimum interval
-        if attr_prop.timer_interval < min_interval:
-            min_interval = attr_prop.timer_interval
-    
-    # Return the minimum interval for next timer call
-    return min_interval if min_interval < 10.0 else 0.1
+    # Sleep until the earliest deadline, but look at the configuration
+    # again at least every TIMER_MAX_SLEEP seconds
+    delay = output_scheduler.next_delay()
+    if delay is None:
+        return TIMER_MAX_SLEEP
+    return min(max(delay, 0.001), TIMER_MAX_SLEEP)
 
 
 @persistent
 def pre_frame_change_handler(scn):
+    drain_scheduler.frame_changed()
+    if replay_source.frame_locked and scn.mqtt_settings.mqtt_enabled:
+        # Apply the replayed samples of this frame right away, the update
+        # timer doesn't run while rendering
+        replay_source.poll(ingest_buffer, attribute_ingest,
+                           mqtt_connection.mqtt_connection.batch_layout.keep_all,
+                           get_frame_time(scn))
+        drain_mqtt_updates(scn)
+    if jitter_buffers.pending and scn.mqtt_settings.mqtt_enabled:
+        apply_jitter_buffers(scn)
     updateSceneVarsByFilters(scn)
     # Publish output properties on frame change
     publish_output_properties(scn, bpy.context) 
@@ -537,14 +1179,33 @@ def pre_frame_change_handler(scn):
 def post_file_load_handler(none_par):
     print("post_file_load_handler !!!!!!!!!")
     scn = bpy.context.scene
-    host = scn.mqtt_settings.broker_host
-    topic = scn.mqtt_settings.topic_prefix
+    settings = scn.mqtt_settings
+    host = settings.broker_host
+    topic = settings.topic_prefix
     # sanity check hostname
-    if len(host) > 3:
-        mqtt_connection.mqtt_connection.run(host, topic)
-        # Register the timer for processing updates if not already registered
-        if not bpy.app.timers.is_registered(process_mqtt_updates):
-            bpy.app.timers.register(process_mqtt_updates)
+    for input_prop in scn.mqtt_inputs:
+        if input_prop.do_decay_float:
+            # Files from before the filter choice
+            input_prop.filter_type = 'DECAY'
+            input_prop.do_decay_float = False
+    mqtt_connection.mqtt_connection.update_inputs(scn)
+    output_scheduler.mark_dirty()
+    # The replayed session belongs to the previous file
+    replay_source.stop()
+    metrics.enabled = settings.metrics_enabled
+    shm_reader.configure(settings.shm_enabled, settings.shm_name)
+    drain_scheduler.min_interval = settings.update_min_interval
+    drain_scheduler.listen_interval = settings.update_idle_interval
+    if settings.shm_enabled:
+        drain_scheduler.wake()
+    if len(host) > 3 or settings.transport == 'LOOPBACK':
+        # The loaded file may use another broker, stopping doesn't wait
+        mqtt_connection.mqtt_connection.stop()
+        mqtt_connection.mqtt_connection.run(host, topic, settings.broker_port,
+                                            settings.transport,
+                                            settings.no_local)
+        # Start the timer for processing updates
+        drain_scheduler.wake()
         # Register the timer for publishing output properties if not already registered
         if not bpy.app.timers.is_registered(publish_timer_output_properties):
             bpy.app.timers.register(publish_timer_output_properties)
@@ -554,6 +1215,7 @@ classes = [
     MQTTInputProp,
     MQTTOutputProp,
     MQTTAttributeOutputProp,
+    MQTTAttributeInputProp,
     ui.MQTTNodePanel,
     ui.MQTTPanel,
     operators.MQTTAddInputProperty,
@@ -562,7 +1224,13 @@ classes = [
     operators.MQTTRemoveOutputProperty,
     operators.MQTTAddAttributeOutputProperty,
     operators.MQTTRemoveAttributeOutputProperty,
+    operators.MQTTAddAttributeInputProperty,
+    operators.MQTTRemoveAttributeInputProperty,
     operators.MQTTReconnectClient,
+    operators.MQTTStartRecording,
+    operators.MQTTStopRecording,
+    operators.MQTTStartReplay,
+    operators.MQTTStopReplay,
 ]
 
 
@@ -573,11 +1241,15 @@ def register():
     bpy.types.Scene.mqtt_inputs = CollectionProperty(type=MQTTInputProp)
     bpy.types.Scene.mqtt_outputs = CollectionProperty(type=MQTTOutputProp)
     bpy.types.Scene.mqtt_attribute_outputs = CollectionProperty(type=MQTTAttributeOutputProp)
+    bpy.types.Scene.mqtt_attribute_inputs = CollectionProperty(type=MQTTAttributeInputProp)
     bpy.app.handlers.load_post.append(post_file_load_handler)
     bpy.app.handlers.frame_change_pre.append(pre_frame_change_handler)
-    # Register timer for processing MQTT updates (similar to Foscap pattern)
-    if not bpy.app.timers.is_registered(process_mqtt_updates):
-        bpy.app.timers.register(process_mqtt_updates)
+    driver_utils.register_handlers()
+    data_paths.register_handlers()
+    # Timer for processing MQTT updates (similar to Foscap pattern), it
+    # stops by itself while there is no connection
+    drain_scheduler.start_timer = start_update_timer
+    drain_scheduler.wake()
     # Register timer for publishing output properties
     if not bpy.app.timers.is_registered(publish_timer_output_properties):
         bpy.app.timers.register(publish_timer_output_properties)
@@ -585,7 +1257,15 @@ def register():
 
 def unregister():
     mqtt_connection.mqtt_connection.stop()
+    shm_reader.configure(False, "")
+    ingest_buffer.recorder = None
+    attribute_ingest.recorder = None
+    session_recorder.stop()
+    replay_source.stop()
+    driver_utils.unregister_handlers()
+    data_paths.unregister_handlers()
     # Unregister timer for processing MQTT updates
+    drain_scheduler.start_timer = None
     if bpy.app.timers.is_registered(process_mqtt_updates):
         bpy.app.timers.unregister(process_mqtt_updates)
     # Unregister timer for publishing output properties
@@ -596,5 +1276,6 @@ def unregister():
     del bpy.types.Scene.mqtt_inputs
     del bpy.types.Scene.mqtt_outputs
     del bpy.types.Scene.mqtt_attribute_outputs
+    del bpy.types.Scene.mqtt_attribute_inputs
     del bpy.types.Scene.mqtt_settings
 
@@ -0,0 +1,73 @@
+"""Bulk reads of geometry attributes into reusable NumPy buffers."""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# attribute data_type -> (foreach property, dtype, components read,
+#                         components published)
+# Colors are read as RGBA but published as RGB, like the per element path.
+ATTRIBUTE_LAYOUTS = {
+    'FLOAT': ('value', 'float32', 1, 1),
+    'INT': ('value', 'int32', 1, 1),
+    'INT8': ('value', 'int32', 1, 1),
+    'BOOLEAN': ('value', 'bool', 1, 1),
+    'FLOAT2': ('vector', 'float32', 2, 2),
+    'INT32_2D': ('value', 'int32', 2, 2),
+    'FLOAT_VECTOR': ('vector', 'float32', 3, 3),
+    'FLOAT_COLOR': ('color', 'float32', 4, 3),
+    'BYTE_COLOR': ('color', 'float32', 4, 3),
+    'QUATERNION': ('value', 'float32', 4, 4),
+}
+
+
+class AttributeBuffers:
+    """Preallocated flat arrays, one per attribute output.
+
+    A buffer is only reallocated when the element count, component width
+    or dtype of its attribute changes.
+    """
+
+    def __init__(self):
+        self._buffers = {}
+
+    def get_buffer(self, key, dtype, size):
+        buf = self._buffers.get(key)
+        if buf is None or buf.size != size or buf.dtype != dtype:
+            buf = np.empty(size, dtype=dtype)
+            self._buffers[key] = buf
+        return buf
+
+    def read(self, key, attr):
+        """Read all elements of an attribute with foreach_get.
+
+        Returns an array of shape (elements, components) viewing the buffer
+        of ``key``, or None if the attribute can't be read in bulk.
+        """
+        if np is None:
+            return None
+        layout = ATTRIBUTE_LAYOUTS.get(getattr(attr, 'data_type', None))
+        if layout is None:
+            return None
+        prop, dtype, width, publish_width = layout
+        count = len(attr.data)
+        buf = self.get_buffer(key, dtype, count * width)
+        try:
+            attr.data.foreach_get(prop, buf)
+        except (AttributeError, TypeError, RuntimeError):
+            return None
+        values = buf.reshape(count, width)
+        if publish_width != width:
+            values = values[:, :publish_width]
+        return values
+
+    def discard(self, key):
+        self._buffers.pop(key, None)
+
+    def clear(self):
+        self._buffers.clear()
+
+
+attribute_buffers = AttributeBuffers()
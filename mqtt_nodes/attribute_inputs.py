@@ -0,0 +1,208 @@
+"""Incoming arrays written straight into geometry attributes.
+
+An attribute input binds a topic to a named attribute on the mesh, point
+cloud or curves data of an object. Every message carries all elements of
+the attribute, in one of these payloads:
+
+- a codec payload (see ``codec.py``), full or delta
+- packed little-endian float32 values, row by row, with the width of the
+  attribute (4 for colors)
+- a JSON list of rows, or the key and delta JSON of ``delta.py``
+
+Payloads are decoded on the network thread into an array with the
+attribute's own dtype and width. Only the newest array per attribute is
+kept until the next update, which writes it with a single
+``foreach_set``.
+"""
+
+import json
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from . import codec
+from .attribute_buffers import ATTRIBUTE_LAYOUTS
+from .router import split_topic
+
+
+class AttributeStream:
+    """Decodes the messages of one attribute input"""
+
+    def __init__(self, index, topic, data_type):
+        # index into scene.mqtt_attribute_inputs
+        self.index = index
+        self.topic = topic
+        self.data_type = data_type
+        _, dtype, width, _ = ATTRIBUTE_LAYOUTS[data_type]
+        self.dtype = np.dtype(dtype)
+        self.width = width
+        # Last complete array, delta payloads are applied to it
+        self._state = None
+
+    def decode(self, payload):
+        """Decode a message into a new array of shape (count, width).
+        Returns None if the payload doesn't fit the attribute, or if it is
+        a delta without a preceding keyframe."""
+        try:
+            values = self._decode(payload)
+        except (codec.CodecError, struct.error, ValueError, TypeError,
+                KeyError, IndexError):
+            return None
+        if values is not None:
+            self._state = values
+        return values
+
+    def _decode(self, payload):
+        if payload[:4] == codec.MAGIC:
+            header, data = codec.decode(payload)
+            if header["flags"] & codec.FLAG_DELTA:
+                return self._apply_delta(header["count"], data)
+            return self._conform(data)
+        if payload[:1] in (b"[", b"{"):
+            try:
+                data = json.loads(payload)
+            except ValueError:
+                # Packed floats may start with these bytes too
+                data = None
+            if data is not None:
+                if isinstance(data, dict):
+                    if data.get("type") == "delta":
+                        return self._apply_delta(int(data["count"]),
+                                                 data["ranges"])
+                    data = data["data"]
+                return self._conform(data)
+        rows = np.frombuffer(payload, dtype="<f4")
+        if rows.size % self.width:
+            raise ValueError("Payload is not a whole number of elements")
+        return self._conform(rows.reshape(-1, self.width))
+
+    def _conform(self, rows):
+        """Copy rows into a new array with the attribute's dtype and width"""
+        rows = np.asarray(rows, dtype=np.float64 if isinstance(rows, list)
+                          else None)
+        if rows.ndim == 1:
+            if rows.size % self.width:
+                raise ValueError("Payload is not a whole number of elements")
+            rows = rows.reshape(-1, self.width)
+        if rows.ndim != 2:
+            raise ValueError("Expected rows of values")
+        components = rows.shape[1]
+        if components == self.width:
+            return rows.astype(self.dtype)
+        if self.width == 4 and components == 3:
+            # Colors may be sent as RGB, like attribute outputs publish them
+            values = np.ones((len(rows), 4), dtype=self.dtype)
+            values[:, :3] = rows
+            return values
+        raise ValueError(f"Expected {self.width} components, got {components}")
+
+    def _apply_delta(self, count, ranges):
+        state = self._state
+        if state is None or len(state) != count:
+            return None
+        # The previous array may still wait in the ingest buffer
+        values = state.copy()
+        for start, rows in ranges:
+            rows = self._conform(rows)
+            if start + len(rows) > count:
+                raise ValueError("Delta range exceeds the element count")
+            values[start:start + len(rows)] = rows
+        return values
+
+
+def build_attribute_streams(scn):
+    """Get relative topic -> [AttributeStream] for the attribute inputs of
+    a scene"""
+    streams = {}
+    if np is None:
+        if len(scn.mqtt_attribute_inputs):
+            print("[MQTT] Attribute inputs need NumPy, they are ignored")
+        return streams
+    for idx, prop in enumerate(scn.mqtt_attribute_inputs):
+        if not prop.object or not prop.attribute_name or not prop.topic:
+            continue
+        topic = "/".join(split_topic(prop.topic))
+        streams.setdefault(topic, []).append(
+                AttributeStream(idx, topic, prop.data_type))
+    return streams
+
+
+def resize_points(data, count):
+    """Give a mesh ``count`` vertices. Vertices are only appended to
+    meshes of loose points, any other change of the count clears the
+    geometry. Returns False for data that can't be resized."""
+    vertices = getattr(data, 'vertices', None)
+    if vertices is None or not hasattr(data, 'clear_geometry'):
+        return False
+    size = len(vertices)
+    if count > size and not len(data.edges) and not len(data.polygons):
+        vertices.add(count - size)
+    else:
+        data.clear_geometry()
+        vertices.add(count)
+    return True
+
+
+class AttributeWriter:
+    """Writes decoded arrays into attributes, reporting each problem of
+    an input once until it is fixed"""
+
+    def __init__(self):
+        self._errors = {}
+
+    def write(self, key, prop, values):
+        """Write an array of shape (count, width) into the attribute of an
+        attribute input. Returns True on success."""
+        error = self._write(prop, values)
+        if error is None:
+            self._errors.pop(key, None)
+            return True
+        if self._errors.get(key) != error:
+            self._errors[key] = error
+            print(f"[MQTT] Attribute input '{prop.attribute_name}': {error}")
+        return False
+
+    def _write(self, prop, values):
+        obj = prop.object
+        if obj is None:
+            return "no object"
+        data = obj.data
+        attributes = getattr(data, 'attributes', None)
+        if attributes is None:
+            return f"object {obj.name} has no attributes"
+        name = prop.attribute_name
+        data_type = prop.data_type
+        attr = attributes.get(name)
+        if attr is None:
+            try:
+                attr = attributes.new(name, data_type, prop.domain)
+            except (RuntimeError, TypeError) as e:
+                return f"can't create attribute: {e}"
+        elif attr.data_type != data_type:
+            return f"attribute is {attr.data_type}, the input sends {data_type}"
+        count = len(values)
+        size = len(attr.data)
+        if size != count:
+            if not prop.resize or attr.domain != 'POINT':
+                return f"received {count} elements, the attribute has {size}"
+            if not resize_points(data, count):
+                return f"can't resize the points of {obj.name}"
+            # Clearing the geometry removes the attribute with it
+            attr = attributes.get(name) or attributes.new(name, data_type, 'POINT')
+            if len(attr.data) != count:
+                return f"resized to {len(attr.data)} elements instead of {count}"
+        try:
+            attr.data.foreach_set(ATTRIBUTE_LAYOUTS[data_type][0], values.ravel())
+        except (AttributeError, TypeError, RuntimeError) as e:
+            return f"write failed: {e}"
+        data.update_tag()
+        return None
+
+    def discard(self, key):
+        self._errors.pop(key, None)
+
+
+attribute_writer = AttributeWriter()
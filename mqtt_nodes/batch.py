@@ -0,0 +1,201 @@
+"""Batch input topic: many input values in one message.
+
+Messages to ``<prefix>batch`` update several inputs at once, either as
+JSON or as a packed binary frame. All values of a batch enter the ingest
+buffer together, so they are applied in the same update and followed by
+a single driver refresh.
+
+JSON payloads map property names to values. Array inputs take a list,
+or a single value under ``"name/slot"``. Vector and array inputs take a
+list with all their values::
+
+    {"z_position": 0.5, "head": [0.1, 0.2, 0.3], "hand/1": 0.7}
+    {"ts": 1700000000.123, "values": {"z_position": 0.5}}
+
+Binary frames are a little-endian header followed by ``count`` float32
+values for the first ``count`` slots of the batch layout::
+
+    magic       4s  b"BLMB"
+    version     B   format version
+    flags       B   0
+    reserved    H
+    layout_id   I   id of the layout the frame was packed for
+    count       I   number of values
+    ts          d   producer timestamp, seconds since the epoch (0 = none)
+
+The layout lists every scalar input and every slot or component of every
+array and vector input in order. It is announced with its id in the
+retained manifest, frames packed for an outdated layout are rejected.
+Vector and array inputs are only updated when a frame holds all of their
+components.
+"""
+
+import json
+import struct
+import zlib
+
+from .router import get_input_length
+
+
+TOPIC = "batch"
+MAGIC = b"BLMB"
+VERSION = 1
+HEADER = struct.Struct("<4sBBHIId")
+
+
+class BatchError(ValueError):
+    pass
+
+
+class BatchLayout:
+    """Slot order of binary batch frames"""
+
+    def __init__(self, slots=(), keep_all=(), vectors=None):
+        # ingest keys, the property name or (property name, slot)
+        self.slots = list(slots)
+        self.keep_all = frozenset(keep_all)
+        # property name -> length, for vector and array inputs
+        self.vectors = vectors or {}
+        # property name -> array size, 0 for scalar inputs
+        self.sizes = {}
+        for key in self.slots:
+            if isinstance(key, tuple):
+                self.sizes[key[0]] = key[1] + 1
+            else:
+                self.sizes[key] = 0
+        self.layout_id = zlib.crc32(json.dumps(self._slot_list()).encode())
+        self._values = struct.Struct(f"<{len(self.slots)}f")
+
+    def _slot_list(self):
+        return [[key[0], key[1]] if isinstance(key, tuple) else [key, None]
+                for key in self.slots]
+
+    def describe(self):
+        """Layout for the manifest"""
+        return {
+            "topic": TOPIC,
+            "magic": MAGIC.decode("ascii"),
+            "version": VERSION,
+            "header": HEADER.format,
+            "header_size": HEADER.size,
+            "header_fields": ["magic", "version", "flags", "reserved",
+                              "layout_id", "count", "ts"],
+            "layout_id": self.layout_id,
+            "slots": self._slot_list(),
+        }
+
+    def decode(self, payload):
+        """Decode a batch message into ([(key, value)], producer time)"""
+        if payload[:4] == MAGIC:
+            return self._decode_frame(payload)
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            raise BatchError("Payload is neither JSON nor a batch frame")
+        if not isinstance(data, dict):
+            raise BatchError("JSON batch must be an object")
+        producer_time = None
+        if isinstance(data.get("values"), dict):
+            if "ts" in data:
+                producer_time = float(data["ts"])
+            data = data["values"]
+        return self._decode_mapping(data), producer_time
+
+    def _decode_frame(self, payload):
+        if len(payload) < HEADER.size:
+            raise BatchError("Payload shorter than header")
+        _, version, _, _, layout_id, count, ts = HEADER.unpack_from(payload)
+        if version != VERSION:
+            raise BatchError(f"Unsupported version: {version}")
+        if layout_id != self.layout_id:
+            raise BatchError("Frame was packed for another layout")
+        if count > len(self.slots):
+            raise BatchError("More values than layout slots")
+        if len(payload) < HEADER.size + count * 4:
+            raise BatchError("Payload shorter than announced data")
+        if count == len(self.slots):
+            values = self._values.unpack_from(payload, HEADER.size)
+        else:
+            values = struct.unpack_from(f"<{count}f", payload, HEADER.size)
+        items = zip(self.slots, values)
+        if self.vectors:
+            items = self._group(items)
+        return list(items), (ts if ts > 0.0 else None)
+
+    def _group(self, items):
+        """Join the components of vector and array inputs into one value"""
+        vectors = self.vectors
+        grouped = []
+        parts = {}
+        for key, value in items:
+            if isinstance(key, tuple) and key[0] in vectors:
+                name = key[0]
+                components = parts.setdefault(name, [])
+                components.append(value)
+                if len(components) == vectors[name]:
+                    grouped.append((name, tuple(components)))
+            else:
+                grouped.append((key, value))
+        return grouped
+
+    def _decode_mapping(self, data):
+        items = []
+        sizes = self.sizes
+        for name, value in data.items():
+            size = sizes.get(name)
+            if size is None:
+                name, _, slot = name.rpartition('/')
+                if not name or not sizes.get(name) or name in self.vectors:
+                    continue
+                try:
+                    slot = int(slot)
+                    value = float(value)
+                except (ValueError, TypeError):
+                    continue
+                if 0 <= slot < sizes[name]:
+                    items.append(((name, slot), value))
+                continue
+            try:
+                if name in self.vectors:
+                    values = tuple(float(v) for v in value)
+                    if len(values) == size:
+                        items.append((name, values))
+                elif size:
+                    values = [float(v) for v in value]
+                    items.extend(((name, slot), v) for slot, v
+                                 in enumerate(values[:size]))
+                else:
+                    items.append((name, float(value)))
+            except (ValueError, TypeError):
+                continue
+        return items
+
+
+def build_batch_layout(scn):
+    """Batch layout of the input properties of a scene"""
+    slots = []
+    keep_all = []
+    vectors = {}
+    seen = set()
+    for prop in scn.mqtt_inputs:
+        name = prop.property_name
+        if not name or name == 'NOT_SET' or name in seen:
+            continue
+        seen.add(name)
+        length = get_input_length(prop)
+        if length:
+            vectors[name] = length
+            slots.extend((name, slot) for slot in range(length))
+        elif prop.array_size > 0:
+            slots.extend((name, slot) for slot in range(prop.array_size))
+        else:
+            slots.append(name)
+        if prop.keep_all_samples or prop.jitter_buffer:
+            keep_all.append(name)
+    return BatchLayout(slots, keep_all, vectors)
+
+
+def encode_frame(layout_id, values, ts=0.0):
+    """Pack a binary batch frame, for producers and tests"""
+    return HEADER.pack(MAGIC, VERSION, 0, 0, layout_id, len(values), ts) + \
+        struct.pack(f"<{len(values)}f", *values)
@@ -0,0 +1,178 @@
+"""Packed binary payloads for array streams.
+
+Every payload starts with a fixed 16 byte little-endian header followed by
+the element data, row by row::
+
+    magic       4s  b"BLMQ"
+    version     B   format version
+    dtype       B   element type, see DTYPES
+    components  B   values per element
+    flags       B   FLAG_DELTA for delta payloads, else 0
+    count       I   number of elements
+    frame       i   scene frame the data was captured on
+
+Delta payloads (``flags & FLAG_DELTA``) only carry changed elements. The
+header is followed by a uint32 range count, then for every range a uint32
+start index, a uint32 length and the data of ``length`` elements.
+
+The layout is announced in the retained manifest (see ``describe``), so
+consumers can decode payloads without guessing.
+"""
+
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+MAGIC = b"BLMQ"
+VERSION = 1
+HEADER = struct.Struct("<4sBBBBIi")
+
+FLAG_DELTA = 1
+
+RANGE_COUNT = struct.Struct("<I")
+RANGE = struct.Struct("<II")
+
+DTYPE_FLOAT32 = 1
+DTYPE_INT32 = 2
+DTYPE_UINT8 = 3
+
+# dtype code -> (name, struct format char, numpy dtype)
+DTYPES = {
+    DTYPE_FLOAT32: ("float32", "f", "<f4"),
+    DTYPE_INT32: ("int32", "i", "<i4"),
+    DTYPE_UINT8: ("uint8", "B", "<u1"),
+}
+
+
+class CodecError(ValueError):
+    pass
+
+
+def _dtype_code(dtype):
+    if dtype.kind == 'f':
+        return DTYPE_FLOAT32
+    if dtype.kind in 'iu' and dtype.itemsize > 1:
+        return DTYPE_INT32
+    if dtype.kind in 'biu':
+        return DTYPE_UINT8
+    raise CodecError(f"Unsupported dtype: {dtype}")
+
+
+def pack_header(dtype_code, components, count, frame=0, flags=0):
+    return HEADER.pack(MAGIC, VERSION, dtype_code, components, flags,
+                       count, frame)
+
+
+def encode_array(values, frame=0):
+    """Encode a NumPy array of shape (elements, components)"""
+    if values.ndim == 1:
+        values = values.reshape(-1, 1)
+    count, components = values.shape
+    code = _dtype_code(values.dtype)
+    data = np.ascontiguousarray(values, dtype=DTYPES[code][2]).tobytes()
+    return pack_header(code, components, count, frame) + data
+
+
+def encode_delta(values, ranges, frame=0):
+    """Encode the given (start, stop) element ranges of a NumPy array of
+    shape (elements, components) as a delta payload"""
+    count, components = values.shape
+    code = _dtype_code(values.dtype)
+    np_dtype = DTYPES[code][2]
+    parts = [pack_header(code, components, count, frame, FLAG_DELTA),
+             RANGE_COUNT.pack(len(ranges))]
+    for start, stop in ranges:
+        parts.append(RANGE.pack(start, stop - start))
+        parts.append(np.ascontiguousarray(values[start:stop],
+                                          dtype=np_dtype).tobytes())
+    return b"".join(parts)
+
+
+def encode_values(rows, frame=0):
+    """Encode a list of equal length float rows, without NumPy"""
+    count = len(rows)
+    components = len(rows[0]) if count else 0
+    flat = [v for row in rows for v in row]
+    data = struct.pack("<%df" % len(flat), *flat)
+    return pack_header(DTYPE_FLOAT32, components, count, frame) + data
+
+
+def decode_header(payload):
+    if len(payload) < HEADER.size:
+        raise CodecError("Payload shorter than header")
+    magic, version, code, components, flags, count, frame = \
+            HEADER.unpack_from(payload)
+    if magic != MAGIC:
+        raise CodecError("Bad magic")
+    if version != VERSION:
+        raise CodecError(f"Unsupported version: {version}")
+    if code not in DTYPES:
+        raise CodecError(f"Unknown dtype: {code}")
+    return {
+        "dtype": code,
+        "components": components,
+        "flags": flags,
+        "count": count,
+        "frame": frame,
+    }
+
+
+def _decode_rows(payload, header, count, offset):
+    name, fmt, np_dtype = DTYPES[header["dtype"]]
+    c = header["components"]
+    n = count * c
+    if len(payload) < offset + n * struct.calcsize(fmt):
+        raise CodecError("Payload shorter than announced data")
+    if np is not None:
+        rows = np.frombuffer(payload, dtype=np_dtype, count=n, offset=offset)
+        return rows.reshape(count, c)
+    flat = struct.unpack_from("<%d%s" % (n, fmt), payload, offset)
+    return [flat[i:i + c] for i in range(0, n, c)]
+
+
+def decode(payload):
+    """Decode a payload into (header, data).
+
+    For full payloads ``data`` holds the rows, a NumPy array of shape
+    (count, components) when NumPy is available, else a list of tuples.
+    For delta payloads it is a list of (start, rows) pairs.
+    """
+    header = decode_header(payload)
+    if not header["flags"] & FLAG_DELTA:
+        return header, _decode_rows(payload, header, header["count"],
+                                    HEADER.size)
+    itemsize = struct.calcsize(DTYPES[header["dtype"]][1])
+    offset = HEADER.size
+    (range_count,) = RANGE_COUNT.unpack_from(payload, offset)
+    offset += RANGE_COUNT.size
+    ranges = []
+    for _ in range(range_count):
+        start, length = RANGE.unpack_from(payload, offset)
+        offset += RANGE.size
+        ranges.append((start, _decode_rows(payload, header, length, offset)))
+        offset += length * header["components"] * itemsize
+    return header, ranges
+
+
+def describe():
+    """Schema of the binary format for the manifest"""
+    return {
+        "magic": MAGIC.decode("ascii"),
+        "version": VERSION,
+        "byte_order": "little",
+        "header": HEADER.format,
+        "header_size": HEADER.size,
+        "header_fields": ["magic", "version", "dtype", "components",
+                          "flags", "count", "frame"],
+        "dtypes": {str(code): name for code, (name, _, _) in DTYPES.items()},
+        "flags": {"delta": FLAG_DELTA},
+        "delta_ranges": {
+            "count": RANGE_COUNT.format,
+            "range": RANGE.format,
+            "range_fields": ["start", "length"],
+        },
+    }
@@ -0,0 +1,140 @@
+"""Cached accessors for output property data paths.
+
+A data path like ``bpy.data.objects["Cube"].location[2]`` is parsed once
+into the datablock it starts from and the steps below it. Reading the
+value then skips parsing and compiling, and the ``bpy.data`` lookup by
+name only happens again when the datablock was renamed or removed. Paths
+that don't follow this form are compiled once and evaluated from the code
+object.
+"""
+
+import ast
+
+import bpy
+
+from bpy.app.handlers import persistent
+
+
+class DataPathAccessor:
+
+    def __init__(self, data_path):
+        self.data_path = data_path
+        self._collection = None
+        self._id_name = None
+        self._steps = ()
+        self._code = None
+        self._id = None
+        self._last_error = None
+        self._parse_error = None
+        try:
+            self._parse()
+        except SyntaxError as e:
+            self._parse_error = e
+
+    def _parse(self):
+        tree = ast.parse(self.data_path, mode='eval')
+        steps = []
+        node = tree.body
+        while True:
+            if isinstance(node, ast.Attribute):
+                steps.append(('attr', node.attr))
+                node = node.value
+            elif isinstance(node, ast.Subscript) and \
+                 isinstance(node.slice, ast.Constant) and \
+                 isinstance(node.slice.value, (int, str)):
+                steps.append(('item', node.slice.value))
+                node = node.value
+            else:
+                break
+        steps.reverse()
+        # Expect bpy.data.<collection>[<name>] followed by the steps
+        if isinstance(node, ast.Name) and node.id == 'bpy' and \
+           len(steps) >= 3 and steps[0] == ('attr', 'data') and \
+           steps[1][0] == 'attr' and steps[2][0] == 'item' and \
+           isinstance(steps[2][1], str):
+            self._collection = steps[1][1]
+            self._id_name = steps[2][1]
+            self._steps = tuple(steps[3:])
+        else:
+            self._code = compile(tree, '<data_path>', 'eval')
+
+    def _resolve(self):
+        self._id = getattr(bpy.data, self._collection)[self._id_name]
+
+    def _read(self):
+        value = self._id
+        for kind, key in self._steps:
+            if kind == 'attr':
+                value = getattr(value, key)
+            else:
+                value = value[key]
+        return value
+
+    def get(self):
+        """Get the current value, raises like eval() of the path would"""
+        if self._parse_error is not None:
+            raise self._parse_error
+        if self._code is not None:
+            return eval(self._code, {"__builtins__": {}, "bpy": bpy})
+        if self._id is None:
+            self._resolve()
+        try:
+            if self._id.name != self._id_name:
+                # renamed, the path refers to a different datablock now
+                self._id = None
+                self._resolve()
+        except ReferenceError:
+            # removed
+            self._id = None
+            self._resolve()
+        return self._read()
+
+    def invalidate(self):
+        self._id = None
+
+    def report_error(self, error):
+        """Returns True the first time an error occurs, so it is only
+        reported once until the path works again"""
+        message = f"{type(error).__name__}: {error}"
+        if message == self._last_error:
+            return False
+        self._last_error = message
+        return True
+
+    def clear_error(self):
+        self._last_error = None
+
+
+_accessors = {}
+
+
+def get_accessor(data_path):
+    """Get the cached accessor for a data path"""
+    accessor = _accessors.get(data_path)
+    if accessor is None:
+        accessor = _accessors[data_path] = DataPathAccessor(data_path)
+    return accessor
+
+
+def invalidate_accessors():
+    """Forget all resolved datablocks and unused accessors"""
+    _accessors.clear()
+
+
+@persistent
+def invalidate_handler(*args):
+    invalidate_accessors()
+
+
+def register_handlers():
+    bpy.app.handlers.undo_post.append(invalidate_handler)
+    bpy.app.handlers.redo_post.append(invalidate_handler)
+    bpy.app.handlers.load_post.append(invalidate_handler)
+
+
+def unregister_handlers():
+    for handlers in (bpy.app.handlers.undo_post,
+                     bpy.app.handlers.redo_post,
+                     bpy.app.handlers.load_post):
+        if invalidate_handler in handlers:
+            handlers.remove(invalidate_handler)
@@ -0,0 +1,99 @@
+"""Delta streaming for attribute outputs.
+
+A delta encoder remembers the last published values of one output and
+only sends the element ranges that changed by more than an epsilon since
+then. A full keyframe is sent every N messages and whenever the element
+count or layout changes. Unchanged frames produce no message at all.
+
+JSON payloads look like::
+
+    {"type": "key", "frame": 12, "count": 3, "data": [[...], [...], [...]]}
+    {"type": "delta", "frame": 13, "count": 3, "ranges": [[1, [[...]]]]}
+
+Binary keyframes are regular codec payloads, binary deltas set
+``codec.FLAG_DELTA`` in the header.
+"""
+
+import json
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from . import codec
+
+
+def changed_ranges(changed):
+    """Get (start, stop) pairs of the runs of True in a boolean array"""
+    edges = np.flatnonzero(np.diff(np.concatenate(
+            ([False], changed, [False])).view(np.int8)))
+    return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+
+def _rows(values):
+    if values.dtype.kind != 'f':
+        values = values.astype('float64')
+    return values.tolist()
+
+
+class DeltaEncoder:
+
+    def __init__(self):
+        self._previous = None
+        self._since_keyframe = 0
+
+    def reset(self):
+        """Send a keyframe with the next message"""
+        self._previous = None
+
+    def encode(self, values, frame, epsilon=0.0, keyframe_interval=60,
+               binary=False):
+        """Encode an array of shape (elements, components).
+
+        Returns the payload, or None if nothing changed.
+        """
+        previous = self._previous
+        if previous is None or previous.shape != values.shape or \
+           previous.dtype != values.dtype or \
+           self._since_keyframe >= keyframe_interval:
+            self._previous = values.copy()
+            self._since_keyframe = 1
+            if binary:
+                return codec.encode_array(values, frame)
+            return json.dumps({"type": "key", "frame": frame,
+                               "count": len(values), "data": _rows(values)})
+
+        if values.dtype.kind == 'b':
+            diff = values != previous
+        else:
+            diff = np.abs(values - previous) > epsilon
+        changed = diff.any(axis=1) if diff.ndim > 1 else diff
+        if not changed.any():
+            return None
+        ranges = changed_ranges(changed)
+        # Only changed elements are taken over, so slow drifts below the
+        # epsilon still get sent once they add up
+        previous[changed] = values[changed]
+        self._since_keyframe += 1
+        if binary:
+            return codec.encode_delta(values, ranges, frame)
+        return json.dumps({
+            "type": "delta", "frame": frame, "count": len(values),
+            "ranges": [[start, _rows(values[start:stop])]
+                       for start, stop in ranges]})
+
+
+delta_encoders = {}
+
+
+def get_encoder(key):
+    encoder = delta_encoders.get(key)
+    if encoder is None:
+        encoder = delta_encoders[key] = DeltaEncoder()
+    return encoder
+
+
+def reset_all():
+    for encoder in delta_encoders.values():
+        encoder.reset()
@@ -0,0 +1,283 @@
+"""Per-frame filters for input values.
+
+Each input can run one filter over its received values:
+
+- ``DECAY``: hold a received value for some frames, then lower it by a
+  fixed rate per frame down to 0
+- ``EMA``: exponential moving average, moving a fraction of the way to
+  the received value every step
+- ``ONE_EURO``: the One Euro filter, a low-pass whose cutoff rises with
+  the speed of the signal, so slow motion is smooth and fast motion
+  doesn't lag
+- ``SLEW``: follow the received value, but change by at most a rate per
+  second
+
+The state of all filtered inputs lives in flat arrays with one channel
+per value (vector and array inputs have one per component), and one
+step per frame updates all channels at once. Only the channels whose
+output changed are written back to the scene.
+"""
+
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .router import get_input_length
+
+
+DECAY, EMA, ONE_EURO, SLEW = range(4)
+FILTER_KINDS = {'DECAY': DECAY, 'EMA': EMA, 'ONE_EURO': ONE_EURO, 'SLEW': SLEW}
+# Cutoff frequency (Hz) of the One Euro filter's speed estimate
+D_CUTOFF = 1.0
+# Smoothed outputs this close to the received value are snapped to it,
+# so the filter settles and stops writing
+SETTLE_EPSILON = 1e-6
+
+# Per channel state, kept when the configuration changes
+STATE = ("raw", "out", "current", "hold", "edx", "ready")
+PARAMS = ("kind", "hold_frames", "rate", "factor", "min_cutoff", "beta")
+
+
+class FilteredInput:
+    __slots__ = ("name", "start", "length", "vector", "slots")
+
+    def __init__(self, name, start, length, vector, slots):
+        self.name = name
+        # first channel of the input
+        self.start = start
+        self.length = length
+        # vector and array inputs are written as a whole
+        self.vector = vector
+        # scalar array inputs are written slot by slot
+        self.slots = slots
+
+
+def _alpha(cutoff, dt):
+    """Smoothing factor of a low-pass with the given cutoff frequency"""
+    return 1.0 / (1.0 + 1.0 / (2.0 * math.pi * cutoff * dt))
+
+
+class FilterEngine:
+    """Filter state of all filtered inputs, main thread only"""
+
+    def __init__(self):
+        # property name -> FilteredInput
+        self._inputs = {}
+        # channel -> FilteredInput
+        self._owners = []
+        self._allocate(0)
+        # True while a non-decay filter hasn't reached its received value
+        self.settling = False
+        # monotonic time of the last step on the update timer
+        self.last_timer_step = 0.0
+
+    def _allocate(self, count):
+        for name in STATE + PARAMS:
+            if np is not None:
+                dtype = np.int32 if name in ("kind", "hold", "hold_frames") \
+                    else np.float64
+                setattr(self, name, np.zeros(count, dtype=dtype))
+            else:
+                setattr(self, name, [0] * count)
+
+    def __bool__(self):
+        return bool(self._inputs)
+
+    def __contains__(self, name):
+        return name in self._inputs
+
+    def configure(self, scn):
+        """Take the filter settings from the input properties. Channels of
+        inputs that keep their filter keep their state."""
+        old_inputs = self._inputs
+        old_state = {name: getattr(self, name) for name in STATE}
+        inputs = {}
+        owners = []
+        params = []
+        for prop in scn.mqtt_inputs:
+            name = prop.property_name
+            kind = FILTER_KINDS.get(prop.filter_type)
+            if kind is None or name == 'NOT_SET' or name in inputs:
+                continue
+            length = get_input_length(prop)
+            slots = not length and prop.array_size > 0
+            if slots:
+                length = prop.array_size
+            inp = FilteredInput(name, len(owners), max(length, 1),
+                                bool(length) and not slots, slots)
+            inputs[name] = inp
+            owners.extend([inp] * inp.length)
+            params.extend([(kind, prop.decay_hold_peak_frames, prop.decay_rate
+                            if kind == DECAY else prop.filter_rate,
+                            prop.filter_factor, prop.filter_min_cutoff,
+                            prop.filter_beta)] * inp.length)
+        self._allocate(len(owners))
+        for channel, values in enumerate(params):
+            for name, value in zip(PARAMS, values):
+                getattr(self, name)[channel] = value
+        # Carry over the state of unchanged inputs
+        for name, inp in inputs.items():
+            old = old_inputs.get(name)
+            if old is None or old.length != inp.length:
+                continue
+            for state in STATE:
+                getattr(self, state)[inp.start:inp.start + inp.length] = \
+                    old_state[state][old.start:old.start + old.length]
+        self._inputs = inputs
+        self._owners = owners
+        # Step once, new settings may move the outputs
+        self.settling = bool(owners)
+
+    def receive(self, key, value):
+        """Feed a received value to the input's filter. Returns True if
+        the filter writes the value later, False if it should be written
+        right away: for decay, for the first value of an input and for
+        inputs without a filter."""
+        if isinstance(key, tuple):
+            name, slot = key
+        else:
+            name, slot = key, 0
+        inp = self._inputs.get(name)
+        if inp is None:
+            return False
+        values = value if isinstance(value, tuple) else (value,)
+        if slot + len(values) > inp.length:
+            return False
+        start = inp.start + slot
+        direct = self.kind[start] == DECAY or not self.ready[start]
+        for channel, v in enumerate(values, start):
+            self.raw[channel] = v
+            if direct:
+                self.out[channel] = v
+                self.current[channel] = v
+                self.hold[channel] = self.hold_frames[channel]
+                self.edx[channel] = 0.0
+                self.ready[channel] = 1
+        if direct:
+            return False
+        self.settling = True
+        return True
+
+    def step(self, dt, decay=True):
+        """Advance the filters by ``dt`` seconds, decay only when
+        ``decay`` is set. Returns [(key, value)] of the inputs whose output
+        changed."""
+        if not self._owners:
+            self.settling = False
+            return []
+        if np is not None:
+            changed = self._step_array(dt, decay)
+        else:
+            self.settling = False
+            changed = [channel for channel in range(len(self._owners))
+                       if self._step_channel(channel, dt, decay)]
+        return self._changed_values(changed)
+
+    def _step_array(self, dt, decay):
+        kind = self.kind
+        raw = self.raw
+        out = self.out
+        ready = self.ready > 0
+        new = out.copy()
+
+        if decay:
+            decaying = ready & (kind == DECAY)
+            holding = decaying & (self.hold > 0)
+            self.hold[holding] -= 1
+            decaying &= ~holding
+            self.current[decaying] = np.maximum(
+                    self.current[decaying] - self.rate[decaying], 0.0)
+            new[decaying] = np.maximum(
+                    np.minimum(self.current[decaying], out[decaying]), 0.0)
+
+        diff = raw - out
+        mask = ready & (kind == EMA)
+        new[mask] = out[mask] + self.factor[mask] * diff[mask]
+
+        mask = ready & (kind == ONE_EURO)
+        if mask.any():
+            edx = self.edx[mask]
+            edx += _alpha(D_CUTOFF, dt) * (diff[mask] / dt - edx)
+            self.edx[mask] = edx
+            cutoff = self.min_cutoff[mask] + self.beta[mask] * np.abs(edx)
+            alpha = 1.0 / (1.0 + 1.0 / (2.0 * np.pi * cutoff * dt))
+            new[mask] = out[mask] + alpha * diff[mask]
+
+        mask = ready & (kind == SLEW)
+        limit = self.rate[mask] * dt
+        new[mask] = out[mask] + np.clip(diff[mask], -limit, limit)
+
+        smoothed = ready & (kind != DECAY)
+        snap = smoothed & (np.abs(raw - new) < SETTLE_EPSILON)
+        new[snap] = raw[snap]
+        changed = np.flatnonzero(new != out)
+        self.out = new
+        self.settling = bool((smoothed & (new != raw)).any())
+        return changed.tolist()
+
+    def _step_channel(self, channel, dt, decay):
+        """Step a single channel, the fallback without NumPy. Returns True
+        if its output changed."""
+        if not self.ready[channel]:
+            return False
+        kind = self.kind[channel]
+        out = self.out[channel]
+        raw = self.raw[channel]
+        if kind == DECAY:
+            if not decay:
+                return False
+            if self.hold[channel] > 0:
+                self.hold[channel] -= 1
+                return False
+            self.current[channel] = max(self.current[channel] - self.rate[channel], 0.0)
+            new = max(min(self.current[channel], out), 0.0)
+        elif kind == EMA:
+            new = out + self.factor[channel] * (raw - out)
+        elif kind == ONE_EURO:
+            edx = self.edx[channel]
+            edx += _alpha(D_CUTOFF, dt) * ((raw - out) / dt - edx)
+            self.edx[channel] = edx
+            cutoff = self.min_cutoff[channel] + self.beta[channel] * abs(edx)
+            new = out + _alpha(cutoff, dt) * (raw - out)
+        else:
+            limit = self.rate[channel] * dt
+            new = out + max(-limit, min(raw - out, limit))
+        if kind != DECAY:
+            if abs(raw - new) < SETTLE_EPSILON:
+                new = raw
+            else:
+                self.settling = True
+        self.out[channel] = new
+        return new != out
+
+    def _changed_values(self, channels):
+        values = []
+        vectors = set()
+        out = self.out
+        owners = self._owners
+        for channel in channels:
+            inp = owners[channel]
+            if inp.vector:
+                vectors.add(inp.name)
+            elif inp.slots:
+                values.append(((inp.name, channel - inp.start), float(out[channel])))
+            else:
+                values.append((inp.name, float(out[channel])))
+        for name in vectors:
+            inp = self._inputs[name]
+            values.append((name, tuple(float(v) for v in
+                                       out[inp.start:inp.start + inp.length])))
+        return values
+
+    def get_stats(self):
+        return {
+            "inputs": len(self._inputs),
+            "channels": len(self._owners),
+            "settling": self.settling,
+        }
+
+
+filter_engine = FilterEngine()
@@ -0,0 +1,104 @@
+import threading
+import time
+
+from collections import namedtuple
+
+
+# A single received value. ``seq`` is a global, monotonically increasing
+# sequence number assigned when the sample entered the buffer.
+# ``recv_time`` is the wall clock time the network thread received it and
+# ``producer_time`` the producer's own timestamp, if it sent one.
+Sample = namedtuple("Sample", ["value", "seq", "recv_time", "producer_time"])
+
+
+class IngestBuffer:
+    """Thread-safe store for incoming values, coalesced per key.
+
+    The network thread pushes samples, the main thread swaps the whole
+    store out once per timer tick. Only the newest value per key is kept,
+    unless a sample is pushed with ``keep_all``, in which case it is also
+    queued in arrival order.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest = {}
+        self._samples = []
+        self._seq = 0
+        self._dropped = 0
+        # record(key, value, recv_time, producer_time) getting every
+        # pushed sample, or None
+        self.recorder = None
+
+    def push(self, key, value, keep_all=False, recv_time=None,
+             producer_time=None):
+        """Add a sample, returns True if it replaced a sample that was
+        never taken out of the buffer"""
+        if recv_time is None:
+            recv_time = time.time()
+        recorder = self.recorder
+        if recorder is not None:
+            recorder(key, value, recv_time, producer_time)
+        with self._lock:
+            self._seq += 1
+            sample = Sample(value, self._seq, recv_time, producer_time)
+            dropped = False
+            if keep_all:
+                self._samples.append((key, sample))
+            elif key in self._latest:
+                self._dropped += 1
+                dropped = True
+            self._latest[key] = sample
+            return dropped
+
+    def push_many(self, entries, recv_time=None, producer_time=None):
+        """Add several ``(key, value, keep_all)`` samples at once. They are
+        taken out of the buffer together by the next ``swap``. Returns the
+        keys whose unapplied samples were replaced."""
+        if recv_time is None:
+            recv_time = time.time()
+        recorder = self.recorder
+        if recorder is not None:
+            for key, value, _ in entries:
+                recorder(key, value, recv_time, producer_time)
+        dropped = []
+        with self._lock:
+            latest = self._latest
+            for key, value, keep_all in entries:
+                self._seq += 1
+                sample = Sample(value, self._seq, recv_time, producer_time)
+                if keep_all:
+                    self._samples.append((key, sample))
+                elif key in latest:
+                    self._dropped += 1
+                    dropped.append(key)
+                latest[key] = sample
+        return dropped
+
+    def swap(self):
+        """Take all pending data out of the buffer.
+
+        Returns ``(latest, samples)`` where ``latest`` maps each key to its
+        newest ``Sample`` and ``samples`` is the ordered list of
+        ``(key, Sample)`` for keep-all keys.
+        """
+        with self._lock:
+            latest = self._latest
+            samples = self._samples
+            self._latest = {}
+            self._samples = []
+        return latest, samples
+
+    def clear(self):
+        self.swap()
+
+    @property
+    def seq(self):
+        return self._seq
+
+    @property
+    def dropped(self):
+        return self._dropped
+
+    def __bool__(self):
+        return bool(self._latest)
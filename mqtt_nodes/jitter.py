@@ -0,0 +1,176 @@
+"""Jitter buffers for inputs that should move smoothly.
+
+Messages don't arrive as evenly as a producer sends them, so writing
+every value as it is drained makes motion stutter. An input with a
+jitter buffer keeps its last samples in a ring buffer instead, and on
+each frame change its value is evaluated at ``now - delay``, between the
+two samples around that time. The delay is a fixed, known latency that
+absorbs the variation of the arrival times.
+
+Samples are placed on the producer's clock when it sends timestamps.
+The offset to Blender's clock is the smallest ``recv_time -
+producer_time`` in the buffer, which follows clock drift and needs no
+clock synchronization; the delay is added on top of the fastest
+delivery. Without producer timestamps the receive time is used.
+"""
+
+import time
+from bisect import bisect_right
+
+
+class JitterBuffer:
+    """Ring buffer of the newest samples of one input key"""
+
+    def __init__(self, size, delay, interpolation):
+        self.size = size
+        self.delay = delay
+        self.interpolation = interpolation
+        self._times = [0.0] * size
+        self._values = [None] * size
+        # recv_time - producer_time of each sample
+        self._offsets = [0.0] * size
+        self._head = 0
+        self._count = 0
+        self._scalar = True
+        # samples older than the newest one, they are dropped
+        self.late = 0
+
+    def push(self, sample):
+        if sample.producer_time is not None:
+            t = sample.producer_time
+            offset = sample.recv_time - t
+        else:
+            t = sample.recv_time
+            offset = 0.0
+        if self._count and t <= self._times[self._head - 1]:
+            self.late += 1
+            return
+        value = sample.value
+        self._scalar = not isinstance(value, tuple)
+        head = self._head
+        self._times[head] = t
+        self._values[head] = (float(value),) if self._scalar else value
+        self._offsets[head] = offset
+        self._head = (head + 1) % self.size
+        self._count = min(self._count + 1, self.size)
+
+    def _ordered(self, items):
+        """Items of the buffer from the oldest to the newest sample"""
+        if self._count < self.size:
+            return items[:self._count]
+        return items[self._head:] + items[:self._head]
+
+    def evaluate(self, now):
+        """Get ``(value, pending)`` at ``now - delay`` on Blender's clock.
+        ``pending`` is True while newer samples lie ahead of that time."""
+        if not self._count:
+            return None, False
+        times = self._ordered(self._times)
+        values = self._ordered(self._values)
+        target = now - min(self._offsets[:self._count]) - self.delay
+        idx = bisect_right(times, target)
+        if idx == 0:
+            value = values[0]
+        elif idx == len(times):
+            value = values[-1]
+        elif self.interpolation == 'HERMITE':
+            value = hermite(times, values, idx - 1, target)
+        else:
+            t0, t1 = times[idx - 1], times[idx]
+            u = (target - t0) / (t1 - t0)
+            value = tuple(a + (b - a) * u
+                          for a, b in zip(values[idx - 1], values[idx]))
+        if self._scalar:
+            value = value[0]
+        return value, idx < len(times)
+
+
+def _tangent(times, values, k):
+    """Slope at sample ``k`` from its neighbours, one-sided at the ends"""
+    lo = max(k - 1, 0)
+    hi = min(k + 1, len(times) - 1)
+    dt = times[hi] - times[lo]
+    return tuple((b - a) / dt for a, b in zip(values[lo], values[hi]))
+
+
+def hermite(times, values, k, t):
+    """Cubic Hermite interpolation between samples ``k`` and ``k + 1``
+    with finite difference tangents, for unevenly spaced samples"""
+    t0, t1 = times[k], times[k + 1]
+    h = t1 - t0
+    u = (t - t0) / h
+    u2 = u * u
+    u3 = u2 * u
+    h00 = 2.0 * u3 - 3.0 * u2 + 1.0
+    h10 = (u3 - 2.0 * u2 + u) * h
+    h01 = 3.0 * u2 - 2.0 * u3
+    h11 = (u3 - u2) * h
+    m0 = _tangent(times, values, k)
+    m1 = _tangent(times, values, k + 1)
+    return tuple(h00 * p0 + h10 * d0 + h01 * p1 + h11 * d1
+                 for p0, p1, d0, d1
+                 in zip(values[k], values[k + 1], m0, m1))
+
+
+class JitterBuffers:
+    """The jitter buffers of all inputs that have one, main thread only"""
+
+    def __init__(self):
+        # property name -> (size, delay, interpolation)
+        self.settings = {}
+        # ingest key -> JitterBuffer
+        self._buffers = {}
+        # True while a buffer has samples that weren't evaluated yet
+        self.pending = False
+
+    def configure(self, scn):
+        """Take the jitter buffer settings from the input properties,
+        buffers whose settings changed start over"""
+        settings = {}
+        for prop in scn.mqtt_inputs:
+            if prop.jitter_buffer and prop.property_name != 'NOT_SET':
+                settings[prop.property_name] = (
+                        prop.jitter_size, prop.jitter_delay, prop.interpolation)
+        self.settings = settings
+        self._buffers = {key: buffer for key, buffer in self._buffers.items()
+                         if settings.get(key[0] if isinstance(key, tuple) else key)
+                         == (buffer.size, buffer.delay, buffer.interpolation)}
+
+    def __contains__(self, name):
+        return name in self.settings
+
+    def push(self, key, sample):
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            size, delay, interpolation = \
+                self.settings[key[0] if isinstance(key, tuple) else key]
+            buffer = self._buffers[key] = JitterBuffer(size, delay, interpolation)
+        buffer.push(sample)
+        self.pending = True
+
+    def evaluate(self, now=None):
+        """Get [(key, value)] of all buffers at the current time"""
+        if now is None:
+            now = time.time()
+        pending = False
+        values = []
+        for key, buffer in self._buffers.items():
+            value, ahead = buffer.evaluate(now)
+            if value is not None:
+                values.append((key, value))
+            pending = pending or ahead
+        self.pending = pending
+        return values
+
+    def clear(self):
+        self._buffers = {}
+        self.pending = False
+
+    def get_stats(self):
+        return {
+            "buffers": len(self._buffers),
+            "late": sum(buffer.late for buffer in self._buffers.values()),
+        }
+
+
+jitter_buffers = JitterBuffers()
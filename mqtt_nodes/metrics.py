@@ -0,0 +1,146 @@
+"""Runtime counters and timing histograms for the MQTT bridge.
+
+Recording is off by default. Call sites check ``metrics.enabled`` before
+doing any work, so the cost when disabled is a single attribute read.
+"""
+
+import bisect
+import threading
+import time
+
+from collections import deque
+
+
+# Histogram bucket upper bounds in seconds, 1 us to ~4 s in powers of two
+BUCKET_BOUNDS = [1e-6 * 2 ** i for i in range(23)]
+
+
+class Histogram:
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th percentile (0-100)"""
+        if not self.count:
+            return 0.0
+        rank = q / 100.0 * self.count
+        seen = 0
+        for idx, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                if idx < len(BUCKET_BOUNDS):
+                    return BUCKET_BOUNDS[idx]
+                return self.max
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+# Number of latency samples kept per input and stage
+LATENCY_WINDOW = 1024
+
+
+class LatencyWindow:
+    """The most recent latency samples, for exact percentiles"""
+
+    def __init__(self, size=LATENCY_WINDOW):
+        self.samples = deque(maxlen=size)
+
+    def observe(self, value):
+        self.samples.append(value)
+
+    def to_dict(self):
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {"count": 0}
+        last = len(ordered) - 1
+        return {
+            "count": len(ordered),
+            "p50": ordered[int(last * 0.50)],
+            "p95": ordered[int(last * 0.95)],
+            "p99": ordered[int(last * 0.99)],
+            "max": ordered[-1],
+        }
+
+
+class Metrics:
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # counter name -> key (input name, topic) -> value
+            self.counters = {}
+            self.histograms = {}
+            # input name -> stage -> LatencyWindow
+            self.latencies = {}
+            self.started = time.time()
+
+    def incr(self, name, key, n=1):
+        with self._lock:
+            counter = self.counters.get(name)
+            if counter is None:
+                counter = self.counters[name] = {}
+            counter[key] = counter.get(key, 0) + n
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def observe_latency(self, key, stage, seconds):
+        with self._lock:
+            stages = self.latencies.get(key)
+            if stages is None:
+                stages = self.latencies[key] = {}
+            window = stages.get(stage)
+            if window is None:
+                window = stages[stage] = LatencyWindow()
+            window.observe(seconds)
+
+    def total(self, name):
+        return sum(self.counters.get(name, {}).values())
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "since": self.started,
+                "counters": {name: dict(counter)
+                             for name, counter in self.counters.items()},
+                "histograms": {name: histogram.to_dict()
+                               for name, histogram in self.histograms.items()},
+                "latency": {key: {stage: window.to_dict()
+                                  for stage, window in stages.items()}
+                            for key, stages in self.latencies.items()},
+            }
+
+
+metrics = Metrics()
@@ -1,97 +1,650 @@
 import bpy
 
+import json
+import random
+import selectors
+import socket
+import struct
 import threading
+import time
 
-import paho.mqtt.client as mqtt
+from . import batch, codec, delta, driver_utils, protocol
+from .attribute_inputs import build_attribute_streams
+from .transport import create_transport
+from .ingest import IngestBuffer
+from .jitter import jitter_buffers
+from .filters import filter_engine
+from .router import TopicRouter, build_router, subscription_filters
+from .publisher import PublishWorker, PUBLISH_QUEUE_SIZE
+from .metrics import metrics
 
-from . import driver_utils, protocol
+# Connection states, shown in the MQTT panel
+STATE_DISCONNECTED = 'DISCONNECTED'
+STATE_CONNECTING = 'CONNECTING'
+STATE_CONNECTED = 'CONNECTED'
+# Waiting to retry after a failed or lost connection
+STATE_WAITING = 'WAITING'
 
-# Global variable for pending MQTT updates (similar to Foscap's pending_updates)
-pending_updates = []
+# Reconnect backoff in seconds, doubled after every failed attempt
+RECONNECT_MIN_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30.0
+# Give up on a connection attempt the broker doesn't answer (seconds)
+CONNECT_TIMEOUT = 10.0
+# Seconds between the transport's keepalive checks
+MISC_INTERVAL = 1.0
+
+# Commands for the network thread
+CMD_PUBLISH = 'publish'
+CMD_MANIFEST = 'manifest'
+CMD_SUBSCRIBE = 'subscribe'
+CMD_STOP = 'stop'
+
+
+def reconnect_delay(attempt):
+    """Seconds to wait before reconnect ``attempt`` (0 based), capped
+    exponential backoff with jitter"""
+    delay = min(RECONNECT_MAX_DELAY, RECONNECT_MIN_DELAY * 2 ** min(attempt, 16))
+    # Machines that lost the same broker don't all retry at once
+    return delay * random.uniform(0.5, 1.0)
+
+
+# Incoming values, coalesced per variable name (similar to Foscap's pending_updates)
+ingest_buffer = IngestBuffer()
+# Decoded arrays of attribute inputs, keyed by attribute input index
+attribute_ingest = IngestBuffer()
+
+
+def get_user_property(msg, name):
+    """Get an MQTT v5 user property of a message, None if not set"""
+    properties = getattr(msg, "properties", None)
+    for key, value in getattr(properties, "UserProperty", None) or ():
+        if key == name:
+            return value
+    return None
+
+
+def parse_payload(msg):
+    """Get (value, producer timestamp) from a message, None if the payload
+    is not a number.
+
+    The payload is either a plain number or a JSON object like
+    ``{"value": 1.5, "ts": 1700000000.123}``. A ``ts`` MQTT v5 user
+    property can carry the producer timestamp as well. Timestamps are
+    seconds since the epoch.
+    """
+    producer_time = None
+    try:
+        value = float(msg.payload)
+    except:
+        try:
+            data = json.loads(msg.payload)
+            value = float(data["value"])
+            if "ts" in data:
+                producer_time = float(data["ts"])
+        except:
+            return None
+    if producer_time is None:
+        ts = get_user_property(msg, "ts")
+        if ts is not None:
+            try:
+                producer_time = float(ts)
+            except ValueError:
+                pass
+    return value, producer_time
+
+
+def parse_vector_payload(msg, route):
+    """Get (values, producer timestamp) for a vector or array input, None
+    unless the payload holds exactly ``route.length`` values.
+
+    The payload is a JSON list, a JSON object like ``{"value": [0.1, 0.2,
+    0.3], "ts": 1700000000.123}``, packed little-endian float32 values or
+    a binary payload in the codec format.
+    """
+    payload = msg.payload
+    length = route.length
+    producer_time = None
+    values = None
+    if payload[:1] in (b"[", b"{"):
+        try:
+            data = json.loads(payload)
+            if isinstance(data, dict):
+                if "ts" in data:
+                    producer_time = float(data["ts"])
+                data = data["value"]
+            values = tuple(float(v) for v in data)
+        except (ValueError, TypeError, KeyError):
+            values = None
+    if values is None:
+        if payload[:4] == codec.MAGIC:
+            try:
+                header, rows = codec.decode(payload)
+            except (codec.CodecError, struct.error):
+                return None
+            if header["flags"] & codec.FLAG_DELTA:
+                return None
+            values = tuple(float(v) for row in rows for v in row)
+        elif len(payload) == route.packed.size:
+            values = route.packed.unpack(payload)
+        else:
+            return None
+    if len(values) != length:
+        return None
+    if producer_time is None:
+        ts = get_user_property(msg, "ts")
+        if ts is not None:
+            try:
+                producer_time = float(ts)
+            except ValueError:
+                pass
+    return values, producer_time
+
+
+class CommandQueue:
+    """Thread-safe commands for the network thread. A command put into an
+    empty queue writes to a socket pair, which wakes the thread's
+    selector. At most ``max_publishes`` publishes wait, beyond that the
+    oldest one is dropped."""
+
+    def __init__(self, max_publishes=PUBLISH_QUEUE_SIZE):
+        self._lock = threading.Lock()
+        self._commands = []
+        self._publishes = 0
+        self.max_publishes = max_publishes
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self.stopped = False
+
+    def fileno(self):
+        return self._wake_r.fileno()
+
+    def put(self, command, *args):
+        """Queue a command, returns the args of a publish dropped to make
+        room, or None"""
+        dropped = None
+        with self._lock:
+            commands = self._commands
+            wake = not commands
+            if command == CMD_PUBLISH:
+                if self._publishes >= self.max_publishes:
+                    for i, (queued, queued_args) in enumerate(commands):
+                        if queued == CMD_PUBLISH:
+                            dropped = queued_args
+                            del commands[i]
+                            break
+                else:
+                    self._publishes += 1
+            commands.append((command, args))
+        if wake:
+            try:
+                self._wake_w.send(b"\0")
+            except OSError:
+                # full, or closed by a stopped thread
+                pass
+        return dropped
+
+    def stop(self):
+        self.stopped = True
+        self.put(CMD_STOP)
+
+    def take(self):
+        """Get all waiting commands"""
+        # Drain the wake ups before taking the commands, so a command put
+        # after the swap always leaves a wake up behind
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        with self._lock:
+            commands = self._commands
+            self._commands = []
+            self._publishes = 0
+        return commands
+
+    def close(self):
+        self._wake_r.close()
+        self._wake_w.close()
 
 
 class MQTTConnection:
 
     def __init__(self):
         self._thread = None
-        self._keep_running = False
-        self._do_pub_manifest = False
+        # Commands for the network thread of the current session
+        self._commands = None
         self._client = None
+        # Manifest JSON, built on the main thread
+        self._manifest = None
+        self.state = STATE_DISCONNECTED
+        self.last_error = None
+        # time.monotonic() of the next connection attempt while waiting
+        self.retry_at = 0.0
+        self.attempts = 0
+        self._broker_port = 1883
+        self._transport = 'PAHO'
+        self._topic_prefix = ""
+        self._no_local = False
+        # Topic filters relative to the prefix, the ones the inputs need
+        # and the ones the broker was asked for (network thread only)
+        self._wanted_topics = set()
+        self._subscribed_topics = set()
+        self.router = TopicRouter()
+        self.batch_layout = batch.BatchLayout()
+        # relative topic -> attribute input streams
+        self.attribute_streams = {}
+        self._publisher = PublishWorker()
+        # Publishes the command queue dropped for newer ones
+        self.publishes_dropped = 0
 
     def _on_connect(client, userdata, flags, rc):
-        topic_prefix = userdata
-        client.subscribe(topic_prefix + "#")
+        connection = userdata
+        if client is not connection._client:
+            # A client the connection was stopped for
+            return
+        if rc != 0:
+            connection._set_state(client, STATE_CONNECTING,
+                                  f"refused by the broker (rc={rc})")
+            client.disconnect()
+            return
+        # A new session starts without subscriptions
+        connection._subscribed_topics = set()
+        connection._sync_subscriptions(client)
+        connection._pub_manifest(client)
+        connection.state = STATE_CONNECTED
+        connection.last_error = None
+        connection.attempts = 0
         print("[MQTT] connected.")
 
+    def _sync_subscriptions(self, client):
+        """Subscribe to the topics the inputs need and unsubscribe from the
+        ones they don't need anymore"""
+        wanted = self._wanted_topics
+        added = wanted - self._subscribed_topics
+        removed = self._subscribed_topics - wanted
+        prefix = self._topic_prefix
+        # Subscribe first, so renamed topics never miss messages
+        if added:
+            client.subscribe([prefix + topic for topic in sorted(added)])
+        if removed:
+            client.unsubscribe([prefix + topic for topic in sorted(removed)])
+        self._subscribed_topics = set(wanted)
+        if added or removed:
+            print(f"[MQTT] subscribed to {len(wanted)} topics "
+                  f"(+{len(added)} -{len(removed)})")
+
     def _on_message(client, userdata, msg):
+        recv_time = time.time()
+        connection = userdata
+        if client is not connection._client:
+            # Still delivered while a stopped client winds down
+            return
         full_topic = str(msg.topic)
         
-        # Split topic and filter out empty segments
-        topic_parts = [part for part in full_topic.split('/') if part]
-        
-        # Get the last non-empty segment as the variable name
-        if not topic_parts:
+        # Only topics below the prefix are routed to inputs
+        topic_prefix = connection._topic_prefix
+        if not full_topic.startswith(topic_prefix):
             return
-        var_name = topic_parts[-1]
-        
-        # Filter out empty topics and the manifest topic
-        if not var_name or var_name == "manifest":
+        rel_topic = full_topic[len(topic_prefix):]
+        if rel_topic == batch.TOPIC:
+            connection._on_batch(msg, recv_time)
+            return
+        streams = connection.attribute_streams.get(rel_topic.strip("/"))
+        if streams:
+            connection._on_attribute(streams, msg, recv_time)
+        matches = connection.router.match(rel_topic)
+        if not matches:
             return
         
+        # Payloads are decoded here, so the main thread only assigns
+        scalar = None
+        # Queue the update instead of processing directly (similar to Foscap pattern)
+        for route, captures in matches:
+            key = route.key_for(captures)
+            if key is not None:
+                if route.length:
+                    parsed = parse_vector_payload(msg, route)
+                else:
+                    if scalar is None:
+                        scalar = parse_payload(msg) or False
+                    parsed = scalar
+                if not parsed:
+                    continue
+                value, producer_time = parsed
+                dropped = ingest_buffer.push(key, value, route.keep_all,
+                                             recv_time, producer_time)
+                if metrics.enabled:
+                    metrics.incr("received", route.property_name)
+                    if dropped:
+                        metrics.incr("dropped", route.property_name)
+
+    def _on_batch(self, msg, recv_time):
+        layout = self.batch_layout
         try:
-            value = float(msg.payload)
-        except:
+            items, producer_time = layout.decode(msg.payload)
+        except (ValueError, TypeError) as e:
+            print(f"[MQTT] Ignoring batch message: {e}")
+            if metrics.enabled:
+                metrics.incr("batch_rejected", "all")
             return
-        # Queue the update instead of processing directly (similar to Foscap pattern)
-        pending_updates.append((var_name, value))
+        if producer_time is None:
+            ts = get_user_property(msg, "ts")
+            if ts is not None:
+                try:
+                    producer_time = float(ts)
+                except ValueError:
+                    pass
+        keep_all = layout.keep_all
+        entries = [(key, value,
+                    (key[0] if isinstance(key, tuple) else key) in keep_all)
+                   for key, value in items]
+        dropped = ingest_buffer.push_many(entries, recv_time, producer_time)
+        if metrics.enabled:
+            metrics.incr("batches", "all")
+            for key, _, _ in entries:
+                metrics.incr("received", key[0] if isinstance(key, tuple) else key)
+            for key in dropped:
+                metrics.incr("dropped", key[0] if isinstance(key, tuple) else key)
+
+    def _on_attribute(self, streams, msg, recv_time):
+        producer_time = None
+        ts = get_user_property(msg, "ts")
+        if ts is not None:
+            try:
+                producer_time = float(ts)
+            except ValueError:
+                pass
+        for stream in streams:
+            values = stream.decode(msg.payload)
+            if values is None:
+                if metrics.enabled:
+                    metrics.incr("attribute_rejected", stream.topic)
+                continue
+            dropped = attribute_ingest.push(stream.index, values, False,
+                                            recv_time, producer_time)
+            if metrics.enabled:
+                metrics.incr("received", stream.topic)
+                metrics.incr("bytes_received", stream.topic, len(msg.payload))
+                if dropped:
+                    metrics.incr("dropped", stream.topic)
 
     def _pub_manifest(self, client):
-        manifest = protocol.get_manifest()
-        client.publish(self._topic_prefix + "manifest", manifest,
-                       qos=0, retain=True)
-                
-    def _run(self):
-        print("[MQTT] Connecting to host:", self._broker_host)
-        client = mqtt.Client()
-        client.user_data_set(self._topic_prefix)
-        client.on_connect = MQTTConnection._on_connect
-        client.on_message = MQTTConnection._on_message
-        client.connect(self._broker_host, 1883, 60)
-        self._client = client
-        self._pub_manifest(client)
-        while self._keep_running:
-            client.loop(timeout=0.2)
-            #FIXME may need locking for race condition
-            if self._do_pub_manifest:
+        if self._manifest is not None:
+            client.publish(self._topic_prefix + "manifest", self._manifest,
+                           qos=0, retain=True)
+
+    def _set_state(self, client, state, error=None):
+        """Update the state, unless the connection was stopped for
+        ``client`` in the meantime"""
+        if self._client is not client:
+            return
+        if error is not None:
+            self.last_error = error
+            print(f"[MQTT] Connection to {self._broker_host}: {error}")
+        self.state = state
+
+    def _run(self, client, commands):
+        """Network thread: connect, handle traffic and commands, and
+        reconnect with backoff until the connection is stopped"""
+        try:
+            while not commands.stopped:
+                print("[MQTT] Connecting to host:", self._broker_host,
+                      "port:", self._broker_port, "transport:", self._transport)
+                self._set_state(client, STATE_CONNECTING)
+                try:
+                    client.connect(self._broker_host, self._broker_port, 60)
+                except (OSError, ValueError) as e:
+                    self._set_state(client, STATE_WAITING,
+                                    str(e) or type(e).__name__)
+                else:
+                    self._loop(client, commands)
+                if commands.stopped or client is not self._client:
+                    break
+                delay = reconnect_delay(self.attempts)
+                self.attempts += 1
+                self.retry_at = time.monotonic() + delay
+                self._set_state(client, STATE_WAITING)
+                print(f"[MQTT] Reconnecting in {delay:.1f} s")
+                self._wait(client, commands, delay)
+        finally:
+            try:
+                client.disconnect()
+            except Exception:
+                pass
+            client.close()
+            commands.close()
+
+    def _loop(self, client, commands):
+        """Handle traffic and commands until the connection is lost or
+        stopped. Sleeps in the selector until the socket or the command
+        queue is ready, or the next keepalive check is due."""
+        sock = client.socket()
+        if sock is None:
+            return
+        selector = selectors.DefaultSelector()
+        selector.register(commands, selectors.EVENT_READ)
+        events = selectors.EVENT_READ
+        if client.want_write():
+            events |= selectors.EVENT_WRITE
+        selector.register(sock, events)
+        now = time.monotonic()
+        connect_deadline = now + CONNECT_TIMEOUT
+        next_misc = now + MISC_INTERVAL
+        try:
+            while not commands.stopped:
+                timeout = next_misc - now
+                if self.state != STATE_CONNECTED:
+                    timeout = min(timeout, connect_deadline - now)
+                for key, mask in selector.select(max(timeout, 0.0)):
+                    if key.fileobj is commands:
+                        self._handle_commands(client, commands)
+                        continue
+                    rc = 0
+                    if mask & selectors.EVENT_READ:
+                        rc = client.loop_read()
+                    if not rc and mask & selectors.EVENT_WRITE:
+                        rc = client.loop_write()
+                    if rc:
+                        self._lost(client)
+                        return
+                now = time.monotonic()
+                if now >= next_misc:
+                    if client.loop_misc():
+                        self._lost(client)
+                        return
+                    next_misc = now + MISC_INTERVAL
+                if self.state != STATE_CONNECTED and now > connect_deadline:
+                    self._set_state(client, STATE_WAITING,
+                                    "no answer from the broker")
+                    client.disconnect()
+                    return
+                if client.socket() is not sock:
+                    # closed after an error
+                    self._lost(client)
+                    return
+                wanted = selectors.EVENT_READ
+                if client.want_write():
+                    wanted |= selectors.EVENT_WRITE
+                if wanted != events:
+                    events = wanted
+                    selector.modify(sock, events)
+        finally:
+            selector.close()
+
+    def _lost(self, client):
+        if self.state == STATE_CONNECTED:
+            self._set_state(client, STATE_WAITING, "connection lost")
+            # Deltas in flight are lost, start over with keyframes
+            delta.reset_all()
+
+    def _wait(self, client, commands, delay):
+        """Wait ``delay`` seconds before reconnecting, still handling
+        commands"""
+        deadline = time.monotonic() + delay
+        with selectors.DefaultSelector() as selector:
+            selector.register(commands, selectors.EVENT_READ)
+            while not commands.stopped:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0.0:
+                    return
+                if selector.select(timeout):
+                    self._handle_commands(client, commands)
+
+    def _handle_commands(self, client, commands):
+        connected = self.state == STATE_CONNECTED
+        for command, args in commands.take():
+            if command == CMD_PUBLISH:
+                if connected:
+                    self._send(client, *args)
+                else:
+                    self._dropped(args[0])
+            elif not connected:
+                # Subscriptions and the manifest are renewed on connect
+                continue
+            elif command == CMD_MANIFEST:
                 self._pub_manifest(client)
-                self._do_pub_manifest = False
+            elif command == CMD_SUBSCRIBE:
+                self._sync_subscriptions(client)
 
-    def run(self, broker_host, topic_prefix):
+    def run(self, broker_host, topic_prefix, port=1883, transport='PAHO',
+            no_local=False):
+        """Start connecting in the background, returns right away"""
         if self._thread:
             return
         ## set con parameters
         self._broker_host = broker_host
+        self._broker_port = port
+        self._transport = transport
+        self._no_local = no_local
         # fix topic prefix
         if topic_prefix[-1] != "/":
             topic_prefix += "/"
         self._topic_prefix = topic_prefix
+        self._manifest = protocol.get_manifest()
+        client = create_transport(transport, no_local)
+        client.user_data_set(self)
+        client.on_connect = MQTTConnection._on_connect
+        client.on_message = MQTTConnection._on_message
+        self._client = client
+        self.attempts = 0
+        self.last_error = None
+        self.state = STATE_CONNECTING
         ## start client thread
-        self._thread = threading.Thread(target=self._run)
-        self._keep_running = True
+        self._commands = CommandQueue()
+        self._thread = threading.Thread(target=self._run, name="mqtt-network",
+                                        args=(client, self._commands),
+                                        daemon=True)
         self._thread.start()
+        self._publisher.start(self._publish)
+
+    def is_connected(self):
+        client = self._client
+        if not client:
+            return False
+        try:
+            return client.is_connected()
+        except:
+            return False
+
+    def publish(self, topic, payload=None, encode=None, args=(), qos=0,
+                retain=False):
+        """Queue a publish to a topic below the prefix. The payload can be
+        built on the publish worker with ``encode(*args)``, so pass raw
+        snapshots rather than references to data that keeps changing.
+        Returns False if the publish queue is full."""
+        topic = self._topic_prefix + topic
+        if self._publisher.submit(topic, payload, encode, args, qos, retain):
+            return True
+        if metrics.enabled:
+            metrics.incr("publish_dropped", topic)
+        return False
+
+    def _publish(self, topic, payload, qos, retain):
+        # called on the publish worker thread, the network thread owns
+        # the client and sends the payload
+        commands = self._commands
+        if commands is not None:
+            dropped = commands.put(CMD_PUBLISH, topic, payload, qos, retain)
+            if dropped is not None:
+                # The network thread fell behind, the newest values win
+                self.publishes_dropped += 1
+                self._dropped(dropped[0])
+            return True
+        # Without a network thread, e.g. in the benchmarks
+        client = self._client
+        if client is None:
+            return False
+        return self._send(client, topic, payload, qos, retain)
+
+    def _dropped(self, topic):
+        """Count a publish dropped after it was encoded. The topic's delta
+        encoder already moved on as if it was sent, so its next message
+        has to be a keyframe."""
+        prefix = self._topic_prefix
+        if topic.startswith(prefix):
+            encoder = delta.delta_encoders.get(topic[len(prefix):])
+            if encoder is not None:
+                encoder.reset()
+        if metrics.enabled:
+            metrics.incr("publish_dropped", topic)
+
+    def _send(self, client, topic, payload, qos, retain):
+        if isinstance(payload, str):
+            # paho would encode it anyway, this way bytes_sent counts bytes
+            payload = payload.encode("utf-8")
+        if metrics.enabled:
+            start = time.perf_counter()
+        result = client.publish(topic, payload, qos=qos, retain=retain)
+        if result.rc != 0:
+            print(f"[MQTT] Failed to publish to topic '{topic}', rc={result.rc}")
+            self._dropped(topic)
+            return False
+        if metrics.enabled:
+            metrics.observe("publish_time", time.perf_counter() - start)
+            metrics.incr("published", topic)
+            metrics.incr("bytes_sent", topic, len(payload) if payload else 0)
+        return True
+
+    def update_inputs(self, scn):
+        """Rebuild the topic router after the input configuration changed"""
+        # Swapping the reference is atomic, the network thread picks up
+        # the new router with the next message
+        self.router = build_router(scn)
+        self.batch_layout = batch.build_batch_layout(scn)
+        self.attribute_streams = build_attribute_streams(scn)
+        jitter_buffers.configure(scn)
+        filter_engine.configure(scn)
+        templates = [route.template for route in self.router.routes]
+        templates.append(batch.TOPIC)
+        templates.extend(self.attribute_streams)
+        self._wanted_topics = subscription_filters(templates)
+        if self._commands is not None:
+            self._commands.put(CMD_SUBSCRIBE)
 
     def pub_manifest(self):
-        self._do_pub_manifest = True
+        """Publish the manifest again after the configuration changed"""
+        commands = self._commands
+        if commands is None:
+            return
+        self._manifest = protocol.get_manifest()
+        commands.put(CMD_MANIFEST)
 
     def stop(self):
-        if self._thread:
-            self._keep_running = False
-            self._thread.join()
-            self._thread = None
+        """Stop the connection without waiting for the network thread,
+        which disconnects and ends on its own. Callbacks of the stopped
+        client are ignored from now on."""
+        self._publisher.stop()
+        commands = self._commands
+        self._commands = None
+        self._thread = None
         self._client = None
+        if commands is not None:
+            commands.stop()
+        self.state = STATE_DISCONNECTED
         # Clear pending updates when stopping
-        global pending_updates
-        pending_updates.clear()
+        ingest_buffer.clear()
+        attribute_ingest.clear()
 
 
 mqtt_connection = MQTTConnection()
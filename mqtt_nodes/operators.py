@@ -3,6 +3,11 @@ import bpy
 from bpy.types import Operator
 
 from . import mqtt_connection
+from .attribute_buffers import attribute_buffers
+from .attribute_inputs import attribute_writer
+from .delta import delta_encoders
+from .recorder import session_recorder, replay_source, RecordingError
+from .scheduler import output_scheduler, drain_scheduler
 
 class MQTTAddInputProperty(Operator):
     """Adds an input property to the scene"""
@@ -25,6 +30,8 @@ class MQTTRemoveInputProperty(Operator):
     def execute(self, context):
         scn = context.scene
         scn.mqtt_inputs.remove(int(self.property_index))
+        mqtt_connection.mqtt_connection.update_inputs(scn)
+        mqtt_connection.mqtt_connection.pub_manifest()
         return {'FINISHED'}
 
 
@@ -36,6 +43,7 @@ class MQTTAddOutputProperty(Operator):
     def execute(self, context):
         scn = context.scene
         scn.mqtt_outputs.add()
+        output_scheduler.mark_dirty()
         return {'FINISHED'}
 
 
@@ -49,6 +57,8 @@ class MQTTRemoveOutputProperty(Operator):
     def execute(self, context):
         scn = context.scene
         scn.mqtt_outputs.remove(int(self.property_index))
+        output_scheduler.mark_dirty()
+        mqtt_connection.mqtt_connection.pub_manifest()
         return {'FINISHED'}
 
 
@@ -60,6 +70,7 @@ class MQTTAddAttributeOutputProperty(Operator):
     def execute(self, context):
         scn = context.scene
         scn.mqtt_attribute_outputs.add()
+        output_scheduler.mark_dirty()
         return {'FINISHED'}
 
 
@@ -72,7 +83,41 @@ class MQTTRemoveAttributeOutputProperty(Operator):
 
     def execute(self, context):
         scn = context.scene
+        attr_prop = scn.mqtt_attribute_outputs[int(self.property_index)]
+        attribute_buffers.discard(attr_prop.topic)
+        delta_encoders.pop(attr_prop.topic, None)
         scn.mqtt_attribute_outputs.remove(int(self.property_index))
+        output_scheduler.mark_dirty()
+        mqtt_connection.mqtt_connection.pub_manifest()
+        return {'FINISHED'}
+
+
+class MQTTAddAttributeInputProperty(Operator):
+    """Adds an attribute input property to the scene"""
+    bl_idname = "mqtt.add_attribute_input_property"
+    bl_label = "MQTT Add Attribute Input Property"
+
+    def execute(self, context):
+        scn = context.scene
+        scn.mqtt_attribute_inputs.add()
+        return {'FINISHED'}
+
+
+class MQTTRemoveAttributeInputProperty(Operator):
+    """Remove an attribute input property from the scene"""
+    bl_idname = "mqtt.remove_attribute_input_property"
+    bl_label = "MQTT Remove Attribute Input Property"
+
+    property_index : bpy.props.IntProperty()
+
+    def execute(self, context):
+        scn = context.scene
+        scn.mqtt_attribute_inputs.remove(int(self.property_index))
+        # Indices shift, pending arrays may belong to another input now
+        mqtt_connection.attribute_ingest.clear()
+        attribute_writer.discard(int(self.property_index))
+        mqtt_connection.mqtt_connection.update_inputs(scn)
+        mqtt_connection.mqtt_connection.pub_manifest()
         return {'FINISHED'}
 
 
@@ -85,12 +130,74 @@ class MQTTReconnectClient(Operator):
         mqtt_connection.mqtt_connection.stop()
         try:
             scn = bpy.context.scene
-            host = scn.mqtt_settings.broker_host
-            topic = scn.mqtt_settings.topic_prefix
-            mqtt_connection.mqtt_connection.run(host, topic)
-            # Timer registration is handled in __init__.py register() and post_file_load_handler
-            # It will be registered when the connection starts if not already registered
+            settings = scn.mqtt_settings
+            mqtt_connection.mqtt_connection.update_inputs(scn)
+            mqtt_connection.mqtt_connection.run(settings.broker_host,
+                                                settings.topic_prefix,
+                                                settings.broker_port,
+                                                settings.transport,
+                                                settings.no_local)
+            # The update timer stops without a connection
+            drain_scheduler.wake()
         except:
             return {'CANCELED'}
         return {'FINISHED'}
 
+
+class MQTTStartRecording(Operator):
+    """Record the received input samples to a file"""
+    bl_idname = "mqtt.start_recording"
+    bl_label = "MQTT Start Recording"
+
+    def execute(self, context):
+        path = bpy.path.abspath(context.scene.mqtt_settings.record_path)
+        try:
+            session_recorder.start(path)
+        except OSError as e:
+            self.report({'ERROR'}, f"Can't record to {path}: {e}")
+            return {'CANCELLED'}
+        mqtt_connection.ingest_buffer.recorder = session_recorder.record
+        mqtt_connection.attribute_ingest.recorder = \
+            session_recorder.record_attribute
+        return {'FINISHED'}
+
+
+class MQTTStopRecording(Operator):
+    """Stop recording and finish the file"""
+    bl_idname = "mqtt.stop_recording"
+    bl_label = "MQTT Stop Recording"
+
+    def execute(self, context):
+        mqtt_connection.ingest_buffer.recorder = None
+        mqtt_connection.attribute_ingest.recorder = None
+        session_recorder.stop()
+        return {'FINISHED'}
+
+
+class MQTTStartReplay(Operator):
+    """Replay a recorded session into the inputs"""
+    bl_idname = "mqtt.start_replay"
+    bl_label = "MQTT Start Replay"
+
+    def execute(self, context):
+        settings = context.scene.mqtt_settings
+        path = bpy.path.abspath(settings.replay_path)
+        try:
+            replay_source.start(path, settings.replay_mode,
+                                settings.replay_speed, settings.replay_loop)
+        except (OSError, RecordingError) as e:
+            self.report({'ERROR'}, f"Can't replay {path}: {e}")
+            return {'CANCELLED'}
+        # The update timer polls the replay like a connection
+        drain_scheduler.wake()
+        return {'FINISHED'}
+
+
+class MQTTStopReplay(Operator):
+    """Stop replaying"""
+    bl_idname = "mqtt.stop_replay"
+    bl_label = "MQTT Stop Replay"
+
+    def execute(self, context):
+        replay_source.stop()
+        return {'FINISHED'}
@@ -2,25 +2,66 @@ import bpy
 
 import json
 
+from . import codec
+from .attribute_buffers import ATTRIBUTE_LAYOUTS
+from .batch import build_batch_layout
+from .router import get_input_length
+
 
 def get_manifest():
     scn = bpy.context.scene
     inp_property_descs = []
     for prop in scn.mqtt_inputs:
         name = prop.property_name
-        inp_property_descs.append({"name" : name})
+        inp_property_descs.append({
+            "name" : name,
+            "topic" : prop.topic or name,
+            "array_size" : prop.array_size,
+            "value_type" : prop.value_type,
+            "length" : get_input_length(prop)
+        })
     
     out_property_descs = []
     for prop in scn.mqtt_outputs:
         if prop.data_path and prop.topic:
             out_property_descs.append({
                 "data_path": prop.data_path,
-                "topic": prop.topic
+                "topic": prop.topic,
+                "encoding": prop.encoding
+            })
+    
+    attr_output_descs = []
+    for prop in scn.mqtt_attribute_outputs:
+        if prop.object and prop.attribute_name and prop.topic:
+            attr_output_descs.append({
+                "object": prop.object.name,
+                "attribute": prop.attribute_name,
+                "topic": prop.topic,
+                "encoding": prop.encoding,
+                "delta": prop.delta_mode,
+                "keyframe_interval": prop.delta_keyframe_interval
+            })
+    
+    attr_input_descs = []
+    for prop in scn.mqtt_attribute_inputs:
+        if prop.object and prop.attribute_name and prop.topic:
+            attr_input_descs.append({
+                "object": prop.object.name,
+                "attribute": prop.attribute_name,
+                "topic": prop.topic,
+                "data_type": prop.data_type,
+                "domain": prop.domain,
+                "components": ATTRIBUTE_LAYOUTS[prop.data_type][2],
+                "resize": prop.resize
             })
     
     manifest = {
         "input_properties" : inp_property_descs,
-        "output_properties" : out_property_descs
+        "output_properties" : out_property_descs,
+        "attribute_outputs" : attr_output_descs,
+        "attribute_inputs" : attr_input_descs,
+        "binary_format" : codec.describe(),
+        "batch" : build_batch_layout(scn).describe()
     }
     return json.dumps(manifest)
 
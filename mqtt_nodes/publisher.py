@@ -0,0 +1,95 @@
+"""Publish worker thread.
+
+The main thread only captures raw value snapshots and submits them
+together with an encode function. Encoding the payload and handing it to
+the MQTT client happen on the worker thread, so timers and frame change
+handlers don't pay for ``json.dumps`` of large arrays.
+"""
+
+import queue
+import threading
+import time
+
+from .metrics import metrics
+
+
+# Maximum number of publishes waiting for the worker
+PUBLISH_QUEUE_SIZE = 256
+
+_STOP = object()
+
+
+class PublishWorker:
+
+    def __init__(self, maxsize=PUBLISH_QUEUE_SIZE):
+        self._maxsize = maxsize
+        self._queue = queue.Queue(maxsize)
+        self._thread = None
+        self._publish = None
+        self.dropped = 0
+        self.failed = 0
+
+    def start(self, publish):
+        """Start the worker, ``publish(topic, payload, qos, retain)`` is
+        called on the worker thread and returns True on success"""
+        if self._thread:
+            return
+        self._publish = publish
+        # A queue per thread, a stopped worker may still be finishing its
+        # last publish
+        self._queue = queue.Queue(self._maxsize)
+        self._thread = threading.Thread(target=self._run, name="mqtt-publish",
+                                        args=(self._queue,), daemon=True)
+        self._thread.start()
+
+    def submit(self, topic, payload=None, encode=None, args=(), qos=0,
+               retain=False):
+        """Queue a publish. Either ``payload`` is given, or it is built on
+        the worker with ``encode(*args)``; an encode result of None skips
+        the publish. Returns False if the queue is full."""
+        try:
+            self._queue.put_nowait((topic, payload, encode, args, qos, retain))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _run(self, jobs):
+        while True:
+            job = jobs.get()
+            if job is _STOP:
+                break
+            topic, payload, encode, args, qos, retain = job
+            try:
+                if encode is not None:
+                    if metrics.enabled:
+                        start = time.perf_counter()
+                        payload = encode(*args)
+                        metrics.observe("encode_time", time.perf_counter() - start)
+                    else:
+                        payload = encode(*args)
+                if payload is None:
+                    continue
+                if not self._publish(topic, payload, qos, retain):
+                    self.failed += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"[MQTT] Error publishing to topic '{topic}': {type(e).__name__}: {e}")
+
+    def stop(self, timeout=None):
+        """Drop waiting publishes and stop the worker thread. Waits up to
+        ``timeout`` seconds for the thread to end if given."""
+        if not self._thread:
+            return
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        self._queue.put(_STOP)
+        if timeout is not None:
+            self._thread.join(timeout)
+        self._thread = None
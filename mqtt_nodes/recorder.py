@@ -0,0 +1,592 @@
+"""Session recording and replay of input samples.
+
+The recorder sits on the ingest path: every sample pushed into the
+ingest buffer, from MQTT, batches or shared memory, and every array
+pushed for an attribute input is appended to a binary log with its
+timestamps. A replay source maps the log and pushes the samples into the
+ingest buffers again, so replayed data takes the same path as live data.
+
+Log layout, little endian. A header, then records starting with their
+type byte::
+
+    header   magic "BLRC", version u8, flags u8, reserved u16,
+             start time f64                                  (16 bytes)
+    key      type 1, key id u16, kind u8 (0 = input, 1 = attribute
+             input), slot i32 (-1 = none, attribute input index),
+             name length u16, name utf-8
+    sample   type 2, key id u16, flags u8, count u32, recv time f64,
+             [producer time f64], values float64[count], or for arrays
+             dtype u8, width u8, values dtype[count]
+    index    type 3, key count u32, key records, point count u32,
+             points (time f64, offset u64)
+    snapshot type 4, time f64, length u32, sample records
+    trailer  end time f64, index offset u64, magic "BLRI"    (20 bytes)
+
+A key record, the topic dictionary entry of an input, precedes the first
+sample of that input. Times are seconds since the epoch. Every second of
+recording starts with a snapshot holding the last sample of every key so
+far, and the index has a point to each snapshot, so replay can seek and
+restore all values without reading what comes before. The index and
+trailer are written when recording stops; a log without trailer, e.g.
+after a crash, is scanned once when it is opened.
+"""
+
+import mmap
+import struct
+import threading
+import time
+from bisect import bisect_right
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+MAGIC = b"BLRC"
+INDEX_MAGIC = b"BLRI"
+VERSION = 2
+HEADER = struct.Struct("<4sBBHd")
+KEY = struct.Struct("<BHBiH")
+SAMPLE = struct.Struct("<BHBId")
+PRODUCER_TIME = struct.Struct("<d")
+ARRAY = struct.Struct("<BB")
+COUNT = struct.Struct("<I")
+POINT = struct.Struct("<dQ")
+SNAPSHOT = struct.Struct("<BdI")
+TRAILER = struct.Struct("<dQ4s")
+
+REC_KEY = 1
+REC_SAMPLE = 2
+REC_INDEX = 3
+REC_SNAPSHOT = 4
+# Key kinds
+KIND_INPUT = 0
+KIND_ATTRIBUTE = 1
+# Sample flags
+FLAG_PRODUCER_TIME = 1
+FLAG_VECTOR = 2
+FLAG_ARRAY = 4
+# Element types of attribute arrays, by dtype code
+ARRAY_DTYPES = ("<f4", "<i4", "|b1")
+
+# Seconds of recording between two index points
+INDEX_INTERVAL = 1.0
+# How often the recorder's writer thread writes to the file (seconds)
+FLUSH_INTERVAL = 0.2
+MAX_KEYS = 0xFFFF
+
+REPLAY_MODES = ('REALTIME', 'FAST', 'FRAME')
+
+
+class RecordingError(ValueError):
+    pass
+
+
+_value_structs = {}
+
+
+def values_struct(count):
+    values = _value_structs.get(count)
+    if values is None:
+        values = _value_structs[count] = struct.Struct(f"<{count}d")
+    return values
+
+
+def pack_key(key_id, kind, key):
+    if kind == KIND_ATTRIBUTE:
+        name, slot = "", key
+    elif isinstance(key, tuple):
+        name, slot = key
+    else:
+        name, slot = key, -1
+    name = name.encode("utf-8")
+    return KEY.pack(REC_KEY, key_id, kind, slot, len(name)) + name
+
+
+class SessionRecorder:
+    """Appends the samples of the ingest path to a log file. Samples are
+    collected in memory and written by a writer thread, so neither the
+    network thread nor the main thread waits for the disk.
+
+    ``record`` and ``record_attribute`` are the recorders of the ingest
+    buffer and of the attribute ingest buffer."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop_event = None
+        self._file = None
+        self.path = ""
+        self._reset()
+
+    def _reset(self):
+        self._pending = bytearray()
+        self._written = 0
+        # (kind, ingest key) -> key id
+        self._keys = {}
+        # key id -> last sample record, for the snapshots
+        self._last = {}
+        self._index = []
+        self._next_index = 0.0
+        self._end_time = 0.0
+        self.samples = 0
+        self.skipped = 0
+
+    @property
+    def active(self):
+        return self._thread is not None
+
+    def start(self, path):
+        """Start recording to ``path``, replacing the file"""
+        if self._thread is not None:
+            return
+        self._file = open(path, "wb")
+        self.path = path
+        self._reset()
+        header = HEADER.pack(MAGIC, VERSION, 0, 0, time.time())
+        self._file.write(header)
+        self._written = len(header)
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="mqtt-recorder",
+                                        args=(self._file, self._stop_event),
+                                        daemon=True)
+        self._thread.start()
+        print(f"[MQTT] Recording to {path}")
+
+    def record(self, key, value, recv_time, producer_time):
+        """Add an input sample, called on the thread pushing it"""
+        if isinstance(value, tuple):
+            values = value
+            flags = FLAG_VECTOR
+        else:
+            values = (value,)
+            flags = 0
+        try:
+            data = values_struct(len(values)).pack(*values)
+        except struct.error:
+            # not numbers
+            self.skipped += 1
+            return
+        self._append(KIND_INPUT, key, flags, len(values), data, recv_time,
+                     producer_time)
+
+    def record_attribute(self, index, values, recv_time, producer_time):
+        """Add the array of an attribute input, called on the thread
+        pushing it"""
+        try:
+            code = ARRAY_DTYPES.index(values.dtype.str)
+        except (AttributeError, ValueError):
+            code = None
+        if code is None or values.ndim != 2:
+            self.skipped += 1
+            return
+        data = ARRAY.pack(code, values.shape[1]) + values.tobytes()
+        self._append(KIND_ATTRIBUTE, index, FLAG_ARRAY, values.size, data,
+                     recv_time, producer_time)
+
+    def _append(self, kind, key, flags, count, data, recv_time, producer_time):
+        if producer_time is not None:
+            flags |= FLAG_PRODUCER_TIME
+            data = PRODUCER_TIME.pack(producer_time) + data
+        with self._lock:
+            if self._thread is None:
+                return
+            pending = self._pending
+            key_id = self._keys.get((kind, key))
+            if key_id is None:
+                key_id = len(self._keys)
+                if key_id >= MAX_KEYS:
+                    self.skipped += 1
+                    return
+                self._keys[(kind, key)] = key_id
+                pending += pack_key(key_id, kind, key)
+            if recv_time >= self._next_index:
+                # Values so far, so replay can start here
+                snapshot = b"".join(self._last.values())
+                self._index.append((recv_time, self._written + len(pending)))
+                self._next_index = recv_time + INDEX_INTERVAL
+                pending += SNAPSHOT.pack(REC_SNAPSHOT, recv_time, len(snapshot))
+                pending += snapshot
+            sample = SAMPLE.pack(REC_SAMPLE, key_id, flags, count,
+                                 recv_time) + data
+            self._last[key_id] = sample
+            pending += sample
+            self._end_time = max(self._end_time, recv_time)
+            self.samples += 1
+
+    def _take(self):
+        with self._lock:
+            data = self._pending
+            self._pending = bytearray()
+            self._written += len(data)
+        return data
+
+    def _run(self, file, stop_event):
+        try:
+            while not stop_event.wait(FLUSH_INTERVAL):
+                data = self._take()
+                if data:
+                    file.write(data)
+            file.write(self._take())
+            file.write(self._pack_index())
+        except OSError as e:
+            print(f"[MQTT] Recording to {self.path} failed: {e}")
+        finally:
+            file.close()
+
+    def _pack_index(self):
+        with self._lock:
+            offset = self._written
+            keys = list(self._keys.items())
+            points = list(self._index)
+            end_time = self._end_time
+        parts = [bytes((REC_INDEX,)), COUNT.pack(len(keys))]
+        parts.extend(pack_key(key_id, kind, key) for (kind, key), key_id in keys)
+        parts.append(COUNT.pack(len(points)))
+        parts.extend(POINT.pack(t, pos) for t, pos in points)
+        parts.append(TRAILER.pack(end_time, offset, INDEX_MAGIC))
+        return b"".join(parts)
+
+    def stop(self):
+        """Stop recording and finish the file"""
+        thread = self._thread
+        if thread is None:
+            return
+        with self._lock:
+            self._thread = None
+        self._stop_event.set()
+        thread.join()
+        self._file = None
+        self._last = {}
+        print(f"[MQTT] Recorded {self.samples} samples to {self.path}")
+        if self.skipped:
+            print(f"[MQTT] {self.skipped} samples could not be recorded")
+
+    def get_stats(self):
+        return {
+            "active": self.active,
+            "samples": self.samples,
+            "skipped": self.skipped,
+            "bytes": self._written + len(self._pending),
+        }
+
+
+class ReplaySource:
+    """Pushes the samples of a recorded log into the ingest buffers.
+
+    The log is memory mapped and read from a cursor, so even long logs
+    are never loaded as a whole. ``REALTIME`` and ``FAST`` replay follow
+    the wall clock, ``FAST`` at ``speed`` times the recorded rate.
+    ``FRAME`` replay follows the timeline, the recording starting at the
+    scene's start frame, so renders get the same values every time: a
+    seek restores the values of the snapshot before the target and reads
+    on from there.
+    """
+
+    def __init__(self):
+        self._file = None
+        self._mm = None
+        self.path = ""
+        self.mode = 'REALTIME'
+        self.speed = 1.0
+        self.loop = False
+        # key id -> (kind, ingest key)
+        self._keys = {}
+        self._index_times = []
+        self._index_offsets = []
+        self._data_start = HEADER.size
+        self._end = 0
+        self.start_time = 0.0
+        self.end_time = 0.0
+        self._pos = 0
+        self._time = 0.0
+        self._wall_start = 0.0
+        # Push the next snapshot, after a seek
+        self._restore = False
+        self.samples = 0
+
+    @property
+    def active(self):
+        return self._mm is not None
+
+    @property
+    def frame_locked(self):
+        return self._mm is not None and self.mode == 'FRAME'
+
+    @property
+    def position(self):
+        """Seconds into the recording"""
+        return self._time - self.start_time
+
+    @property
+    def duration(self):
+        return self.end_time - self.start_time
+
+    def start(self, path, mode='REALTIME', speed=1.0, loop=False):
+        """Open a log and start replaying it"""
+        self.stop()
+        file = open(path, "rb")
+        try:
+            mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            file.close()
+            raise RecordingError("empty file")
+        try:
+            self._open(mm)
+        except (RecordingError, struct.error) as e:
+            mm.close()
+            file.close()
+            if isinstance(e, struct.error):
+                e = RecordingError("damaged log")
+            raise e
+        self._file = file
+        self._mm = mm
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self.loop = loop
+        self.samples = 0
+        self._rewind()
+        print(f"[MQTT] Replaying {path}, {len(self._keys)} inputs, "
+              f"{self.duration:.1f} s")
+
+    def _open(self, mm):
+        if len(mm) < HEADER.size:
+            raise RecordingError("file too small")
+        magic, version, _, _, start_time = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise RecordingError("not a version %d recording" % VERSION)
+        self._keys = {}
+        self._index_times = []
+        self._index_offsets = []
+        self.start_time = start_time
+        if len(mm) >= HEADER.size + TRAILER.size:
+            end_time, offset, index_magic = TRAILER.unpack_from(
+                    mm, len(mm) - TRAILER.size)
+            if index_magic == INDEX_MAGIC:
+                self._end = offset
+                self._read_index(mm, offset)
+                self.end_time = max(end_time, self.start_time)
+                return
+        # Recording didn't finish, find the dictionary and index points
+        self._end = len(mm)
+        self.end_time = start_time
+        self._scan(mm)
+
+    def _read_index(self, mm, pos):
+        if mm[pos] != REC_INDEX:
+            raise RecordingError("index not found")
+        count = COUNT.unpack_from(mm, pos + 1)[0]
+        pos += 1 + COUNT.size
+        for _ in range(count):
+            pos = self._read_key(mm, pos)
+        count = COUNT.unpack_from(mm, pos)[0]
+        pos += COUNT.size
+        for _ in range(count):
+            t, offset = POINT.unpack_from(mm, pos)
+            self._index_times.append(t)
+            self._index_offsets.append(offset)
+            pos += POINT.size
+        if self._index_times:
+            self.start_time = self._index_times[0]
+
+    def _read_key(self, mm, pos):
+        _, key_id, kind, slot, length = KEY.unpack_from(mm, pos)
+        pos += KEY.size
+        name = bytes(mm[pos:pos + length]).decode("utf-8", "replace")
+        if kind == KIND_ATTRIBUTE:
+            self._keys[key_id] = (kind, slot)
+        else:
+            self._keys[key_id] = (kind, name if slot < 0 else (name, slot))
+        return pos + length
+
+    def _scan(self, mm):
+        pos = HEADER.size
+        end = self._end
+        while pos < end:
+            rtype = mm[pos]
+            if rtype == REC_KEY:
+                if pos + KEY.size > end:
+                    break
+                _, _, _, _, length = KEY.unpack_from(mm, pos)
+                if pos + KEY.size + length > end:
+                    break
+                pos = self._read_key(mm, pos)
+            elif rtype == REC_SAMPLE:
+                if pos + SAMPLE.size > end:
+                    break
+                size = self._sample_size(mm, pos)
+                if pos + size > end:
+                    break
+                self.end_time = SAMPLE.unpack_from(mm, pos)[4]
+                pos += size
+            elif rtype == REC_SNAPSHOT:
+                if pos + SNAPSHOT.size > end:
+                    break
+                _, t, length = SNAPSHOT.unpack_from(mm, pos)
+                if pos + SNAPSHOT.size + length > end:
+                    break
+                self._index_times.append(t)
+                self._index_offsets.append(pos)
+                pos += SNAPSHOT.size + length
+            else:
+                break
+        # Cut off a partly written record
+        self._end = pos
+        if self._index_times:
+            self.start_time = self._index_times[0]
+
+    @staticmethod
+    def _sample_size(mm, pos):
+        _, _, flags, count, _ = SAMPLE.unpack_from(mm, pos)
+        size = SAMPLE.size
+        if flags & FLAG_PRODUCER_TIME:
+            size += PRODUCER_TIME.size
+        if flags & FLAG_ARRAY:
+            code = mm[pos + size]
+            if code >= len(ARRAY_DTYPES):
+                raise RecordingError("unknown array type")
+            return size + ARRAY.size + count * int(ARRAY_DTYPES[code][2])
+        return size + count * 8
+
+    def _rewind(self):
+        self._pos = self._data_start
+        self._time = self.start_time
+        self._wall_start = time.monotonic()
+        self._restore = False
+
+    def _seek(self, target):
+        """Move the cursor to the snapshot before ``target``, the next read
+        restores its values"""
+        idx = bisect_right(self._index_times, target) - 1
+        if idx < 0:
+            self._pos = self._data_start
+            self._time = self.start_time
+            self._restore = False
+        else:
+            self._pos = self._index_offsets[idx]
+            self._time = self._index_times[idx]
+            self._restore = True
+
+    def poll(self, ingest_buffer, attribute_ingest=None, keep_all=(),
+             frame_time=None):
+        """Push the samples up to the current replay time into the ingest
+        buffers, returns the number of samples pushed. ``frame_time`` is
+        the seconds since the start frame, for frame locked replay."""
+        if self._mm is None:
+            return 0
+        if self.mode == 'FRAME':
+            if frame_time is None:
+                return 0
+            target = self.start_time + frame_time
+            # Jumps on the timeline seek, playback reads on
+            if target < self._time or target > self._time + 2.0 * INDEX_INTERVAL:
+                self._seek(target)
+        else:
+            speed = self.speed if self.mode == 'FAST' else 1.0
+            target = self.start_time + (time.monotonic() - self._wall_start) * speed
+        pushed = self._read(ingest_buffer, attribute_ingest, keep_all, target)
+        if self.mode != 'FRAME' and self._pos >= self._end:
+            if self.loop:
+                self._rewind()
+            else:
+                print(f"[MQTT] Replay of {self.path} finished")
+                self.stop()
+        return pushed
+
+    def _read(self, ingest_buffer, attribute_ingest, keep_all, target):
+        mm = self._mm
+        pos = self._pos
+        end = self._end
+        # Replayed samples get timestamps as if they arrived now
+        shift = time.time() - target
+        pushed = 0
+        while pos < end:
+            rtype = mm[pos]
+            if rtype == REC_KEY:
+                pos = self._read_key(mm, pos)
+                continue
+            if rtype == REC_SNAPSHOT:
+                _, t, length = SNAPSHOT.unpack_from(mm, pos)
+                if t > target:
+                    break
+                pos += SNAPSHOT.size
+                if self._restore:
+                    self._restore = False
+                    stop = pos + length
+                    while pos < stop:
+                        pos = self._push(mm, pos, ingest_buffer,
+                                         attribute_ingest, keep_all, shift)
+                        pushed += 1
+                else:
+                    # Read on from before, the values are up to date
+                    pos += length
+                self._time = t
+                continue
+            if rtype != REC_SAMPLE:
+                pos = end
+                break
+            recv_time = SAMPLE.unpack_from(mm, pos)[4]
+            if recv_time > target:
+                break
+            pos = self._push(mm, pos, ingest_buffer, attribute_ingest,
+                             keep_all, shift)
+            self._time = recv_time
+            pushed += 1
+        if pos >= end:
+            self._time = max(self._time, target)
+        self._pos = pos
+        self.samples += pushed
+        return pushed
+
+    def _push(self, mm, pos, ingest_buffer, attribute_ingest, keep_all, shift):
+        """Push the sample record at ``pos``, returns the position after
+        it"""
+        _, key_id, flags, count, recv_time = SAMPLE.unpack_from(mm, pos)
+        pos += SAMPLE.size
+        producer_time = None
+        if flags & FLAG_PRODUCER_TIME:
+            producer_time = PRODUCER_TIME.unpack_from(mm, pos)[0] + shift
+            pos += PRODUCER_TIME.size
+        kind, key = self._keys.get(key_id, (None, None))
+        if flags & FLAG_ARRAY:
+            code, width = ARRAY.unpack_from(mm, pos)
+            pos += ARRAY.size
+            dtype = ARRAY_DTYPES[code]
+            size = count * int(dtype[2])
+            if kind == KIND_ATTRIBUTE and attribute_ingest is not None \
+                    and np is not None:
+                values = np.frombuffer(mm, dtype=dtype, count=count,
+                                       offset=pos).reshape(-1, width)
+                # A copy, the file is unmapped when replay stops
+                attribute_ingest.push(key, values.copy(), False,
+                                      recv_time + shift, producer_time)
+            return pos + size
+        if kind == KIND_INPUT:
+            values = values_struct(count).unpack_from(mm, pos)
+            value = values if flags & FLAG_VECTOR else values[0]
+            ingest_buffer.push(key, value,
+                               (key[0] if isinstance(key, tuple) else key) in keep_all,
+                               recv_time + shift, producer_time)
+        return pos + count * 8
+
+    def stop(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._file.close()
+        self._mm = None
+        self._file = None
+
+    def get_stats(self):
+        return {
+            "active": self.active,
+            "mode": self.mode,
+            "position": self.position if self.active else 0.0,
+            "duration": self.duration if self.active else 0.0,
+            "samples": self.samples,
+        }
+
+
+session_recorder = SessionRecorder()
+replay_source = ReplaySource()
@@ -0,0 +1,171 @@
+"""Topic router for MQTT input properties.
+
+Topic templates are compiled into a trie of topic segments, so looking up
+an incoming topic costs O(topic depth) instead of a scan over all inputs.
+Templates follow MQTT filter syntax: ``+`` matches one segment and ``#``
+matches all remaining segments. For scalar inputs with an array size,
+the numeric segment matched by the first ``+`` selects the array slot,
+messages with other segments are ignored. Vector and
+array inputs get their whole value from a single message.
+"""
+
+
+import struct
+
+
+def split_topic(topic):
+    """Split a topic into its non-empty segments"""
+    return [part for part in topic.split('/') if part]
+
+
+class Route:
+    """Where the values of one input template go"""
+
+    def __init__(self, property_name, template, array_size=0, keep_all=False,
+                 length=0):
+        self.property_name = property_name
+        self.template = template
+        self.array_size = array_size
+        self.keep_all = keep_all
+        # values per message for vector and array inputs, 0 for scalars
+        self.length = length
+        self.packed = struct.Struct(f"<{length}f") if length else None
+
+    def slot_for(self, segment):
+        """Get the array slot for a wildcard segment, None if it is not a
+        number or out of range"""
+        try:
+            slot = int(segment)
+        except ValueError:
+            return None
+        if 0 <= slot < self.array_size:
+            return slot
+        return None
+
+    def key_for(self, captures):
+        """Get the ingest key for a match: the property name for scalar
+        inputs, (property name, slot) for array inputs"""
+        if self.length or self.array_size <= 0 or not captures:
+            return self.property_name
+        slot = self.slot_for(captures[0])
+        if slot is None:
+            return None
+        return (self.property_name, slot)
+
+
+class _Node:
+    __slots__ = ("children", "routes", "rest_routes")
+
+    def __init__(self):
+        self.children = {}
+        # routes whose template ends at this node
+        self.routes = []
+        # routes whose template ends with '#' at this node
+        self.rest_routes = []
+
+
+class TopicRouter:
+
+    def __init__(self, routes=(), input_indices=None, vector_lengths=None):
+        self._root = _Node()
+        self.routes = []
+        # property name -> indices into scene.mqtt_inputs
+        self.input_indices = input_indices or {}
+        # property name -> values per message, for vector and array inputs
+        self.vector_lengths = vector_lengths or {}
+        for route in routes:
+            self.add(route)
+
+    def add(self, route):
+        node = self._root
+        for segment in split_topic(route.template):
+            if segment == '#':
+                node.rest_routes.append(route)
+                break
+            node = node.children.setdefault(segment, _Node())
+        else:
+            node.routes.append(route)
+        self.routes.append(route)
+
+    def match(self, topic):
+        """Get all (route, captures) pairs matching a topic relative to the
+        topic prefix. ``captures`` holds the segments matched by ``+``."""
+        matches = []
+        self._match(self._root, split_topic(topic), 0, (), matches)
+        return matches
+
+    def _match(self, node, segments, depth, captures, matches):
+        for route in node.rest_routes:
+            matches.append((route, captures))
+        if depth == len(segments):
+            for route in node.routes:
+                matches.append((route, captures))
+            return
+        segment = segments[depth]
+        child = node.children.get(segment)
+        if child is not None:
+            self._match(child, segments, depth + 1, captures, matches)
+        child = node.children.get('+')
+        if child is not None:
+            self._match(child, segments, depth + 1, captures + (segment,), matches)
+
+    def __len__(self):
+        return len(self.routes)
+
+
+def build_router(scn):
+    """Compile the input properties of a scene into a router"""
+    routes = []
+    input_indices = {}
+    vector_lengths = {}
+    for idx, prop in enumerate(scn.mqtt_inputs):
+        if not prop.property_name or prop.property_name == 'NOT_SET':
+            continue
+        input_indices.setdefault(prop.property_name, []).append(idx)
+        template = prop.topic or prop.property_name
+        length = get_input_length(prop)
+        if length:
+            vector_lengths[prop.property_name] = length
+        routes.append(Route(prop.property_name, template,
+                            array_size=0 if length else prop.array_size,
+                            keep_all=prop.keep_all_samples or prop.jitter_buffer,
+                            length=length))
+    return TopicRouter(routes, input_indices, vector_lengths)
+
+
+def filter_covers(general, specific):
+    """Check if every topic matching the filter ``specific`` also matches
+    the filter ``general``. Both are lists of topic segments."""
+    for idx, level in enumerate(general):
+        if level == '#':
+            return True
+        if idx >= len(specific) or specific[idx] == '#':
+            return False
+        if level != '+' and level != specific[idx]:
+            return False
+    return len(general) == len(specific)
+
+
+def subscription_filters(templates):
+    """Get the smallest set of topic filters, relative to the topic
+    prefix, that receives all topics of the given templates"""
+    filters = {}
+    for template in templates:
+        segments = split_topic(template)
+        if segments:
+            filters["/".join(segments)] = segments
+    # Only filters with wildcards can cover others
+    wildcards = [(name, segments) for name, segments in filters.items()
+                 if '+' in segments or '#' in segments]
+    return {name for name, segments in filters.items()
+            if not any(other != name and filter_covers(general, segments)
+                       for other, general in wildcards)}
+
+
+def get_input_length(prop):
+    """Values per message of an input, 0 for scalar inputs"""
+    if prop.value_type == 'VECTOR':
+        return prop.vector_size
+    if prop.value_type == 'ARRAY':
+        return prop.array_size
+    return 0
@@ -0,0 +1,206 @@
+"""Timer scheduling for publishing outputs and applying inputs.
+
+Deadline scheduler for timer based publishing:
+
+Every timer based output has its own next-due deadline in a priority
+queue, so each one publishes at its own rate and the Blender timer only
+wakes up for the earliest deadline. Deadlines advance by the interval
+from the previous deadline rather than from the publish time, so rates
+don't drift. When the main thread falls behind by more than an interval
+the missed publishes are skipped and counted.
+
+Drain scheduler for the timer applying incoming data: fast while data
+arrives, backing off while it doesn't, and stopped while nothing can
+deliver data. It also tells whether frames are changing, so work done on
+frame changes can move to the timer while the animation is stopped.
+"""
+
+import heapq
+import itertools
+import time
+
+
+class DeadlineScheduler:
+
+    def __init__(self):
+        self._heap = []
+        self._intervals = {}
+        self._due = {}
+        self._counter = itertools.count()
+        self._dirty = True
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.published = 0
+        self.missed = 0
+        self.last_slip = 0.0
+        self.max_slip = 0.0
+        self.mean_slip = 0.0
+
+    def mark_dirty(self):
+        """Request a sync with the scene configuration"""
+        self._dirty = True
+
+    @property
+    def dirty(self):
+        return self._dirty
+
+    def sync(self, intervals, now=None):
+        """Set the scheduled keys and their intervals in seconds.
+
+        Keys that keep their interval keep their deadline, new keys and
+        keys with a changed interval are due immediately.
+        """
+        if now is None:
+            now = time.perf_counter()
+        due = {}
+        for key, interval in intervals.items():
+            if self._intervals.get(key) == interval and key in self._due:
+                due[key] = self._due[key]
+            else:
+                due[key] = now
+        self._intervals = dict(intervals)
+        self._due = due
+        self._heap = [(t, next(self._counter), key) for key, t in due.items()]
+        heapq.heapify(self._heap)
+        self._dirty = False
+
+    def pop_due(self, now=None):
+        """Get the keys due at ``now`` and schedule their next deadline"""
+        if now is None:
+            now = time.perf_counter()
+        keys = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            due, _, key = heapq.heappop(heap)
+            interval = self._intervals[key]
+            slip = now - due
+            self.last_slip = slip
+            if slip > self.max_slip:
+                self.max_slip = slip
+            self.mean_slip += (slip - self.mean_slip) * 0.05
+            next_due = due + interval
+            if next_due <= now:
+                # fell behind by more than an interval, skip ahead
+                self.missed += int((now - due) / interval)
+                next_due = now + interval
+            self._due[key] = next_due
+            heapq.heappush(heap, (next_due, next(self._counter), key))
+            keys.append(key)
+        self.published += len(keys)
+        return keys
+
+    def next_delay(self, now=None):
+        """Seconds until the earliest deadline, None if nothing is
+        scheduled"""
+        if not self._heap:
+            return None
+        if now is None:
+            now = time.perf_counter()
+        return max(0.0, self._heap[0][0] - now)
+
+    def get_stats(self):
+        return {
+            "scheduled": len(self._intervals),
+            "published": self.published,
+            "missed": self.missed,
+            "last_slip": self.last_slip,
+            "max_slip": self.max_slip,
+            "mean_slip": self.mean_slip,
+        }
+
+    def __len__(self):
+        return len(self._intervals)
+
+
+output_scheduler = DeadlineScheduler()
+
+
+# Seconds the drain timer stays at the minimum spacing after data arrived
+HOT_TIME = 1.0
+# Longest interval of the drain timer while a source is active (seconds)
+IDLE_INTERVAL = 0.1
+# First step of the backoff when the minimum spacing is 0
+BACKOFF_START = 0.005
+# Without a frame change for this long (seconds) the animation is not
+# playing
+FRAME_IDLE = 0.25
+
+
+class DrainScheduler:
+    """Interval of the timer that applies incoming data.
+
+    After an update that applied data the timer comes back after
+    ``min_interval``, so a burst is applied in few updates with one
+    driver refresh each. Once nothing arrived for ``HOT_TIME`` the
+    interval doubles on every empty update up to ``IDLE_INTERVAL``, or
+    up to ``listen_interval`` while connected, which bounds the latency
+    of the first message after a quiet period. Without any source of
+    data the timer stops until ``wake`` starts it.
+    """
+
+    def __init__(self, min_interval=0.01, listen_interval=0.05):
+        self.min_interval = min_interval
+        # Longest interval while connected (seconds)
+        self.listen_interval = listen_interval
+        self._interval = min_interval
+        self._last_data = 0.0
+        # callable (re)starting the timer right away, set by the addon
+        self.start_timer = None
+        self.running = False
+        self.drains = 0
+        self.idle_polls = 0
+        self._last_frame_change = 0.0
+
+    def next_interval(self, applied, now=None, listening=False):
+        """Interval until the next update, after an update that did or
+        didn't apply data. ``listening`` is True while connected."""
+        if now is None:
+            now = time.monotonic()
+        self.running = True
+        if applied:
+            self.drains += 1
+            self._last_data = now
+            self._interval = self.min_interval
+        else:
+            self.idle_polls += 1
+            if now - self._last_data > HOT_TIME:
+                limit = self.listen_interval if listening else IDLE_INTERVAL
+                self._interval = min(max(self._interval * 2.0, BACKOFF_START),
+                                     max(limit, self.min_interval))
+        return self._interval
+
+    def stop(self):
+        """The timer stops, returns None for the timer function"""
+        self.running = False
+        return None
+
+    def wake(self):
+        """Apply pending data right away and poll fast for a while, e.g.
+        after connecting. Main thread only."""
+        self._interval = self.min_interval
+        self._last_data = time.monotonic()
+        self.running = True
+        if self.start_timer is not None:
+            self.start_timer()
+
+    def frame_changed(self, now=None):
+        self._last_frame_change = time.monotonic() if now is None else now
+
+    def playing(self, now=None):
+        """Whether frames are changing, so the frame change handler does
+        the per-frame work"""
+        if now is None:
+            now = time.monotonic()
+        return now - self._last_frame_change < FRAME_IDLE
+
+    def get_stats(self):
+        return {
+            "running": self.running,
+            "interval": self._interval,
+            "drains": self.drains,
+            "idle_polls": self.idle_polls,
+        }
+
+
+drain_scheduler = DrainScheduler()
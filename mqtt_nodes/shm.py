@@ -0,0 +1,258 @@
+"""Same-host input source reading a shared memory segment.
+
+A producer on the same machine (see ``mqtt_shm_producer.py``) creates a
+``multiprocessing.shared_memory`` segment with one fixed slot per
+channel and writes the newest value of each channel into its slot.
+Blender maps the segment once and reads the changed slots on every
+update tick, without a broker, sockets or text parsing.
+
+Layout, little endian::
+
+    header  magic "BLSH", version u8, flags u8, slot count u16,
+            slot size u32, reserved u32            (16 bytes)
+    slot    seq u64, timestamp f64, components u32, capacity u32,
+            name 48 bytes utf-8, values float32[capacity]
+
+Each slot is guarded by a sequence lock: the writer makes ``seq`` odd
+before it writes and even again afterwards. A reader that sees an odd
+``seq``, or a different ``seq`` after reading the values, has read a
+torn slot and retries.
+"""
+
+import os
+import struct
+import time
+
+from .metrics import metrics
+
+
+MAGIC = b"BLSH"
+VERSION = 1
+HEADER = struct.Struct("<4sBBHII")
+SLOT_HEADER = struct.Struct("<QdII48s")
+SEQ = struct.Struct("<Q")
+# Set by the producer before it removes the segment
+FLAG_CLOSED = 1
+# How often to look for the segment while it does not exist, or for a
+# new segment under the same name while no slot changes (seconds)
+ATTACH_INTERVAL = 1.0
+# Reads of a slot before giving up on it for this tick
+MAX_RETRIES = 3
+
+
+class ShmError(ValueError):
+    pass
+
+
+class ShmChannel:
+    __slots__ = ("name", "offset", "components", "values", "last_seq")
+
+    def __init__(self, name, offset, components):
+        self.name = name
+        self.offset = offset
+        self.components = components
+        self.values = struct.Struct(f"<{components}f")
+        self.last_seq = 0
+
+
+class ShmReader:
+    """Reads the latest channel values from a producer's segment"""
+
+    def __init__(self):
+        self.enabled = False
+        self.segment_name = ""
+        self._shm = None
+        self._buf = None
+        self.channels = []
+        self._next_attach = 0.0
+        # Inode of the mapped segment, None where segments have none
+        self._inode = None
+        # When a slot last changed (monotonic)
+        self._last_change = 0.0
+        self.torn_reads = 0
+
+    @property
+    def attached(self):
+        return self._shm is not None
+
+    def configure(self, enabled, segment_name):
+        if enabled == self.enabled and segment_name == self.segment_name:
+            return
+        self.detach()
+        self.enabled = enabled
+        self.segment_name = segment_name
+        self._next_attach = 0.0
+
+    def _open(self):
+        """Open the segment by name, None if it does not exist"""
+        from multiprocessing import shared_memory
+        # Attaching must not make Python remove the producer's segment
+        # when Blender exits
+        try:
+            return shared_memory.SharedMemory(name=self.segment_name, track=False)
+        except TypeError:
+            # Python < 3.13 always tracks, undo the registration
+            try:
+                shm = shared_memory.SharedMemory(name=self.segment_name)
+            except (FileNotFoundError, ValueError, OSError):
+                return None
+            try:
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(shm._name, "shared_memory")
+            except Exception:
+                pass
+            return shm
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+
+    @staticmethod
+    def _get_inode(shm):
+        fd = getattr(shm, "_fd", -1)
+        if fd < 0:
+            return None
+        try:
+            return os.fstat(fd).st_ino
+        except OSError:
+            return None
+
+    def attach(self):
+        """Map the segment, returns False if it does not exist (yet)"""
+        shm = self._open()
+        if shm is None:
+            return False
+        try:
+            self._parse(shm.buf)
+        except ShmError as e:
+            print(f"[MQTT] Shared memory '{self.segment_name}': {e}")
+            self.channels = []
+            shm.close()
+            return False
+        self._shm = shm
+        self._buf = shm.buf
+        self._inode = self._get_inode(shm)
+        self._last_change = time.monotonic()
+        print(f"[MQTT] Shared memory '{self.segment_name}' attached, "
+              f"{len(self.channels)} channels")
+        return True
+
+    def _parse(self, buf):
+        if len(buf) < HEADER.size:
+            raise ShmError("segment too small")
+        magic, version, flags, count, slot_size, _ = HEADER.unpack_from(buf, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ShmError("not a version %d segment" % VERSION)
+        if flags & FLAG_CLOSED:
+            raise ShmError("producer closed the segment")
+        if HEADER.size + count * slot_size > len(buf):
+            raise ShmError("slot table exceeds the segment")
+        channels = []
+        for idx in range(count):
+            offset = HEADER.size + idx * slot_size
+            _, _, components, capacity, name = SLOT_HEADER.unpack_from(buf, offset)
+            if components > capacity or \
+               SLOT_HEADER.size + capacity * 4 > slot_size:
+                raise ShmError(f"bad slot {idx}")
+            name = name.rstrip(b"\0").decode("utf-8", "replace")
+            channels.append(ShmChannel(name, offset, components))
+        self.channels = channels
+
+    def _replaced(self):
+        """Whether the segment name was removed or now belongs to another
+        segment, e.g. after a producer crashed and restarted"""
+        shm = self._open()
+        if shm is None:
+            return True
+        inode = self._get_inode(shm)
+        shm.close()
+        return inode is not None and inode != self._inode
+
+    def detach(self):
+        self.channels = []
+        self._buf = None
+        if self._shm is not None:
+            try:
+                self._shm.close()
+            except BufferError:
+                # a view is still alive, the mapping goes with the object
+                pass
+            self._shm = None
+
+    def _read(self, buf, channel):
+        """Read a slot under its sequence lock, None if it did not change
+        or no consistent read succeeded"""
+        offset = channel.offset
+        for _ in range(MAX_RETRIES):
+            seq = SEQ.unpack_from(buf, offset)[0]
+            if seq == channel.last_seq or seq & 1:
+                # unchanged, or the producer is writing right now
+                return None
+            timestamp = struct.unpack_from("<d", buf, offset + 8)[0]
+            values = channel.values.unpack_from(buf, offset + SLOT_HEADER.size)
+            if SEQ.unpack_from(buf, offset)[0] == seq:
+                return seq, timestamp, values
+            self.torn_reads += 1
+        return None
+
+    def poll(self, ingest_buffer, vector_lengths=None):
+        """Push the channels written since the last poll into the ingest
+        buffer, returns the number of channels pushed.
+
+        Single component channels use the channel name as key. Channels
+        of vector and array inputs, given as name -> length in
+        ``vector_lengths``, push all values as one sample. Others push one
+        (name, component) key per component for scalar array inputs.
+        """
+        if not self.enabled:
+            return 0
+        if self._shm is None:
+            now = time.monotonic()
+            if now < self._next_attach:
+                return 0
+            self._next_attach = now + ATTACH_INTERVAL
+            if not self.attach():
+                return 0
+        buf = self._buf
+        if HEADER.unpack_from(buf, 0)[2] & FLAG_CLOSED:
+            print(f"[MQTT] Shared memory '{self.segment_name}' closed by the producer")
+            self.detach()
+            return 0
+
+        recv_time = time.time()
+        pushed = 0
+        for channel in self.channels:
+            read = self._read(buf, channel)
+            if read is None:
+                continue
+            seq, timestamp, values = read
+            channel.last_seq = seq
+            producer_time = timestamp if timestamp > 0.0 else None
+            if vector_lengths and \
+               vector_lengths.get(channel.name) == channel.components:
+                ingest_buffer.push(channel.name, values, False,
+                                   recv_time, producer_time)
+            elif channel.components == 1:
+                ingest_buffer.push(channel.name, values[0], False,
+                                   recv_time, producer_time)
+            else:
+                for component, value in enumerate(values):
+                    ingest_buffer.push((channel.name, component), value, False,
+                                       recv_time, producer_time)
+            if metrics.enabled:
+                metrics.incr("received", channel.name)
+            pushed += 1
+        now = time.monotonic()
+        if pushed:
+            self._last_change = now
+        elif now - self._last_change > ATTACH_INTERVAL and \
+                now >= self._next_attach:
+            # Slots stopped changing, the producer may be writing to a new
+            # segment under the same name
+            self._next_attach = now + ATTACH_INTERVAL
+            if self._replaced():
+                print(f"[MQTT] Shared memory '{self.segment_name}' was replaced")
+                self.detach()
+                self._next_attach = 0.0
+        return pushed
+
+
+shm_reader = ShmReader()
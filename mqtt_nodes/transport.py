@@ -0,0 +1,414 @@
+"""Transports carry the messages between the MQTT connection and a broker.
+
+``MQTTConnection`` only talks to the ``Transport`` interface. The
+callbacks follow paho's signatures, ``on_connect(transport, userdata,
+flags, rc)`` and ``on_message(transport, userdata, msg)``, and messages
+have ``topic``, ``payload``, ``qos``, ``retain`` and ``properties`` like
+paho's ``MQTTMessage``.
+
+The connection's network thread drives a transport from its own
+selector: it waits until ``socket()`` is readable (or writable while
+``want_write()``) and then calls ``loop_read()`` or ``loop_write()``, and
+``loop_misc()`` about once a second for keepalive. These return 0, or an
+error code like paho's once the connection is lost.
+
+``PahoTransport`` talks to a real broker. ``LoopbackTransport`` talks to
+an in-process broker, so the bridge can be tested and benchmarked
+without a network.
+
+With ``no_local`` a transport asks the broker not to send its own
+publishes back to it, which needs MQTT v5 for paho.
+"""
+
+import select
+import socket
+import threading
+
+from abc import ABC, abstractmethod
+from collections import deque, namedtuple
+
+
+# Return value of Transport.publish(), rc is 0 on success like paho's
+PublishResult = namedtuple("PublishResult", ["rc", "mid"])
+
+
+class Message:
+    __slots__ = ("topic", "payload", "qos", "retain", "properties")
+
+    def __init__(self, topic, payload, qos=0, retain=False, properties=None):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.properties = properties
+
+
+class Transport(ABC):
+    """Interface of a message transport, see the module docstring.
+    Subclasses that miss a method fail when they are created."""
+
+    def __init__(self, no_local=False):
+        self.on_connect = None
+        self.on_message = None
+        self._userdata = None
+        self.no_local = no_local
+
+    def user_data_set(self, userdata):
+        self._userdata = userdata
+
+    @abstractmethod
+    def connect(self, host, port, keepalive=60):
+        """Connect to a broker, blocks until the connection is made"""
+
+    @abstractmethod
+    def disconnect(self):
+        """Disconnect, the transport can connect again"""
+
+    @abstractmethod
+    def is_connected(self):
+        """True while connected to the broker"""
+
+    @abstractmethod
+    def subscribe(self, topics, qos=0):
+        """Subscribe to a list of topic filters"""
+
+    @abstractmethod
+    def unsubscribe(self, topics):
+        """Unsubscribe from a list of topic filters"""
+
+    @abstractmethod
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        """Send a message, returns a PublishResult"""
+
+    def close(self):
+        """Release the transport after its last disconnect"""
+        pass
+
+    @abstractmethod
+    def socket(self):
+        """The socket to wait on, None while not connected"""
+
+    def want_write(self):
+        """True if data is waiting to be written to the socket"""
+        return False
+
+    @abstractmethod
+    def loop_read(self):
+        """Read what arrived and call the callbacks"""
+
+    def loop_write(self):
+        """Write waiting data"""
+        return 0
+
+    def loop_misc(self):
+        """Keepalive and timeouts, call about once a second"""
+        return 0
+
+
+# Most packets read per loop_read() call, so a flood of messages can't
+# keep the network thread from its commands
+READ_BATCH = 1000
+
+
+class PahoTransport(Transport):
+    """Transport to an MQTT broker using paho-mqtt"""
+
+    def __init__(self, no_local=False):
+        super().__init__(no_local)
+        # Imported here, so the other transports work without paho
+        import paho.mqtt.client as mqtt
+        if no_local:
+            # The no local subscription option only exists in MQTT v5
+            self._client = mqtt.Client(protocol=mqtt.MQTTv5)
+        else:
+            self._client = mqtt.Client()
+        self._client.on_connect = self._handle_connect
+        self._client.on_message = self._handle_message
+
+    def _handle_connect(self, client, userdata, flags, rc, properties=None):
+        if self.on_connect:
+            self.on_connect(self, self._userdata, flags, rc)
+
+    def _handle_message(self, client, userdata, msg):
+        if self.on_message:
+            self.on_message(self, self._userdata, msg)
+
+    def connect(self, host, port, keepalive=60):
+        return self._client.connect(host, port, keepalive)
+
+    def disconnect(self):
+        return self._client.disconnect()
+
+    def is_connected(self):
+        return self._client.is_connected()
+
+    def subscribe(self, topics, qos=0):
+        if self.no_local:
+            from paho.mqtt.subscribeoptions import SubscribeOptions
+            options = SubscribeOptions(qos=qos, noLocal=True)
+            return self._client.subscribe([(topic, options) for topic in topics])
+        return self._client.subscribe([(topic, qos) for topic in topics])
+
+    def unsubscribe(self, topics):
+        return self._client.unsubscribe(list(topics))
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        info = self._client.publish(topic, payload, qos=qos, retain=retain)
+        return PublishResult(info.rc, info.mid)
+
+    def socket(self):
+        return self._client.socket()
+
+    def want_write(self):
+        return self._client.want_write()
+
+    def loop_read(self):
+        # paho reads a single packet per call unless QoS messages are in
+        # flight, keep reading while more data is waiting
+        client = self._client
+        for _ in range(READ_BATCH):
+            rc = client.loop_read()
+            if rc:
+                return rc
+            sock = client.socket()
+            if sock is None or not _readable(sock):
+                break
+        return 0
+
+    def loop_write(self):
+        return self._client.loop_write()
+
+    def loop_misc(self):
+        return self._client.loop_misc()
+
+
+def _readable(sock):
+    """Whether reading ``sock`` wouldn't block, including data TLS has
+    already decrypted"""
+    pending = getattr(sock, "pending", None)
+    if pending is not None and pending():
+        return True
+    return bool(select.select([sock], [], [], 0.0)[0])
+
+
+def topic_matches(topic_filter, topic):
+    """Check if a topic matches an MQTT topic filter with + and #"""
+    filter_levels = topic_filter.split('/')
+    topic_levels = topic.split('/')
+    # Wildcards in the first level do not match $ topics like $SYS
+    if topic.startswith('$') and filter_levels[0] in ('+', '#'):
+        return False
+    for idx, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if idx >= len(topic_levels):
+            return False
+        if level != '+' and level != topic_levels[idx]:
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+class LoopbackBroker:
+    """In-process broker with MQTT topic matching and retained messages.
+
+    Published messages are queued for every matching subscriber and
+    handed to its ``on_message`` when the subscriber calls ``loop()``, so
+    they arrive on the subscriber's network thread as with a real broker.
+    Anything in the process can publish, e.g. a benchmark producer.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # topic filter -> set of transports
+        self._subscriptions = {}
+        # the filters of _subscriptions with + or #, the others are only
+        # looked up by topic
+        self._wildcards = set()
+        # transports that don't get their own publishes
+        self._no_local = set()
+        self._retained = {}
+        self.published = 0
+
+    def subscribe(self, transport, topic_filter, no_local=False):
+        with self._lock:
+            self._subscriptions.setdefault(topic_filter, set()).add(transport)
+            if '+' in topic_filter or '#' in topic_filter:
+                self._wildcards.add(topic_filter)
+            if no_local:
+                self._no_local.add(transport)
+            retained = [msg for topic, msg in self._retained.items()
+                        if topic_matches(topic_filter, topic)]
+        for msg in retained:
+            transport._enqueue(msg)
+
+    def unsubscribe(self, transport, topic_filter):
+        with self._lock:
+            subscribers = self._subscriptions.get(topic_filter)
+            if subscribers is not None:
+                subscribers.discard(transport)
+                if not subscribers:
+                    del self._subscriptions[topic_filter]
+                    self._wildcards.discard(topic_filter)
+
+    def disconnect(self, transport):
+        with self._lock:
+            self._no_local.discard(transport)
+            for topic_filter in list(self._subscriptions):
+                self._subscriptions[topic_filter].discard(transport)
+                if not self._subscriptions[topic_filter]:
+                    del self._subscriptions[topic_filter]
+                    self._wildcards.discard(topic_filter)
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None,
+                sender=None):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        elif payload is None:
+            payload = b""
+        elif not isinstance(payload, bytes):
+            payload = bytes(payload)
+        with self._lock:
+            self.published += 1
+            if retain:
+                if payload:
+                    self._retained[topic] = Message(topic, payload, qos, True, properties)
+                else:
+                    self._retained.pop(topic, None)
+            # A subscriber gets a message once, even if several of its
+            # filters match
+            receivers = set(self._subscriptions.get(topic, ()))
+            for topic_filter in self._wildcards:
+                if topic_matches(topic_filter, topic):
+                    receivers.update(self._subscriptions[topic_filter])
+            if sender in self._no_local:
+                receivers.discard(sender)
+        if receivers:
+            msg = Message(topic, payload, qos, False, properties)
+            for transport in receivers:
+                transport._enqueue(msg)
+
+    def retained(self, topic):
+        """Get the retained payload of a topic, None if there is none"""
+        msg = self._retained.get(topic)
+        return msg.payload if msg is not None else None
+
+    def clear(self):
+        with self._lock:
+            self._subscriptions.clear()
+            self._wildcards.clear()
+            self._no_local.clear()
+            self._retained.clear()
+            self.published = 0
+
+
+loopback_broker = LoopbackBroker()
+
+
+class LoopbackTransport(Transport):
+    """Transport to the in-process loopback broker"""
+
+    def __init__(self, no_local=False, broker=None):
+        super().__init__(no_local)
+        self._broker = broker if broker is not None else loopback_broker
+        self._inbox = deque()
+        self._lock = threading.Lock()
+        # The broker wakes the network thread's selector through this pair
+        self._signal_r, self._signal_w = socket.socketpair()
+        self._signal_r.setblocking(False)
+        self._signal_w.setblocking(False)
+        self._connected = False
+        self._connect_pending = False
+
+    def _signal(self):
+        try:
+            self._signal_w.send(b"\0")
+        except OSError:
+            # the pair is full, the reader wakes up anyway
+            pass
+
+    def _enqueue(self, msg):
+        with self._lock:
+            # One wake up per batch of messages
+            wake = not self._inbox
+            self._inbox.append(msg)
+        if wake:
+            self._signal()
+
+    def connect(self, host=None, port=None, keepalive=60):
+        self._connected = True
+        # on_connect is called from loop_read() like with paho
+        self._connect_pending = True
+        self._signal()
+        return 0
+
+    def disconnect(self):
+        self._connected = False
+        self._broker.disconnect(self)
+        with self._lock:
+            self._inbox.clear()
+        self._signal()
+        return 0
+
+    def is_connected(self):
+        return self._connected
+
+    def subscribe(self, topics, qos=0):
+        for topic in topics:
+            self._broker.subscribe(self, topic, self.no_local)
+        return 0, 0
+
+    def unsubscribe(self, topics):
+        for topic in topics:
+            self._broker.unsubscribe(self, topic)
+        return 0, 0
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        if not self._connected:
+            return PublishResult(4, 0)
+        self._broker.publish(topic, payload, qos, retain, sender=self)
+        return PublishResult(0, 0)
+
+    def close(self):
+        self._signal_r.close()
+        self._signal_w.close()
+
+    def socket(self):
+        return self._signal_r
+
+    def loop_read(self):
+        # Drain the signals before taking the messages, so a message
+        # queued after the swap always leaves a signal behind
+        try:
+            while self._signal_r.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        if not self._connected:
+            # Like paho's MQTT_ERR_NO_CONN
+            return 4
+        if self._connect_pending:
+            self._connect_pending = False
+            if self.on_connect:
+                self.on_connect(self, self._userdata, {}, 0)
+        with self._lock:
+            messages = self._inbox
+            self._inbox = deque()
+        on_message = self.on_message
+        if on_message:
+            for msg in messages:
+                on_message(self, self._userdata, msg)
+        return 0
+
+    def loop_misc(self):
+        return 0 if self._connected else 4
+
+
+TRANSPORTS = {
+    'PAHO': PahoTransport,
+    'LOOPBACK': LoopbackTransport,
+}
+
+
+def create_transport(kind, no_local=False):
+    """Create a transport by its settings name"""
+    return TRANSPORTS[kind](no_local)
@@ -1,7 +1,91 @@
 import bpy
+import time
 
 from bpy.types import Panel
 
+from . import mqtt_connection
+from .scheduler import output_scheduler
+from .metrics import metrics
+from .shm import shm_reader
+from .recorder import session_recorder, replay_source
+
+
+# Connection state at the last redraw
+_last_state = None
+
+
+def redraw_on_state_change():
+    """Redraw the properties editors after the connection state changed
+    on the network thread"""
+    global _last_state
+    state = mqtt_connection.mqtt_connection.state
+    if state == _last_state:
+        return
+    _last_state = state
+    wm = getattr(bpy.context, "window_manager", None)
+    if wm is None:
+        return
+    for window in wm.windows:
+        for area in window.screen.areas:
+            if area.type == 'PROPERTIES':
+                area.tag_redraw()
+
+
+def draw_connection_state(layout):
+    connection = mqtt_connection.mqtt_connection
+    state = connection.state
+    if state == mqtt_connection.STATE_CONNECTED:
+        layout.label(text="Connected", icon='LINKED')
+    elif state == mqtt_connection.STATE_CONNECTING:
+        layout.label(text="Connecting...", icon='TIME')
+    elif state == mqtt_connection.STATE_WAITING:
+        delay = max(0.0, connection.retry_at - time.monotonic())
+        layout.label(text="%s, retry %d in %.0f s" % (
+            connection.last_error or "Disconnected", connection.attempts, delay),
+            icon='ERROR')
+    else:
+        layout.label(text="Disconnected", icon='UNLINKED')
+
+
+def draw_metrics(layout):
+    """Draw the collected metrics as labels"""
+    report = metrics.snapshot()
+    counters = report["counters"]
+    col = layout.column(align=True)
+    received = counters.get("received", {})
+    applied = counters.get("applied", {})
+    dropped = counters.get("dropped", {})
+    if received:
+        col.label(text="Inputs (received / applied / dropped)")
+        for name in sorted(received):
+            col.label(text="  %s: %d / %d / %d" % (
+                name, received[name], applied.get(name, 0), dropped.get(name, 0)))
+    published = counters.get("published", {})
+    bytes_sent = counters.get("bytes_sent", {})
+    if published:
+        col.label(text="Outputs (publishes / kB)")
+        for topic in sorted(published):
+            col.label(text="  %s: %d / %.1f" % (
+                topic, published[topic], bytes_sent.get(topic, 0) / 1024.0))
+    latency = report["latency"]
+    if latency:
+        col.label(text="Latency total (p50 / p95 / p99 ms)")
+        for name in sorted(latency):
+            total = latency[name].get("total")
+            if total and total["count"]:
+                col.label(text="  %s: %.1f / %.1f / %.1f" % (
+                    name, total["p50"] * 1000.0, total["p95"] * 1000.0, total["p99"] * 1000.0))
+    histograms = report["histograms"]
+    if histograms:
+        col.label(text="Timings (mean / p95 / max ms)")
+        for name in sorted(histograms):
+            h = histograms[name]
+            col.label(text="  %s: %.2f / %.2f / %.2f" % (
+                name, h["mean"] * 1000.0, h["p95"] * 1000.0, h["max"] * 1000.0))
+    if not (received or published or histograms):
+        col.label(text="No data yet")
+
+
 class MQTTNodePanel(Panel):
 
     bl_label = 'MQTT'
@@ -18,7 +102,40 @@ class MQTTNodePanel(Panel):
         scn = context.scene
         layout = self.layout
         row = layout.row()
-        row.label(text="This is a test")
+        row.prop(scn.mqtt_settings, "metrics_enabled", text="Collect Metrics")
+        if scn.mqtt_settings.metrics_enabled:
+            draw_metrics(layout)
+
+
+def draw_session(layout, mqtt_settings):
+    """Recording and replay of input sessions"""
+    box = layout.box()
+    col = box.column()
+    row = col.row()
+    row.prop(mqtt_settings, "record_path")
+    if session_recorder.active:
+        row.operator("mqtt.stop_recording", text="Stop", icon='SNAP_FACE')
+        text = f"Recording: {session_recorder.samples} samples"
+        if session_recorder.skipped:
+            text += f", {session_recorder.skipped} skipped"
+        col.label(text=text, icon='REC')
+    else:
+        row.operator("mqtt.start_recording", text="Record", icon='REC')
+    row = col.row()
+    row.prop(mqtt_settings, "replay_path")
+    if replay_source.active:
+        row.operator("mqtt.stop_replay", text="Stop", icon='SNAP_FACE')
+    else:
+        row.operator("mqtt.start_replay", text="Replay", icon='PLAY')
+    row = col.row()
+    row.prop(mqtt_settings, "replay_mode", text="")
+    if mqtt_settings.replay_mode == 'FAST':
+        row.prop(mqtt_settings, "replay_speed", text="Speed")
+    if mqtt_settings.replay_mode != 'FRAME':
+        row.prop(mqtt_settings, "replay_loop")
+    if replay_source.active:
+        col.label(text=f"Replay: {replay_source.position:.1f} / "
+                       f"{replay_source.duration:.1f} s")
 
 
 class MQTTPanel(Panel):
@@ -34,15 +151,39 @@ class MQTTPanel(Panel):
         layout = self.layout
         box = layout.box()
         col = box.column()
-        col.prop(mqtt_settings, "broker_host")
+        col.prop(mqtt_settings, "transport")
+        if mqtt_settings.transport == 'PAHO':
+            row = col.row()
+            row.prop(mqtt_settings, "broker_host")
+            row.prop(mqtt_settings, "broker_port", text="Port")
         col.prop(mqtt_settings, "topic_prefix")
+        col.prop(mqtt_settings, "no_local")
+        row = col.row()
+        row.prop(mqtt_settings, "shm_enabled")
+        if mqtt_settings.shm_enabled:
+            row.prop(mqtt_settings, "shm_name", text="")
+            if shm_reader.attached:
+                col.label(text=f"Shared memory: {len(shm_reader.channels)} channels")
+            else:
+                col.label(text="Shared memory: waiting for producer", icon='TIME')
         row = col.row()
         row.prop(mqtt_settings, "mqtt_enabled", text="MQTT Enabled")
         if mqtt_settings.mqtt_enabled:
             row.label(text="", icon="PLAY")
         else:
             row.label(text="", icon="PAUSE")
-        col.operator("mqtt.reconnect_client", text="Reconnect")
+        row = col.row()
+        draw_connection_state(row)
+        row.operator("mqtt.reconnect_client", text="Reconnect")
+        row = col.row()
+        row.prop(mqtt_settings, "metrics_enabled", text="Metrics")
+        if mqtt_settings.metrics_enabled:
+            row.prop(mqtt_settings, "metrics_interval", text="Publish every (s)")
+        row = col.row()
+        row.prop(mqtt_settings, "latency_echo", text="Latency Echo")
+        row.prop(mqtt_settings, "update_min_interval", text="Min Spacing (s)")
+        row.prop(mqtt_settings, "update_idle_interval", text="Idle Poll (s)")
+        draw_session(layout, mqtt_settings)
         # props
         box = layout.box()
         col = box.column()
@@ -53,13 +194,56 @@ class MQTTPanel(Panel):
             row.prop(input_prop, "property_name", text="")
             row.operator("mqtt.remove_input_property", text="", icon="CANCEL").property_index = idx
             row = col.row()
-            row.prop(input_prop, "do_decay_float", text="Decay")
-            if input_prop.do_decay_float:
+            row.prop(input_prop, "topic", text="Topic")
+            row.prop(input_prop, "value_type", text="")
+            if input_prop.value_type == 'VECTOR':
+                row.prop(input_prop, "vector_size", text="Size")
+            else:
+                row.prop(input_prop, "array_size", text="Array")
+            row = col.row()
+            row.prop(input_prop, "keep_all_samples", text="Keep All Samples")
+            row.prop(input_prop, "jitter_buffer", text="Jitter Buffer")
+            if input_prop.jitter_buffer:
+                row = col.row()
+                row.prop(input_prop, "jitter_delay", text="Delay (s)")
+                row.prop(input_prop, "jitter_size", text="Samples")
+                row.prop(input_prop, "interpolation", text="")
+            row = col.row()
+            row.prop(input_prop, "filter_type", text="Filter")
+            if input_prop.filter_type == 'DECAY':
                 row.prop(input_prop, "decay_hold_peak_frames", text="hold frames")
                 row.prop(input_prop, "decay_rate", text="rate")
+            elif input_prop.filter_type == 'EMA':
+                row.prop(input_prop, "filter_factor", text="Factor")
+            elif input_prop.filter_type == 'ONE_EURO':
+                row.prop(input_prop, "filter_min_cutoff", text="Min Cutoff")
+                row.prop(input_prop, "filter_beta", text="Beta")
+            elif input_prop.filter_type == 'SLEW':
+                row.prop(input_prop, "filter_rate", text="Max Rate")
         col = box.column()
         col.operator("mqtt.add_input_property", text="ADD")
         
+        # Attribute Input properties
+        box = layout.box()
+        box.label(text="Attribute Input Properties")
+        col = box.column()
+        for idx, attr_prop in enumerate(scn.mqtt_attribute_inputs):
+            row = col.row()
+            if not attr_prop.object or not attr_prop.attribute_name or not attr_prop.topic:
+                row.alert = True
+            row.prop(attr_prop, "object", text="Object")
+            row.operator("mqtt.remove_attribute_input_property", text="", icon="CANCEL").property_index = idx
+            row = col.row()
+            row.prop(attr_prop, "attribute_name", text="Attribute")
+            row.prop(attr_prop, "data_type", text="")
+            row.prop(attr_prop, "domain", text="")
+            row = col.row()
+            row.prop(attr_prop, "topic", text="Topic")
+            if attr_prop.domain == 'POINT':
+                row.prop(attr_prop, "resize", text="Resize")
+        col = box.column()
+        col.operator("mqtt.add_attribute_input_property", text="ADD ATTRIBUTE INPUT")
+        
         # Output properties
         box = layout.box()
         box.label(text="Output Properties")
@@ -71,6 +255,7 @@ class MQTTPanel(Panel):
             row.prop(output_prop, "data_path", text="Data Path")
             row = col.row()
             row.prop(output_prop, "topic", text="Topic")
+            row.prop(output_prop, "encoding", text="")
             row = col.row()
             row.prop(output_prop, "publish_on_frame", text="Publish on Frame")
             if not output_prop.publish_on_frame:
@@ -80,6 +265,11 @@ class MQTTPanel(Panel):
             row.operator("mqtt.remove_output_property", text="", icon="CANCEL").property_index = idx
         col = box.column()
         col.operator("mqtt.add_output_property", text="ADD OUTPUT")
+        if len(output_scheduler):
+            stats = output_scheduler.get_stats()
+            row = col.row()
+            row.label(text="Timer slip: %.1f ms (max %.1f ms), missed: %d" % (
+                stats["mean_slip"] * 1000.0, stats["max_slip"] * 1000.0, stats["missed"]))
         
         # Attribute Output properties
         box = layout.box()
@@ -96,8 +286,15 @@ class MQTTPanel(Panel):
             row.prop(attr_prop, "stream_all_instances", text="Stream All Instances")
             if not attr_prop.stream_all_instances:
                 row.prop(attr_prop, "attribute_index", text="Index")
+            else:
+                row = col.row()
+                row.prop(attr_prop, "delta_mode", text="Delta")
+                if attr_prop.delta_mode:
+                    row.prop(attr_prop, "delta_epsilon", text="Epsilon")
+                    row.prop(attr_prop, "delta_keyframe_interval", text="Keyframe Every")
             row = col.row()
             row.prop(attr_prop, "topic", text="Topic")
+            row.prop(attr_prop, "encoding", text="")
             row = col.row()
             row.prop(attr_prop, "publish_on_frame", text="Publish on Frame")
             if not attr_prop.publish_on_frame:
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Shared Memory Producer for Blender MQTT Nodes Addon
+
+Feeds input values to a Blender instance on the same machine through
+shared memory instead of an MQTT broker. Enable "Shared Memory" in the
+addon's MQTT panel with the same segment name. Each channel name is the
+custom property name of an input; channels with more than one component
+go to array inputs with a matching array size.
+
+Library use:
+    from mqtt_shm_producer import ShmProducer
+
+    producer = ShmProducer("blender_mqtt", {"z_position": 1, "head": 3})
+    producer.write("z_position", 0.5)
+    producer.write("head", (0.1, 0.2, 0.3))
+    producer.close()
+
+Usage as a demo, writing sine waves:
+    python mqtt_shm_producer.py --channels z_position:1,head:3 --rate 120
+
+The layout must match mqtt_nodes/shm.py.
+"""
+
+import argparse
+import math
+import struct
+import time
+
+from multiprocessing import shared_memory
+
+
+MAGIC = b"BLSH"
+VERSION = 1
+HEADER = struct.Struct("<4sBBHII")
+SLOT_HEADER = struct.Struct("<QdII48s")
+SEQ = struct.Struct("<Q")
+FLAG_CLOSED = 1
+
+
+class ShmProducer:
+    """Creates the segment and writes channel values into it.
+
+    Only one process may write to a segment.
+    """
+
+    def __init__(self, segment_name, channels):
+        """channels maps channel names to their number of components"""
+        self.segment_name = segment_name
+        capacity = max(channels.values(), default=1)
+        # Slots are 8 byte aligned, so seq and timestamp are aligned too
+        self.slot_size = (SLOT_HEADER.size + capacity * 4 + 7) & ~7
+        size = HEADER.size + len(channels) * self.slot_size
+        try:
+            # Remove a segment left behind by a crashed producer. Mark it
+            # closed first, so readers still mapping it attach again.
+            stale = shared_memory.SharedMemory(name=segment_name)
+            if stale.size >= HEADER.size and bytes(stale.buf[:4]) == MAGIC:
+                struct.pack_into("<B", stale.buf, 5, FLAG_CLOSED)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        self._shm = shared_memory.SharedMemory(name=segment_name, create=True, size=size)
+        self._buf = self._shm.buf
+        self._slots = {}
+        for idx, (name, components) in enumerate(channels.items()):
+            encoded = name.encode("utf-8")
+            if len(encoded) > 48:
+                raise ValueError(f"channel name too long: {name}")
+            offset = HEADER.size + idx * self.slot_size
+            SLOT_HEADER.pack_into(self._buf, offset, 0, 0.0, components, capacity, encoded)
+            self._slots[name] = (offset, struct.Struct(f"<{components}f"))
+        # The header goes last, readers only accept a complete table
+        HEADER.pack_into(self._buf, 0, MAGIC, VERSION, 0, len(channels), self.slot_size, 0)
+
+    def write(self, name, values, timestamp=None):
+        """Write a channel's newest value (a number or a sequence).
+        ``timestamp`` defaults to now, in seconds since the epoch."""
+        offset, packer = self._slots[name]
+        if not isinstance(values, (list, tuple)):
+            values = (values,)
+        if timestamp is None:
+            timestamp = time.time()
+        buf = self._buf
+        seq = SEQ.unpack_from(buf, offset)[0]
+        # Odd while writing, readers retry
+        SEQ.pack_into(buf, offset, seq + 1)
+        struct.pack_into("<d", buf, offset + 8, timestamp)
+        packer.pack_into(buf, offset + SLOT_HEADER.size, *values)
+        SEQ.pack_into(buf, offset, seq + 2)
+
+    def close(self):
+        """Tell readers the segment is gone and remove it"""
+        struct.pack_into("<B", self._buf, 5, FLAG_CLOSED)
+        self._buf.release()
+        self._shm.close()
+        self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def parse_channels(text):
+    channels = {}
+    for item in text.split(","):
+        if not item:
+            continue
+        name, _, components = item.partition(":")
+        channels[name] = int(components or 1)
+    return channels
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--name", default="blender_mqtt", help="segment name (default: blender_mqtt)")
+    parser.add_argument("--channels", type=parse_channels, default={"z_position": 1},
+                        help="comma separated name:components (default: z_position:1)")
+    parser.add_argument("--rate", type=float, default=60.0, help="updates per second (default: 60)")
+    parser.add_argument("--frequency", type=float, default=0.5, help="sine wave frequency in Hz")
+    parser.add_argument("--duration", type=float, help="seconds to run (default: forever)")
+    args = parser.parse_args()
+
+    with ShmProducer(args.name, args.channels) as producer:
+        print(f"[INFO] Writing {len(args.channels)} channels to '{args.name}' at {args.rate} Hz")
+        print(f"       Press Ctrl+C to stop")
+        start = time.monotonic()
+        count = 0
+        try:
+            while args.duration is None or time.monotonic() - start < args.duration:
+                elapsed = time.monotonic() - start
+                for idx, (name, components) in enumerate(args.channels.items()):
+                    angle = 2 * math.pi * args.frequency * elapsed + idx
+                    producer.write(name, [math.sin(angle + k) for k in range(components)])
+                # Drift-free pacing on the monotonic clock
+                count += 1
+                delay = start + count / args.rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+        except KeyboardInterrupt:
+            pass
+    print("[INFO] Producer stopped")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,11 +3,15 @@
 MQTT Sine Wave Publisher for Blender MQTT Nodes Addon
 
 This script publishes a sine wave movement value for z-axis movement.
-The addon should be configured with a property name (e.g., "z_position") 
+The addon should be configured with a property name (e.g., "z_position")
 that matches the topic name used here.
 
+With --topics it runs as a load generator instead, driving many topics
+at once to stress-test a Blender instance (see --help).
+
 Usage:
     python mqtt_sine_wave_publisher.py
+    python mqtt_sine_wave_publisher.py --topics 200 --rate 60 --duration 60
 
 Edit the configuration values in the main() function to customize:
     - BROKER_HOST: MQTT broker IP address
@@ -19,33 +23,89 @@ Edit the configuration values in the main() function to customize:
 """
 
 import paho.mqtt.client as mqtt
+import argparse
+import heapq
+import json
 import time
 import math
+import struct
 import sys
 
+from collections import deque
+
+
+# Broker statistics reported by mosquitto and compatible brokers
+SYS_TOPICS = (
+    "$SYS/broker/messages/stored",
+    "$SYS/broker/store/messages/count",
+    "$SYS/broker/store/messages/bytes",
+    "$SYS/broker/clients/connected",
+    "$SYS/broker/load/messages/received/1min",
+    "$SYS/broker/load/messages/sent/1min",
+)
+
+# Echoed latency samples kept for the percentiles
+LATENCY_WINDOW = 10000
+
+# Binary batch frame header, see mqtt_nodes/batch.py
+BATCH_HEADER = struct.Struct("<4sBBHIId")
+
+# Give up catching up on a topic when it falls this far behind (seconds)
+MAX_LAG = 1.0
+
+
+# Components per topic for each payload shape, the array shape uses
+# --array-size
+SHAPE_COMPONENTS = {'scalar': 0, 'vector': 3, 'batch': 0, 'batch-binary': 0}
+
+
+class Pacer:
+    """Drift-free pacing on the monotonic clock.
+
+    Deadlines are computed from the start time, so time spent publishing
+    and sleep overshoot do not add up over a long run.
+    """
+
+    def __init__(self, rate):
+        self.period = 1.0 / rate
+        self.start = time.monotonic()
+        self.count = 0
+
+    def wait(self):
+        self.count += 1
+        deadline = self.start + self.count * self.period
+        delay = deadline - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        elif -delay > MAX_LAG:
+            # Too far behind, restart the schedule instead of bursting
+            self.start = time.monotonic()
+            self.count = 0
+
 
 class SineWavePublisher:
-    def __init__(self, broker_host, topic_prefix, property_name, frequency=0.5, amplitude=1.0, offset=0.0):
+    def __init__(self, broker_host, topic_prefix, property_name, frequency=0.5, amplitude=1.0, offset=0.0, port=1883):
         self.broker_host = broker_host
+        self.port = port
         self.topic_prefix = topic_prefix
         self.property_name = property_name
         self.frequency = frequency  # Hz
         self.amplitude = amplitude
         self.offset = offset
         self.running = False
-        
+
         # Ensure topic prefix ends with /
         if not self.topic_prefix.endswith('/'):
             self.topic_prefix += '/'
-        
+
         # Full topic path
         self.topic = f"{self.topic_prefix}{self.property_name}"
-        
+
         # Create MQTT client
         self.client = mqtt.Client()
         self.client.on_connect = self._on_connect
         self.client.on_disconnect = self._on_disconnect
-        
+
     def _on_connect(self, client, userdata, flags, rc):
         if rc == 0:
             print(f"[MQTT] Connected to broker at {self.broker_host}")
@@ -53,73 +113,73 @@ class SineWavePublisher:
         else:
             print(f"[MQTT] Failed to connect, return code {rc}")
             sys.exit(1)
-    
+
     def _on_disconnect(self, client, userdata, rc):
         if rc != 0:
             print(f"[MQTT] Unexpected disconnection (rc={rc})")
         else:
             print("[MQTT] Disconnected")
-    
+
     def connect(self):
         """Connect to the MQTT broker"""
         try:
-            self.client.connect(self.broker_host, 1883, 60)
+            self.client.connect(self.broker_host, self.port, 60)
             self.client.loop_start()
             # Wait a moment for connection to establish
             time.sleep(0.5)
         except Exception as e:
             print(f"[ERROR] Failed to connect to MQTT broker: {e}")
             sys.exit(1)
-    
+
     def publish_sine_wave(self, duration=None, update_rate=30):
         """
         Publish sine wave values continuously
-        
+
         Args:
             duration: How long to publish (in seconds). None = infinite
             update_rate: Updates per second (default: 30 Hz for smooth animation)
         """
         self.running = True
-        start_time = time.time()
-        period = 1.0 / self.frequency  # Period in seconds
-        
+        start_time = time.monotonic()
+        pacer = Pacer(update_rate)
+
         print(f"[INFO] Starting sine wave publisher")
         print(f"       Frequency: {self.frequency} Hz")
         print(f"       Amplitude: {self.amplitude}")
         print(f"       Offset: {self.offset}")
         print(f"       Update rate: {update_rate} Hz")
         print(f"       Press Ctrl+C to stop")
-        
+
         try:
             while self.running:
-                elapsed = time.time() - start_time
-                
+                elapsed = time.monotonic() - start_time
+
                 # Calculate sine wave value
                 # sin(2π * frequency * time)
                 sine_value = math.sin(2 * math.pi * self.frequency * elapsed)
-                
+
                 # Scale by amplitude and add offset
                 value = self.amplitude * sine_value + self.offset
-                
+
                 # Publish the value
                 self.client.publish(self.topic, str(value), qos=0)
-                
+
                 # Print value occasionally (every second)
                 if int(elapsed) != int(elapsed - 1.0/update_rate):
                     print(f"[{elapsed:.1f}s] Value: {value:.4f}")
-                
+
                 # Check if duration limit reached
                 if duration is not None and elapsed >= duration:
                     break
-                
-                # Sleep to maintain update rate
-                time.sleep(1.0 / update_rate)
-                
+
+                # Wait for the next update without drifting
+                pacer.wait()
+
         except KeyboardInterrupt:
             print("\n[INFO] Stopping publisher...")
         finally:
             self.stop()
-    
+
     def stop(self):
         """Stop publishing and disconnect"""
         self.running = False
@@ -128,6 +188,329 @@ class SineWavePublisher:
         print("[INFO] Publisher stopped")
 
 
+def percentiles(values):
+    ordered = sorted(values)
+    if not ordered:
+        return {"count": 0}
+    last = len(ordered) - 1
+    return {
+        "count": len(ordered),
+        "p50": ordered[int(last * 0.50)],
+        "p95": ordered[int(last * 0.95)],
+        "p99": ordered[int(last * 0.99)],
+        "max": ordered[-1],
+    }
+
+
+class LoadTopic:
+    """One generated topic with its own rate and sine phase"""
+
+    def __init__(self, index, name, rate, components):
+        self.index = index
+        self.name = name
+        self.rate = rate
+        self.components = components
+        self.phase = index * 0.37
+        self.deadline = 0.0
+        self.sent = 0
+
+
+class LoadGenerator:
+    """Drives many topics at once to stress-test a Blender instance.
+
+    Every topic publishes at its own rate on a shared monotonic schedule.
+    Payload shapes:
+        scalar  one number per message to <prefix><name>_<i>
+        vector  3 components as one JSON list to <prefix><name>_<i>,
+                for a vector input
+        array   --array-size components as one JSON list, for an array
+                input
+        With --split-components, vector and array components are sent
+        as separate messages to <prefix><name>_<i>/<k> instead, for an
+        input with topic "<name>_<i>/+" and a matching array size.
+        batch   one JSON object with the values of all topics per tick
+                to <prefix>batch, at --rate
+        batch-binary
+                one packed frame per tick to <prefix>batch, for the
+                batch layout announced in the addon's manifest
+
+    With --timestamps the values are sent as {"value": v, "ts": t}. If
+    "Latency Echo" is enabled in Blender, the echoed samples are used to
+    report the network, queue, apply and total latency distributions.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.topic_prefix = args.prefix
+        if not self.topic_prefix.endswith('/'):
+            self.topic_prefix += '/'
+        components = SHAPE_COMPONENTS.get(args.shape, args.array_size)
+        rates = args.rates or [args.rate]
+        self.topics = [LoadTopic(i, f"{args.name}_{i}", rates[i % len(rates)], components)
+                       for i in range(args.topics)]
+        # Batches send all topics in one message on a single schedule
+        self.batch = args.shape.startswith('batch')
+        self.scheduled = [LoadTopic(0, "batch", args.rate, 0)] if self.batch else self.topics
+        self.batch_layout = None
+        self.running = False
+
+        self.sent = 0
+        self.sent_values = 0
+        self.sent_bytes = 0
+        self.acked = 0
+        self.late = 0
+        self.broker_stats = {}
+        # stage -> recent latencies in seconds
+        self.latencies = {stage: deque(maxlen=LATENCY_WINDOW)
+                          for stage in ("network", "queue", "apply", "total", "round_trip")}
+        self.echoes = 0
+
+        self.client = mqtt.Client()
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_publish = self._on_publish
+        self.client.on_message = self._on_message
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc != 0:
+            print(f"[MQTT] Failed to connect, return code {rc}")
+            return
+        print(f"[MQTT] Connected to broker at {self.args.host}")
+        client.subscribe(self.topic_prefix + "$echo/#")
+        client.subscribe(self.topic_prefix + "manifest")
+        for topic in SYS_TOPICS:
+            client.subscribe(topic)
+
+    def _on_disconnect(self, client, userdata, rc):
+        if rc != 0:
+            print(f"[MQTT] Unexpected disconnection (rc={rc})")
+
+    def _on_publish(self, client, userdata, mid):
+        self.acked += 1
+
+    def _on_message(self, client, userdata, msg):
+        if msg.topic.startswith("$SYS/"):
+            self.broker_stats[msg.topic[len("$SYS/broker/"):]] = msg.payload.decode(errors="replace")
+            return
+        try:
+            echo = json.loads(msg.payload)
+        except ValueError:
+            return
+        if msg.topic == self.topic_prefix + "manifest":
+            layout = echo.get("batch")
+            if layout and (self.batch_layout is None or
+                           layout["layout_id"] != self.batch_layout["layout_id"]):
+                print(f"[MQTT] Batch layout {layout['layout_id']}: {len(layout['slots'])} slots")
+                self.batch_layout = layout
+            return
+        now = time.time()
+        self.echoes += 1
+        producer_ts = echo.get("producer_ts")
+        recv_ts = echo.get("recv_ts")
+        drain_ts = echo.get("drain_ts")
+        applied_ts = echo.get("applied_ts")
+        if None in (recv_ts, drain_ts, applied_ts):
+            return
+        self.latencies["queue"].append(drain_ts - recv_ts)
+        self.latencies["apply"].append(applied_ts - drain_ts)
+        if producer_ts is not None:
+            self.latencies["network"].append(recv_ts - producer_ts)
+            self.latencies["total"].append(applied_ts - producer_ts)
+            self.latencies["round_trip"].append(now - producer_ts)
+
+    def connect(self):
+        try:
+            self.client.connect(self.args.host, self.args.port, 60)
+        except Exception as e:
+            print(f"[ERROR] Failed to connect to MQTT broker: {e}")
+            sys.exit(1)
+        self.client.loop_start()
+        time.sleep(0.5)
+
+    def burst_factor(self, elapsed):
+        """Rate multiplier at a point of the run"""
+        args = self.args
+        if not args.burst_every or not args.burst_length:
+            return 1.0
+        if elapsed % args.burst_every < args.burst_length:
+            return args.burst_factor
+        return 1.0
+
+    def payload(self, value, ts):
+        if self.args.timestamps:
+            return json.dumps({"value": value, "ts": ts})
+        return json.dumps(value)
+
+    def send_batch(self, elapsed):
+        ts = time.time()
+        args = self.args
+        angle = 2 * math.pi * args.frequency * elapsed
+        if args.shape == 'batch':
+            values = {topic.name: args.amplitude * math.sin(angle + topic.phase) + args.offset
+                      for topic in self.topics}
+            payload = json.dumps({"ts": ts, "values": values} if args.timestamps else values)
+            count = len(values)
+        else:
+            layout = self.batch_layout
+            if layout is None:
+                # wait for the manifest
+                return
+            count = len(layout["slots"])
+            values = [args.amplitude * math.sin(angle + idx * 0.37) + args.offset
+                      for idx in range(count)]
+            payload = BATCH_HEADER.pack(b"BLMB", 1, 0, 0, layout["layout_id"], count,
+                                        ts if args.timestamps else 0.0) + \
+                struct.pack(f"<{count}f", *values)
+        self.client.publish(self.topic_prefix + "batch", payload, qos=args.qos)
+        self.sent += 1
+        self.sent_values += count
+        self.sent_bytes += len(payload)
+
+    def send(self, topic, elapsed):
+        if self.batch:
+            self.send_batch(elapsed)
+            return
+        ts = time.time()
+        base = self.topic_prefix + topic.name
+        args = self.args
+        angle = 2 * math.pi * args.frequency * elapsed + topic.phase
+        if topic.components and args.split_components:
+            messages = [(f"{base}/{k}", args.amplitude * math.sin(angle + k) + args.offset)
+                        for k in range(topic.components)]
+        elif topic.components:
+            messages = [(base, [args.amplitude * math.sin(angle + k) + args.offset
+                                for k in range(topic.components)])]
+        else:
+            messages = [(base, args.amplitude * math.sin(angle) + args.offset)]
+        for full_topic, value in messages:
+            payload = self.payload(value, ts)
+            self.client.publish(full_topic, payload, qos=self.args.qos)
+            self.sent += 1
+            self.sent_values += len(value) if isinstance(value, list) else 1
+            self.sent_bytes += len(payload)
+        topic.sent += 1
+
+    def run(self):
+        args = self.args
+        self.running = True
+        start = self.start = time.monotonic()
+        # (deadline, topic index), every topic starts at a different offset
+        # within its first period to avoid a thundering herd
+        schedule = []
+        scheduled = self.scheduled
+        for topic in scheduled:
+            topic.deadline = start + (topic.index / len(scheduled)) / topic.rate
+            schedule.append((topic.deadline, topic.index))
+        heapq.heapify(schedule)
+
+        per_tick = lambda topic: topic.components if args.split_components else 1
+        target = sum(topic.rate * max(per_tick(topic), 1) for topic in scheduled)
+        print(f"[INFO] Load generator: {len(self.topics)} topics, shape {args.shape}, "
+              f"target {target:.0f} msg/s")
+        if args.burst_every:
+            print(f"       Bursts: x{args.burst_factor} for {args.burst_length}s every {args.burst_every}s")
+        print(f"       Press Ctrl+C to stop")
+
+        next_report = start + args.report_interval
+        last_report = (start, 0)
+        try:
+            while self.running and schedule:
+                deadline, idx = schedule[0]
+                now = time.monotonic()
+                if deadline > now:
+                    # A slow send may have run past the report time
+                    time.sleep(max(0.0, min(deadline, next_report) - now))
+                    now = time.monotonic()
+                if now >= next_report:
+                    last_report = self.report(now, last_report)
+                    next_report += args.report_interval
+                    if args.duration is not None and now - start >= args.duration:
+                        break
+                    continue
+                if deadline > now:
+                    continue
+                topic = scheduled[idx]
+                elapsed = now - start
+                self.send(topic, elapsed)
+                # Advance from the deadline, not from now, so pacing does
+                # not drift. A topic that fell too far behind restarts.
+                period = 1.0 / (topic.rate * self.burst_factor(elapsed))
+                topic.deadline = deadline + period
+                if now - topic.deadline > MAX_LAG:
+                    self.late += 1
+                    topic.deadline = now + period
+                heapq.heapreplace(schedule, (topic.deadline, idx))
+        except KeyboardInterrupt:
+            print("\n[INFO] Stopping load generator...")
+        finally:
+            summary = self.summary(time.monotonic() - start)
+            self.stop()
+        return summary
+
+    def report(self, now, last_report):
+        last_time, last_sent = last_report
+        rate = (self.sent - last_sent) / max(now - last_time, 1e-9)
+        line = (f"[{now - self.start:.1f}s] sent {rate:8.0f} msg/s, "
+                f"client backlog {self.sent - self.acked}, late {self.late}")
+        stored = self.broker_stats.get("messages/stored")
+        if stored is not None:
+            line += f", broker stored {stored}"
+        total = self.latencies["total"]
+        if total:
+            stats = percentiles(total)
+            line += (f", latency p50 {stats['p50'] * 1000:.1f} ms"
+                     f" p99 {stats['p99'] * 1000:.1f} ms")
+        print(line)
+        return now, self.sent
+
+    def summary(self, elapsed):
+        return {
+            "topics": len(self.topics),
+            "shape": self.args.shape,
+            "duration": elapsed,
+            "sent": self.sent,
+            "sent_values": self.sent_values,
+            "sent_bytes": self.sent_bytes,
+            "send_rate": self.sent / max(elapsed, 1e-9),
+            "client_backlog": self.sent - self.acked,
+            "late": self.late,
+            "broker": dict(self.broker_stats),
+            "echoes": self.echoes,
+            "latency": {stage: percentiles(values)
+                        for stage, values in self.latencies.items()},
+        }
+
+    def stop(self):
+        self.running = False
+        self.client.loop_stop()
+        self.client.disconnect()
+        print("[INFO] Load generator stopped")
+
+
+def print_blender_setup(args):
+    """Print a script creating matching inputs, to paste into Blender's
+    Python console"""
+    components = SHAPE_COMPONENTS.get(args.shape, args.array_size)
+    print("import bpy")
+    print("scn = bpy.context.scene")
+    print(f"for i in range({args.topics}):")
+    print("    prop = scn.mqtt_inputs.add()")
+    if components and args.split_components:
+        print(f"    prop.array_size = {components}")
+        print(f"    prop.topic = '{args.name}_%d/+' % i")
+    elif args.shape == 'vector':
+        print("    prop.value_type = 'VECTOR'")
+        print(f"    prop.vector_size = {components}")
+    elif args.shape == 'array':
+        print("    prop.value_type = 'ARRAY'")
+        print(f"    prop.array_size = {components}")
+    print(f"    prop.property_name = '{args.name}_%d' % i")
+
+
+def parse_rates(text):
+    return [float(v) for v in text.split(",") if v]
+
+
 def main():
     # Configuration - edit these values as needed
     BROKER_HOST = '192.168.1.20'
@@ -138,22 +521,76 @@ def main():
     OFFSET = 0.0
     UPDATE_RATE = 60.0  # Hz
     DURATION = None  # None = infinite, or set to number of seconds
-    
-    # Create publisher
-    publisher = SineWavePublisher(
-        broker_host=BROKER_HOST,
-        topic_prefix=TOPIC_PREFIX,
-        property_name=PROPERTY_NAME,
-        frequency=FREQUENCY,
-        amplitude=AMPLITUDE,
-        offset=OFFSET
-    )
-    
-    # Connect and publish
-    publisher.connect()
-    publisher.publish_sine_wave(duration=DURATION, update_rate=UPDATE_RATE)
+
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=BROKER_HOST, help="MQTT broker host")
+    parser.add_argument("--port", type=int, default=1883, help="MQTT broker port")
+    parser.add_argument("--prefix", default=TOPIC_PREFIX, help="topic prefix")
+    parser.add_argument("--name", default=PROPERTY_NAME,
+                        help="property name, or the name stem of the generated topics")
+    parser.add_argument("--frequency", type=float, default=FREQUENCY, help="sine wave frequency in Hz")
+    parser.add_argument("--amplitude", type=float, default=AMPLITUDE)
+    parser.add_argument("--offset", type=float, default=OFFSET)
+    parser.add_argument("--rate", type=float, default=UPDATE_RATE, help="updates per second per topic")
+    parser.add_argument("--duration", type=float, default=DURATION, help="seconds to run (default: forever)")
+
+    load = parser.add_argument_group("load generator")
+    load.add_argument("--topics", type=int, default=0,
+                      help="number of topics to drive, enables the load generator")
+    load.add_argument("--rates", type=parse_rates,
+                      help="comma separated rates, assigned to the topics in turn")
+    load.add_argument("--shape", choices=("scalar", "vector", "array", "batch", "batch-binary"),
+                      default="scalar",
+                      help="payload shape (default: scalar)")
+    load.add_argument("--array-size", type=int, default=64,
+                      help="components per topic for the array shape (default: 64)")
+    load.add_argument("--split-components", action="store_true",
+                      help="send vector and array components as separate messages")
+    load.add_argument("--timestamps", action=argparse.BooleanOptionalAction, default=True,
+                      help="send JSON payloads with a producer timestamp (default: on)")
+    load.add_argument("--qos", type=int, choices=(0, 1, 2), default=0)
+    load.add_argument("--burst-every", type=float, default=0.0,
+                      help="start a burst every N seconds")
+    load.add_argument("--burst-length", type=float, default=1.0, help="burst length in seconds")
+    load.add_argument("--burst-factor", type=float, default=4.0,
+                      help="rate multiplier during bursts (default: 4)")
+    load.add_argument("--report-interval", type=float, default=1.0,
+                      help="seconds between progress reports (default: 1)")
+    load.add_argument("--output", help="write the final report as JSON to a file")
+    load.add_argument("--print-blender-setup", action="store_true",
+                      help="print a Blender script creating the matching inputs and exit")
+    args = parser.parse_args()
+
+    if args.print_blender_setup:
+        print_blender_setup(args)
+        return
+
+    if not args.topics:
+        # Create publisher
+        publisher = SineWavePublisher(
+            broker_host=args.host,
+            topic_prefix=args.prefix,
+            property_name=args.name,
+            frequency=args.frequency,
+            amplitude=args.amplitude,
+            offset=args.offset,
+            port=args.port
+        )
+
+        # Connect and publish
+        publisher.connect()
+        publisher.publish_sine_wave(duration=args.duration, update_rate=args.rate)
+        return
+
+    generator = LoadGenerator(args)
+    generator.connect()
+    summary = generator.run()
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
 
 
 if __name__ == '__main__':
     main()
-